@@ -0,0 +1,10 @@
+"""Drawing helpers shared by the ticket and invoice renderers"""
+from PIL import ImageFont
+
+
+def load_font(size):
+    """The default font at ``size``"""
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has no scalable default font
+        return ImageFont.load_default()
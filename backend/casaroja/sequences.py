@@ -0,0 +1,80 @@
+"""
+Document number sequences.
+
+``next_value(name)`` returns the next number of a named sequence in O(1),
+without counting rows and without two callers ever getting the same value.
+
+* PostgreSQL: a native sequence ``numberseq_<name>`` created with a
+  ``CACHE`` block, so each connection takes numbers from its own block
+  and ``nextval`` never waits for another transaction. Values are not
+  rolled back, so numbers may have gaps.
+* Other engines: one UPDATE on the ``NumberSequence`` row inside the
+  caller's transaction. SQLite serialises writers anyway, and a rollback
+  gives the number back.
+
+``create_sequence`` is meant for migrations, to start a sequence after the
+numbers already in use. The ``NumberSequence`` registry table lives in the
+payments app, where the first sequences were used.
+"""
+import re
+
+from django.db import IntegrityError, ProgrammingError, connection, transaction
+from django.db.models import F
+
+from payments.models import NumberSequence
+
+SEQUENCE_CACHE = 20
+NAME_PATTERN = re.compile(r'^[a-z][a-z0-9_]{0,39}$')
+
+
+def sequence_name(name):
+    if not NAME_PATTERN.match(name):
+        raise ValueError(f"Nombre de secuencia inválido: {name!r}")
+    return f"numberseq_{name}"
+
+
+def create_sequence(name, start=1, using=connection):
+    """Create the sequence ``name`` starting at ``start`` if it does not exist"""
+    if using.vendor == 'postgresql':
+        with using.cursor() as cursor:
+            cursor.execute(
+                f"CREATE SEQUENCE IF NOT EXISTS {sequence_name(name)} START WITH %s CACHE %s",
+                [start, SEQUENCE_CACHE],
+            )
+    NumberSequence.objects.using(using.alias).get_or_create(name=name, defaults={'next_value': start})
+
+
+def _postgres_next(name):
+    sequence = sequence_name(name)
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [sequence])
+            return cursor.fetchone()[0]
+    except ProgrammingError:
+        # First use of a sequence no migration created
+        create_sequence(name)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [sequence])
+            return cursor.fetchone()[0]
+
+
+def _table_next(name):
+    with transaction.atomic():
+        sequences = NumberSequence.objects.filter(name=name)
+        if not sequences.update(next_value=F('next_value') + 1):
+            try:
+                with transaction.atomic():
+                    NumberSequence.objects.create(name=name, next_value=2)
+                return 1
+            except IntegrityError:
+                sequences.update(next_value=F('next_value') + 1)
+        # The UPDATE holds the row lock, so this read sees our own increment
+        return sequences.values_list('next_value', flat=True).get() - 1
+
+
+def next_value(name):
+    """The next number of the sequence ``name``"""
+    sequence_name(name)
+    if connection.vendor == 'postgresql':
+        return _postgres_next(name)
+    return _table_next(name)
@@ -78,6 +78,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'casaroja.wsgi.application'
+ASGI_APPLICATION = 'casaroja.asgi.application'
 
 # Database
 DATABASES = {
@@ -138,6 +139,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_THROTTLE_RATES': {
+        'payment_webhooks': config('PAYMENT_WEBHOOK_THROTTLE', default='3000/min'),
+    },
 }
 
 # JWT Settings
@@ -170,6 +174,42 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
 }
 
+# Payment gateways: payment_type -> client class. Unlisted types use the
+# deterministic simulators in payments.gateways.
+PAYMENT_GATEWAYS = {}
+PAYMENT_GATEWAY_TIMEOUT = config('PAYMENT_GATEWAY_TIMEOUT', default=10, cast=int)  # seconds
+PAYMENT_GATEWAY_WORKERS = config('PAYMENT_GATEWAY_WORKERS', default=16, cast=int)
+PAYMENT_WEBHOOK_PARTITIONS = 8  # Workers lease partitions, one worker per partition at a time
+PLATFORM_COMMISSION_PERCENTAGE = config('PLATFORM_COMMISSION_PERCENTAGE', default='15.00')
+
+# Electronic invoices (DTE)
+DTE_ISSUER_RUT = config('DTE_ISSUER_RUT', default='76000000-0')
+DTE_ISSUER_NAME = config('DTE_ISSUER_NAME', default='Casa Roja SpA')
+DTE_SIGNER = config('DTE_SIGNER', default='payments.dte.LocalSigner')
+DTE_SIGNING_KEY = config('DTE_SIGNING_KEY', default='casaroja-dte-development-key')
+
+# Chat gateway: chat.pubsub.LocalBackend for a single process,
+# chat.pubsub.RedisBackend to fan out across processes
+CHAT_PUBSUB_BACKEND = config('CHAT_PUBSUB_BACKEND', default='chat.pubsub.LocalBackend')
+CHAT_PUBSUB_URL = config('CHAT_PUBSUB_URL', default='redis://localhost:6379/1')
+
+CHAT_ARCHIVE_AFTER_DAYS = config('CHAT_ARCHIVE_AFTER_DAYS', default=30, cast=int)  # after the event ends
+CHAT_ATTACHMENT_MAX_SIZE = config('CHAT_ATTACHMENT_MAX_SIZE', default=25 * 1024 * 1024, cast=int)  # bytes
+
+# Notification digests (chat.notifications). The senders default to local
+# stand-ins in chat.delivery; rates are sends per second per channel.
+NOTIFICATION_DIGEST_WINDOW = config('NOTIFICATION_DIGEST_WINDOW', default=300, cast=int)  # seconds
+NOTIFICATION_EMAIL_SENDER = config('NOTIFICATION_EMAIL_SENDER', default='chat.delivery.LocalEmailSender')
+NOTIFICATION_PUSH_SENDER = config('NOTIFICATION_PUSH_SENDER', default='chat.delivery.LocalPushSender')
+NOTIFICATION_EMAIL_RATE = config('NOTIFICATION_EMAIL_RATE', default=50, cast=int)
+NOTIFICATION_PUSH_RATE = config('NOTIFICATION_PUSH_RATE', default=200, cast=int)
+
+# Support desk (chat.support): SLA per priority in minutes, optionally
+# overridden per category, e.g. {'billing': {'normal': 240}}
+SUPPORT_SLA_MINUTES = {'urgent': 30, 'high': 120, 'normal': 480, 'low': 1440}
+SUPPORT_CATEGORY_SLA_MINUTES = {}
+SUPPORT_LOAD_REFRESH = config('SUPPORT_LOAD_REFRESH', default=30, cast=int)  # seconds
+
 # Cache
 CACHES = {
     'default': {
@@ -0,0 +1,62 @@
+import threading
+import time
+from unittest import skipIf
+
+from django.db import OperationalError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase
+
+from payments.models import NumberSequence
+from .sequences import create_sequence, next_value
+
+
+class SequenceTests(TestCase):
+    def test_values_follow_each_other(self):
+        self.assertEqual([next_value('folio') for _ in range(3)], [1, 2, 3])
+        self.assertEqual(next_value('otro'), 1)
+
+    @skipIf(connection.vendor == 'postgresql', 'native sequences may leave gaps')
+    def test_rolled_back_value_is_given_again(self):
+        create_sequence('folio', start=41)
+        self.assertEqual(next_value('folio'), 41)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.assertEqual(next_value('folio'), 42)
+            raise RuntimeError
+        self.assertEqual(next_value('folio'), 42)
+        self.assertEqual(NumberSequence.objects.get(name='folio').next_value, 43)
+
+    def test_invalid_name_is_rejected(self):
+        with self.assertRaises(ValueError):
+            next_value('folio; DROP TABLE x')
+
+
+class ConcurrentSequenceTests(TransactionTestCase):
+    def test_concurrent_callers_never_share_a_value(self):
+        values = []
+        errors = []
+
+        def allocate():
+            try:
+                for _ in range(10):
+                    while True:
+                        try:
+                            values.append(next_value('folio'))
+                            break
+                        except OperationalError:
+                            # SQLite lets one writer through at a time
+                            time.sleep(0.001)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=allocate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(values)), 40)
+        # Native sequences hand each connection its own block; only the table is gap-free
+        if connection.vendor != 'postgresql':
+            self.assertEqual(sorted(values), list(range(1, 41)))
@@ -0,0 +1,274 @@
+"""
+Chat archival.
+
+Rooms with ``auto_close_after_event`` are closed (``is_active=False``)
+once their event has ended, and after ``CHAT_ARCHIVE_AFTER_DAYS`` more
+their messages move out of ``chat_chatmessage`` into archive segments:
+gzip-compressed JSON-lines files of up to ``segment_size`` messages, one
+``ChatArchiveSegment`` row each. Every line is the message exactly as the
+history API serializes it, so archived rooms are served read-only through
+the same endpoint (``history_page``) without touching the live table.
+
+Archiving a room writes all its segments first, then sets
+``ChatRoom.archived_at`` (readers switch to the archive) and finally
+deletes the live rows in chunks. Each step can be re-run after a crash.
+Archived messages are no longer searchable and their mentions are dropped;
+notifications keep their text but lose the link to the message.
+
+Reading keeps a small index per segment in a bounded cache instead of
+the segment itself: where each line starts in the decompressed file, its
+seq, and the message ids sorted for binary search. A page bisects the
+segments by position and the lines by seq, then decodes only its own lines.
+"""
+import gzip
+import json
+import tempfile
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .history import DEFAULT_LIMIT, MAX_LIMIT, MessageNotFound
+from .models import ChatArchiveSegment, ChatMessage, ChatNotification, ChatRoom
+from .reads import number_messages
+from .serializers import HistoryMessageSerializer
+
+DEFAULT_SEGMENT_SIZE = 5000
+DEFAULT_CHUNK_SIZE = 1000
+SEGMENT_INDEX_CACHE = 128  # segment indexes kept in memory, about 30 bytes per message
+
+
+def close_rooms(now=None):
+    """Close the rooms of events that have ended. Returns how many were closed."""
+    now = now or timezone.now()
+    return ChatRoom.objects.filter(
+        is_active=True, auto_close_after_event=True, event__end_datetime__lte=now
+    ).update(is_active=False, updated_at=now)
+
+
+def archivable_rooms(now=None, after=None):
+    now = now or timezone.now()
+    if after is None:
+        after = timedelta(days=getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 30))
+    return ChatRoom.objects.filter(
+        is_active=False, auto_close_after_event=True, archived_at__isnull=True,
+        event__end_datetime__lte=now - after,
+    )
+
+
+def segment_path(room, first_seq, last_seq):
+    return f"chat/archive/{room.room_id}/{first_seq:010d}-{last_seq:010d}.jsonl.gz"
+
+
+def _write_segment(room, messages):
+    rows = HistoryMessageSerializer(messages, many=True).data
+    with tempfile.TemporaryFile() as buffer:
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as compressed:
+            for row in rows:
+                compressed.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False).encode())
+                compressed.write(b'\n')
+        size = buffer.tell()
+        buffer.seek(0)
+        path = segment_path(room, messages[0].seq, messages[-1].seq)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        path = default_storage.save(path, File(buffer))
+    segment = ChatArchiveSegment(
+        chat_room=room,
+        first_seq=messages[0].seq,
+        last_seq=messages[-1].seq,
+        message_count=len(messages),
+        first_created_at=messages[0].created_at,
+        last_created_at=messages[-1].created_at,
+        size=size,
+    )
+    segment.file.name = path
+    segment.save()
+    return segment
+
+
+def archive_room(room, segment_size=DEFAULT_SEGMENT_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Move all of ``room``'s messages into archive segments. Returns the number moved."""
+    number_messages([room.pk], chunk_size)
+    last_seq = room.archive_segments.aggregate(last=Max('last_seq'))['last'] or 0
+    messages = (
+        ChatMessage.objects.filter(chat_room=room)
+        .select_related('chat_room', 'sender', 'attachment', 'reply_to__sender')
+        .order_by('seq')
+    )
+    while True:
+        batch = list(messages.filter(seq__gt=last_seq)[:segment_size])
+        if not batch:
+            break
+        last_seq = _write_segment(room, batch).last_seq
+
+    with transaction.atomic():
+        ChatRoom.objects.filter(pk=room.pk).update(archived_at=timezone.now())
+        ChatNotification.objects.filter(chat_message__chat_room=room).update(chat_message=None)
+    room.archived_at = timezone.now()
+    return purge_archived(room, chunk_size)
+
+
+def purge_archived(room, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Delete the live rows of an archived room that are already in its segments"""
+    last_seq = room.archive_segments.aggregate(last=Max('last_seq'))['last'] or 0
+    archived = ChatMessage.objects.filter(chat_room=room, seq__lte=last_seq)
+    deleted = 0
+    while True:
+        # Newest first, so replies go before the messages they point to
+        ids = list(archived.order_by('-seq').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            ChatMessage.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+    return deleted
+
+
+def archive_rooms(rooms=None, segment_size=DEFAULT_SEGMENT_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                  progress=None):
+    """
+    Archive ``rooms`` (default: every closed room past the archive delay)
+    and finish purging rooms a previous run left half done. ``progress`` is
+    called as ``progress(done, total)``. Returns the number of messages moved.
+    """
+    if rooms is None:
+        rooms = archivable_rooms()
+    leftovers = ChatRoom.objects.filter(archived_at__isnull=False, messages__isnull=False).distinct()
+    moved = sum(purge_archived(room, chunk_size) for room in leftovers)
+
+    rooms = list(rooms.order_by('pk'))
+    for done, room in enumerate(rooms, start=1):
+        moved += archive_room(room, segment_size, chunk_size)
+        if progress:
+            progress(done, len(rooms))
+    return moved
+
+
+class _SegmentIndex:
+    """
+    Line offsets and seqs of one segment, plus its message ids sorted
+    (as 16-byte keys) next to their seqs for binary search
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = array('Q')
+        self.seqs = array('Q')
+        keys = []
+        offset = 0
+        with default_storage.open(path, 'rb') as stored, gzip.GzipFile(fileobj=stored) as lines:
+            for line in lines:
+                row = json.loads(line)
+                self.offsets.append(offset)
+                self.seqs.append(row['seq'])
+                keys.append((uuid.UUID(row['message_id']).bytes, row['seq']))
+                offset += len(line)
+        self.offsets.append(offset)
+        keys.sort()
+        self.keys = b''.join(key for key, _ in keys)
+        self.key_seqs = array('Q', (seq for _, seq in keys))
+
+    def seq_of(self, message_id):
+        """The seq of ``message_id`` (a UUID), or ``None`` if it isn't in the segment"""
+        key = message_id.bytes
+        low, high = 0, len(self.key_seqs)
+        while low < high:
+            middle = (low + high) // 2
+            if self.keys[middle * 16:middle * 16 + 16] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.key_seqs) and self.keys[low * 16:low * 16 + 16] == key:
+            return self.key_seqs[low]
+        return None
+
+    def rows(self, start, end):
+        """Decode lines ``start`` to ``end`` only"""
+        with default_storage.open(self.path, 'rb') as stored, gzip.GzipFile(fileobj=stored) as lines:
+            lines.seek(self.offsets[start])
+            data = lines.read(self.offsets[end] - self.offsets[start])
+        return [json.loads(line) for line in data.splitlines()]
+
+
+@lru_cache(maxsize=SEGMENT_INDEX_CACHE)
+def _segment_index(path, size):
+    # ``size`` tells apart a segment rewritten under the same path
+    return _SegmentIndex(path)
+
+
+class _Archive:
+    """The archived messages of a room as one sequence, decompressing segments on demand"""
+
+    def __init__(self, room):
+        self.segments = list(room.archive_segments.order_by('first_seq'))
+        self.first_seqs = [segment.first_seq for segment in self.segments]
+        self.starts = []
+        total = 0
+        for segment in self.segments:
+            self.starts.append(total)
+            total += segment.message_count
+        self.total = total
+
+    def index(self, number):
+        segment = self.segments[number]
+        return _segment_index(segment.file.name, segment.size)
+
+    def rows(self, start, end):
+        rows = []
+        number = max(bisect_right(self.starts, start) - 1, 0)
+        while number < len(self.segments) and self.starts[number] < end:
+            offset = self.starts[number]
+            count = self.segments[number].message_count
+            rows.extend(self.index(number).rows(max(start - offset, 0), min(end - offset, count)))
+            number += 1
+        return rows
+
+    def position(self, message_id):
+        try:
+            message_id = uuid.UUID(str(message_id))
+        except ValueError:
+            raise MessageNotFound(message_id)
+        # Cursors are usually recent, so the newest segments are tried first
+        for number in reversed(range(len(self.segments))):
+            seq = self.index(number).seq_of(message_id)
+            if seq is not None:
+                return self.position_of_seq(seq)
+        raise MessageNotFound(message_id)
+
+    def position_of_seq(self, seq):
+        number = bisect_right(self.first_seqs, seq) - 1
+        return self.starts[number] + bisect_left(self.index(number).seqs, seq)
+
+
+def history_page(room, before=None, after=None, around=None, limit=DEFAULT_LIMIT):
+    """
+    ``chat.history.history_page`` for an archived room, returning rows that
+    are already serialized
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    archive = _Archive(room)
+
+    if after:
+        start = archive.position(after) + 1
+        end = min(start + limit, archive.total)
+        return archive.rows(start, end), True, end < archive.total
+
+    if around:
+        position = archive.position(around)
+        start = max(position - limit // 2, 0)
+        end = min(start + limit, archive.total)
+        return archive.rows(start, end), start > 0, end < archive.total
+
+    end = archive.position(before) if before else archive.total
+    start = max(end - limit, 0)
+    return archive.rows(start, end), start > 0, bool(before)
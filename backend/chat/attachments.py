@@ -0,0 +1,255 @@
+"""
+Chat attachment pipeline.
+
+``store_upload`` reads an upload chunk by chunk to get its size and
+SHA-256, then streams it to storage under its hash. The content type is
+taken from the first bytes, never from what the client declared, so only
+real JPEG, PNG, GIF and WebP files are treated as images. Django spools
+uploads over ``FILE_UPLOAD_MAX_MEMORY_SIZE`` to a temporary file, so no
+step holds the whole file in memory. Every upload gets its own
+``ChatAttachment`` owned by the uploader, but content that was uploaded
+before is not stored again: the new row points at the same file, and at
+its thumbnail if it already has one.
+
+Images are stored as ``pending``. ``process_attachments`` (the
+``process_chat_attachments`` job) makes a JPEG thumbnail and a blurhash
+placeholder for them in a process pool. Other files are ready
+immediately. Messages serve the thumbnail by default and keep the
+original one link away.
+"""
+import hashlib
+import math
+import mimetypes
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ChatAttachment
+
+DEFAULT_WORKERS = 4
+DEFAULT_CHUNK_SIZE = 100
+THUMBNAIL_SIZE = (320, 320)
+BLURHASH_COMPONENTS = (4, 3)
+# Leading bytes of the image formats thumbnails are made for
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+# Types a browser would render or run; files named like them are plain downloads
+ACTIVE_CONTENT_TYPES = {
+    'text/html', 'application/xhtml+xml', 'image/svg+xml', 'text/xml', 'application/xml',
+    'text/javascript', 'application/javascript',
+}
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+class AttachmentError(Exception):
+    """The upload can't be accepted"""
+
+
+def max_size():
+    return getattr(settings, 'CHAT_ATTACHMENT_MAX_SIZE', 25 * 1024 * 1024)
+
+
+def attachment_path(digest, content_type):
+    # The extension follows the sniffed type so storage never serves an upload as something else
+    extension = mimetypes.guess_extension(content_type) or '.bin'
+    return f"chat/attachments/{digest[:2]}/{digest}{extension}"
+
+
+def thumbnail_path(digest):
+    return f"chat/thumbnails/{digest[:2]}/{digest}.jpg"
+
+
+def sniff_content_type(head, file_name):
+    """Content type of a file from its first bytes, falling back to its name for non-images"""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    guessed = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    if guessed.startswith('image/') or guessed in ACTIVE_CONTENT_TYPES:
+        return 'application/octet-stream'
+    return guessed
+
+
+def store_upload(upload, user=None):
+    """Store ``upload`` (an ``UploadedFile``) for ``user`` and return its attachment"""
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    for chunk in upload.chunks():
+        if len(head) < 16:
+            head += chunk[:16 - len(head)]
+        size += len(chunk)
+        if size > max_size():
+            raise AttachmentError(f"El archivo supera el máximo de {max_size() // (1024 * 1024)} MB")
+        digest.update(chunk)
+    if not size:
+        raise AttachmentError('El archivo está vacío')
+    digest = digest.hexdigest()
+
+    file_name = os.path.basename(upload.name or '')[:255]
+    attachment = ChatAttachment(
+        sha256=digest,
+        size=size,
+        content_type=sniff_content_type(head, file_name),
+        file_name=file_name,
+        uploaded_by=user,
+    )
+
+    same_content = ChatAttachment.objects.filter(sha256=digest)
+    existing = same_content.filter(status='ready').first() or same_content.first()
+    if existing is not None:
+        attachment.file.name = existing.file.name
+        if existing.status == 'ready' and attachment.is_image == existing.is_image:
+            attachment.thumbnail.name = existing.thumbnail.name
+            attachment.width = existing.width
+            attachment.height = existing.height
+            attachment.blurhash = existing.blurhash
+            attachment.status = 'ready'
+            attachment.processed_at = existing.processed_at
+    else:
+        path = attachment_path(digest, attachment.content_type)
+        if not default_storage.exists(path):
+            upload.seek(0)
+            path = default_storage.save(path, upload)
+        attachment.file.name = path
+
+    if not attachment.is_image:
+        attachment.status = 'ready'
+        attachment.processed_at = attachment.processed_at or timezone.now()
+    attachment.save()
+    return attachment
+
+
+def _base83(value, length):
+    return ''.join(BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _linear(value):
+    value = value / 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(image, components=BLURHASH_COMPONENTS):
+    """Encode ``image`` as a blurhash string (https://blurha.sh), from a 32px copy"""
+    small = image.convert('RGB')
+    small.thumbnail((32, 32))
+    width, height = small.size
+    pixels = [tuple(_linear(channel) for channel in pixel) for pixel in small.getdata()]
+    x_components, y_components = components
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            norm = 1 if i == j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                cos_y = math.cos(math.pi * j * y / height)
+                row = y * width
+                for x in range(width):
+                    basis = norm * math.cos(math.pi * i * x / width) * cos_y
+                    pr, pg, pb = pixels[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised = max(0, min(82, int(math.floor(max(abs(c) for f in ac for c in f) * 166 - 0.5))))
+        maximum = (quantised + 1) / 166
+    else:
+        quantised, maximum = 0, 1
+    result += _base83(quantised, 1)
+    result += _base83((_srgb(dc[0]) << 16) + (_srgb(dc[1]) << 8) + _srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (
+            max(0, min(18, int(math.floor(math.copysign(abs(c / maximum) ** 0.5, c) * 9 + 9.5))))
+            for c in factor
+        )
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def _process_image(job):
+    """Runs in a worker process: thumbnail bytes, size and blurhash of one image"""
+    pk, path = job
+    try:
+        with default_storage.open(path, 'rb') as source:
+            image = Image.open(source)
+            image.draft('RGB', (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))  # cheap JPEG downscale
+            image = ImageOps.exif_transpose(image)
+            width, height = image.size
+            image.thumbnail(THUMBNAIL_SIZE)
+            thumbnail = image.convert('RGB')
+        buffer = BytesIO()
+        thumbnail.save(buffer, format='JPEG', quality=80, optimize=True)
+        return pk, {'thumbnail': buffer.getvalue(), 'width': width, 'height': height,
+                    'blurhash': blurhash(thumbnail)}
+    except Exception as exc:  # unreadable or hostile images fail alone
+        return pk, {'error': str(exc)}
+
+
+def process_attachments(attachments=None, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE,
+                        progress=None):
+    """
+    Make thumbnails and blurhashes for pending images. ``progress`` is
+    called as ``progress(done, total)``. Returns the number processed.
+    """
+    if attachments is None:
+        attachments = ChatAttachment.objects.all()
+    pending = attachments.filter(status='pending')
+    total = pending.count()
+    done = 0
+    last_pk = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            chunk = list(pending.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            by_pk = {attachment.pk: attachment for attachment in chunk}
+            now = timezone.now()
+            for pk, result in pool.map(_process_image, [(a.pk, a.file.name) for a in chunk]):
+                attachment = by_pk[pk]
+                attachment.processed_at = now
+                if 'error' in result:
+                    attachment.status = 'failed'
+                    continue
+                path = thumbnail_path(attachment.sha256)
+                if not default_storage.exists(path):
+                    path = default_storage.save(path, ContentFile(result['thumbnail']))
+                attachment.thumbnail.name = path
+                attachment.width = result['width']
+                attachment.height = result['height']
+                attachment.blurhash = result['blurhash']
+                attachment.status = 'ready'
+            ChatAttachment.objects.bulk_update(
+                chunk, ['thumbnail', 'width', 'height', 'blurhash', 'status', 'processed_at']
+            )
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+
+    return done
@@ -0,0 +1,152 @@
+"""
+WebSocket chat gateway.
+
+One connection per client, multiplexing any number of rooms. Clients send
+JSON frames:
+
+* ``{"type": "subscribe", "room_id": ...}`` / ``{"type": "unsubscribe", ...}``
+* ``{"type": "message", "room_id": ..., "content": ..., "reply_to": ..., "attachment_id": ..., "client_id": ...}``
+  (``attachment_id`` comes from uploading to ``/api/chat/rooms/<room_id>/attachments/``)
+* ``{"type": "read", "room_id": ..., "message_id": ...}`` (default: latest message)
+* ``{"type": "ping"}``
+
+and receive ``subscribed``, ``unsubscribed``, ``ack`` (with the stored
+``message_id``), ``message``, ``read`` (someone's new read position),
+``pong`` and ``error`` frames. Idle connections hold no tasks or queries,
+only a set of room ids.
+"""
+import json
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+
+from .messaging import ChatError, active_participant, message_event, parse_id, post_message
+from .models import ChatMessage
+from .pubsub import get_broker
+from .reads import mark_read
+
+MAX_ROOMS_PER_CONNECTION = 200
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+
+    async def connect(self):
+        self.rooms = set()
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.user = user
+        await self.accept()
+
+    async def disconnect(self, code):
+        broker = get_broker()
+        for room_id in self.rooms:
+            await broker.unsubscribe(room_id, self)
+        self.rooms = set()
+
+    async def receive_json(self, content, **kwargs):
+        handler = {
+            'subscribe': self.subscribe,
+            'unsubscribe': self.unsubscribe,
+            'message': self.message,
+            'read': self.read,
+            'ping': self.ping,
+        }.get(content.get('type') if isinstance(content, dict) else None)
+        if handler is None:
+            await self.error('Tipo de mensaje desconocido')
+            return
+        try:
+            await handler(content)
+        except ChatError as exc:
+            await self.error(str(exc), content)
+        except (ValidationError, ObjectDoesNotExist):
+            # A bad id in a frame must not close the connection
+            await self.error('Solicitud inválida', content)
+
+    async def deliver(self, text):
+        """Called by the broker with an already encoded frame"""
+        await self.send(text_data=text)
+
+    async def error(self, message, content=None):
+        frame = {'type': 'error', 'error': message}
+        if content and content.get('client_id'):
+            frame['client_id'] = content['client_id']
+        await self.send_json(frame)
+
+    def room_id(self, content):
+        return self.uuid(content, 'room_id')
+
+    def uuid(self, content, key):
+        return str(parse_id(content.get(key), key))
+
+    async def subscribe(self, content):
+        room_id = self.room_id(content)
+        if room_id not in self.rooms:
+            if len(self.rooms) >= MAX_ROOMS_PER_CONNECTION:
+                raise ChatError('Demasiadas salas en esta conexión')
+            participant = await database_sync_to_async(active_participant)(room_id, self.user)
+            if participant is None:
+                raise ChatError('No participas en este chat')
+            self.rooms.add(room_id)
+            await get_broker().subscribe(room_id, self)
+        await self.send_json({'type': 'subscribed', 'room_id': room_id})
+
+    async def unsubscribe(self, content):
+        room_id = self.room_id(content)
+        if room_id in self.rooms:
+            self.rooms.discard(room_id)
+            await get_broker().unsubscribe(room_id, self)
+        await self.send_json({'type': 'unsubscribed', 'room_id': room_id})
+
+    async def message(self, content):
+        room_id = self.room_id(content)
+        message_id, text = await database_sync_to_async(self.store_message)(room_id, content)
+        await self.send_json({
+            'type': 'ack',
+            'client_id': content.get('client_id'),
+            'message_id': str(message_id),
+        })
+        await get_broker().publish(room_id, text)
+
+    def store_message(self, room_id, content):
+        participant = active_participant(room_id, self.user)
+        if participant is None:
+            raise ChatError('No participas en este chat')
+        attachment = self.uuid(content, 'attachment_id') if content.get('attachment_id') else None
+        message = post_message(
+            participant, content.get('content'), reply_to=content.get('reply_to'), attachment=attachment
+        )
+        return message.message_id, message_event(message)
+
+    async def read(self, content):
+        room_id = self.room_id(content)
+        text = await database_sync_to_async(self.store_read)(room_id, content)
+        if text:
+            await get_broker().publish(room_id, text)
+
+    def store_read(self, room_id, content):
+        participant = active_participant(room_id, self.user)
+        if participant is None:
+            raise ChatError('No participas en este chat')
+        message = None
+        if content.get('message_id'):
+            message = ChatMessage.objects.filter(
+                chat_room=participant.chat_room,
+                message_id=self.uuid(content, 'message_id'),
+                seq__isnull=False,
+            ).only('seq', 'created_at', 'message_id').first()
+            if message is None:
+                raise ChatError('El mensaje no existe en este chat')
+        if not mark_read(participant, message):
+            return None
+        return json.dumps({
+            'type': 'read',
+            'room_id': room_id,
+            'user': self.user.pk,
+            'seq': participant.last_read_seq,
+        })
+
+    async def ping(self, content):
+        await self.send_json({'type': 'pong'})
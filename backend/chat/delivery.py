@@ -0,0 +1,100 @@
+"""
+Notification delivery channels.
+
+Email and push senders are chosen with the ``NOTIFICATION_EMAIL_SENDER``
+and ``NOTIFICATION_PUSH_SENDER`` settings. The defaults are local
+stand-ins that record what would have been sent, so development and tests
+never reach a real provider. Each channel is called from a bounded thread
+pool behind a ``RateLimiter`` shared by the pool's threads.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class DeliveryError(Exception):
+    """Raised when a channel fails to deliver a digest"""
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` calls per second (0: unlimited), safe across threads"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Sender:
+    """Interface for a delivery channel"""
+    channel = None
+
+    def send(self, user, subject, body):
+        raise NotImplementedError
+
+
+class LocalSender(Sender):
+    """
+    Local stand-in: keeps the last deliveries in ``outbox`` and waits
+    ``NOTIFICATION_SIMULATOR_LATENCY`` seconds per call, like a provider would.
+    """
+    outbox_size = 1000
+
+    def __init__(self):
+        self.outbox = []
+        self.lock = threading.Lock()
+
+    def send(self, user, subject, body):
+        latency = getattr(settings, 'NOTIFICATION_SIMULATOR_LATENCY', 0)
+        if latency:
+            time.sleep(latency)
+        with self.lock:
+            self.outbox.append((user.pk, subject, body))
+            del self.outbox[:-self.outbox_size]
+        return True
+
+
+class LocalEmailSender(LocalSender):
+    channel = 'email'
+
+    def send(self, user, subject, body):
+        if not user.email:
+            return False
+        return super().send(user, subject, body)
+
+
+class LocalPushSender(LocalSender):
+    channel = 'push'
+
+
+_senders = {}
+
+
+def get_sender(channel):
+    """The configured sender for ``'email'`` or ``'push'``, one instance per process"""
+    if channel not in _senders:
+        defaults = {
+            'email': 'chat.delivery.LocalEmailSender',
+            'push': 'chat.delivery.LocalPushSender',
+        }
+        path = getattr(settings, f"NOTIFICATION_{channel.upper()}_SENDER", defaults[channel])
+        _senders[channel] = import_string(path)()
+    return _senders[channel]
@@ -0,0 +1,76 @@
+"""
+Chat history, paged by keyset on ``(chat_room, created_at, id)``.
+
+Every page is an index range scan of ``limit + 1`` rows on the
+``chatmessage_room_created`` index, so the first page of a room with a
+million messages costs the same as one with ten. Cursors are message ids:
+``before``/``after`` page backwards/forwards from a message and ``around``
+jumps to a message with context on both sides. Senders and replied-to
+messages are joined into the same query.
+"""
+from django.db.models import Q
+
+from .models import ChatMessage
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class MessageNotFound(Exception):
+    """The cursor message does not belong to the room"""
+
+
+def _messages(room):
+    return ChatMessage.objects.filter(chat_room=room).select_related(
+        'chat_room', 'sender', 'attachment', 'reply_to__sender'
+    )
+
+
+def _older(room, anchor, limit, inclusive=False):
+    """Up to ``limit`` messages before ``anchor`` (newest first) and whether more exist"""
+    if inclusive:
+        same_moment = Q(created_at=anchor.created_at, id__lte=anchor.id)
+    else:
+        same_moment = Q(created_at=anchor.created_at, id__lt=anchor.id)
+    condition = Q(created_at__lt=anchor.created_at) | same_moment
+    rows = list(_messages(room).filter(condition).order_by('-created_at', '-id')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def _newer(room, anchor, limit):
+    """Up to ``limit`` messages after ``anchor`` (oldest first) and whether more exist"""
+    condition = Q(created_at__gt=anchor.created_at) | Q(created_at=anchor.created_at, id__gt=anchor.id)
+    rows = list(_messages(room).filter(condition).order_by('created_at', 'id')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def _anchor(room, message_id):
+    anchor = ChatMessage.objects.filter(chat_room=room, message_id=message_id).only('id', 'created_at').first()
+    if anchor is None:
+        raise MessageNotFound(message_id)
+    return anchor
+
+
+def history_page(room, before=None, after=None, around=None, limit=DEFAULT_LIMIT):
+    """
+    Return ``(messages, has_before, has_after)`` with ``messages`` in
+    chronological order. Without a cursor the newest page is returned.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    if after:
+        messages, has_after = _newer(room, _anchor(room, after), limit)
+        return messages, True, has_after
+
+    if around:
+        anchor = _anchor(room, around)
+        older, has_before = _older(room, anchor, limit // 2 + 1, inclusive=True)
+        newer, has_after = _newer(room, anchor, limit - len(older))
+        return older[::-1] + newer, has_before, has_after
+
+    if before:
+        older, has_before = _older(room, _anchor(room, before), limit)
+        return older[::-1], has_before, True
+
+    latest = list(_messages(room).order_by('-created_at', '-id')[:limit + 1])
+    return latest[:limit][::-1], len(latest) > limit, False
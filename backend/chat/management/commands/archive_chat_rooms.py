@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.archive import (
+    DEFAULT_CHUNK_SIZE, DEFAULT_SEGMENT_SIZE, archivable_rooms, archive_rooms, close_rooms
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Close the chat rooms of events that have ended and move the messages '
+        'of rooms closed for long enough into compressed archive segments. Safe to re-run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--after-days', type=int, default=getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 30),
+            help='Archive rooms whose event ended at least this many days ago'
+        )
+        parser.add_argument('--segment-size', type=int, default=DEFAULT_SEGMENT_SIZE,
+                            help='Messages per archive segment')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        rooms = archivable_rooms(after=timedelta(days=options['after_days']))
+        if options['dry_run']:
+            self.stdout.write(f"{rooms.count()} salas por archivar")
+            return
+
+        closed = close_rooms()
+        self.stdout.write(f"{closed} salas cerradas")
+
+        def progress(done, total):
+            self.stdout.write(f"{done}/{total} salas")
+
+        moved = archive_rooms(
+            rooms, segment_size=options['segment_size'], chunk_size=options['chunk_size'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f"{moved} mensajes archivados"))
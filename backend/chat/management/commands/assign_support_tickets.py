@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import SupportTicket
+from chat.support import auto_assign, queue
+
+
+class Command(BaseCommand):
+    help = (
+        'Assign queued support tickets, most overdue first, to the least-loaded '
+        'available agent of their category. Meant to run every minute.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Assign at most this many tickets')
+        parser.add_argument(
+            '--category', action='append', choices=[value for value, _ in SupportTicket.CATEGORIES],
+            help='Only this queue (repeatable)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report the queued tickets')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f"{queue(options['category']).count()} tickets en cola")
+            return
+
+        assigned = auto_assign(limit=options['limit'], categories=options['category'])
+        self.stdout.write(self.style.SUCCESS(f"{assigned} tickets asignados"))
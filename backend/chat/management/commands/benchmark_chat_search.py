@@ -0,0 +1,55 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from chat.messaging import active_participant, post_message
+from chat.models import ChatRoom
+from chat.rooms import add_participants
+from chat.search import drop_statements
+
+SAMPLE = 'Hola, ¿a qué hora abren las puertas del concierto? Llego en el bus de las {n}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Time message inserts with and without the full-text search index. '
+        'Runs in one transaction that is rolled back; the index is dropped '
+        'inside it, so use a staging copy of the database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Username that posts the messages')
+        parser.add_argument('--messages', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"Usuario {options['user']} no existe")
+
+        total = options['messages']
+        with transaction.atomic():
+            self.time_inserts(user, min(total, 100))  # warm up connection and caches
+            indexed = self.time_inserts(user, total)
+            with connection.cursor() as cursor:
+                for sql in drop_statements(connection.vendor):
+                    cursor.execute(sql)
+            plain = self.time_inserts(user, total)
+            transaction.set_rollback(True)
+
+        overhead = (indexed - plain) / plain * 100 if plain else 0
+        self.stdout.write(f"{connection.vendor}, {total} mensajes")
+        self.stdout.write(f"  con índice: {total / indexed:.0f} msg/s")
+        self.stdout.write(f"  sin índice: {total / plain:.0f} msg/s")
+        self.stdout.write(self.style.SUCCESS(f"Costo del índice: {overhead:+.1f}% por inserción"))
+
+    def time_inserts(self, user, total):
+        room = ChatRoom.objects.create(name='Prueba de búsqueda', room_type='group', is_private=True)
+        add_participants(room, [user], role='owner')
+        participant = active_participant(room.room_id, user)
+        started = time.perf_counter()
+        for n in range(total):
+            post_message(participant, SAMPLE.format(n=n))
+        return time.perf_counter() - started
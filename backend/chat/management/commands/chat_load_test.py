@@ -0,0 +1,96 @@
+import asyncio
+import resource
+import time
+
+from channels.routing import URLRouter
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.middleware import JWTAuthMiddleware
+from chat.models import ChatRoom
+from chat.rooms import add_participants
+from chat.routing import websocket_urlpatterns
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = (
+        'Open many idle WebSocket connections against the chat gateway in this '
+        'process, subscribe them to one room and time a broadcast to all of them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Username the connections authenticate as')
+        parser.add_argument('--connections', type=int, default=10000)
+        parser.add_argument('--concurrency', type=int, default=500,
+                            help='Connections opened at the same time')
+        parser.add_argument('--idle', type=float, default=5.0,
+                            help='Seconds to hold the connections idle before broadcasting')
+        parser.add_argument('--timeout', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"Usuario {options['user']} no existe")
+
+        room = ChatRoom.objects.create(name='Prueba de carga', room_type='group', is_private=True)
+        add_participants(room, [user], role='owner')
+        try:
+            asyncio.run(self.run(str(AccessToken.for_user(user)), str(room.room_id), options))
+        finally:
+            room.delete()
+
+    async def run(self, token, room_id, options):
+        # channels.testing needs daphne, which only load testing machines have
+        from channels.testing import WebsocketCommunicator
+
+        app = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        timeout = options['timeout']
+        total = options['connections']
+
+        async def open_connection():
+            communicator = WebsocketCommunicator(app, f"/ws/chat/?token={token}")
+            connected, _ = await communicator.connect(timeout=timeout)
+            if not connected:
+                raise CommandError('La conexión fue rechazada')
+            await communicator.send_json_to({'type': 'subscribe', 'room_id': room_id})
+            reply = await communicator.receive_json_from(timeout=timeout)
+            if reply.get('type') != 'subscribed':
+                raise CommandError(f"Suscripción fallida: {reply}")
+            return communicator
+
+        rss_before = peak_rss_kb()
+        started = time.perf_counter()
+        connections = []
+        while len(connections) < total:
+            batch = min(options['concurrency'], total - len(connections))
+            connections.extend(await asyncio.gather(*(open_connection() for _ in range(batch))))
+        connect_time = time.perf_counter() - started
+        rss_after = peak_rss_kb()
+        self.stdout.write(
+            f"{total} conexiones en {connect_time:.1f}s, "
+            f"~{(rss_after - rss_before) / total:.1f} KB por conexión (RSS máx. {rss_after // 1024} MB)"
+        )
+
+        await asyncio.sleep(options['idle'])
+
+        sender = connections[0]
+        started = time.perf_counter()
+        await sender.send_json_to({'type': 'message', 'room_id': room_id, 'content': 'ping de carga'})
+        await sender.receive_json_from(timeout=timeout)  # ack
+        await asyncio.gather(*(
+            connection.receive_json_from(timeout=timeout) for connection in connections
+        ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Mensaje entregado a {total} conexiones en {(time.perf_counter() - started) * 1000:.0f} ms"
+        ))
+
+        for start in range(0, total, options['concurrency']):
+            await asyncio.gather(*(
+                connection.disconnect() for connection in connections[start:start + options['concurrency']]
+            ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from chat.attachments import DEFAULT_CHUNK_SIZE, DEFAULT_WORKERS, process_attachments
+
+
+class Command(BaseCommand):
+    help = 'Make thumbnails and blurhash placeholders for pending chat image attachments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            self.stdout.write(f"{done}/{total}")
+
+        done = process_attachments(
+            workers=options['workers'], chunk_size=options['chunk_size'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f"{done} adjuntos procesados"))
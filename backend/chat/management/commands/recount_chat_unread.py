@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import ChatRoom
+from chat.reads import DEFAULT_CHUNK_SIZE, recount_unread
+from chat.rooms import refresh_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild chat counters from the stored messages: sequences, unread '
+        'counts, member counts and last-message previews'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', action='append', dest='rooms', help='room_id to recount (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        rooms = ChatRoom.objects.all()
+        if options['rooms']:
+            rooms = rooms.filter(room_id__in=options['rooms'])
+        done = recount_unread(rooms, chunk_size=options['chunk_size'])
+
+        room_ids = list(rooms.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(room_ids), options['chunk_size']):
+            refresh_summaries(room_ids[start:start + options['chunk_size']])
+        self.stdout.write(self.style.SUCCESS(f"{done} salas recontadas"))
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.notifications import DEFAULT_CHUNK_SIZE, DEFAULT_WORKERS, deliver_notifications
+
+
+class Command(BaseCommand):
+    help = (
+        'Send pending chat notifications as per-user digests by email and push. '
+        'Run every minute or so; a user is sent at most one digest per window.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--window', type=int, default=getattr(settings, 'NOTIFICATION_DIGEST_WINDOW', 300),
+            help='Seconds notifications wait to be coalesced'
+        )
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Threads per channel')
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            self.stdout.write(f"{done}/{total} usuarios")
+
+        delivered = deliver_notifications(
+            window=timedelta(seconds=options['window']),
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f"{delivered} notificaciones entregadas"))
@@ -0,0 +1,88 @@
+"""
+Mentions and room media.
+
+``store_mentions`` runs when a message is stored: it resolves ``@username``
+in the text (and user ids a client put in ``metadata['mentions']``) against
+the room's active members, writes one ``MessageMention`` row each and sends
+them a ``mention`` notification. Listing a user's mentions then reads the
+``messagemention_user_created`` index.
+
+A room's images and files are read from the partial
+``chatmessage_room_media`` index on ``ChatMessage``.
+"""
+import re
+
+from django.db.models import Q
+
+from .models import ChatMessage, ChatParticipant, MessageMention
+from .notifications import notify
+
+# Django usernames may contain letters, digits and @.+-_
+MENTION_PATTERN = re.compile(r'(?<![\w@.+-])@([\w.@+-]+)')
+MEDIA_TYPES = ['image', 'file']
+
+
+def mentioned_usernames(content):
+    # A trailing dot is punctuation ("gracias @ana.")
+    return {name.rstrip('.') for name in MENTION_PATTERN.findall(content)} - {''}
+
+
+def _mentioned_ids(metadata):
+    ids = metadata.get('mentions') if isinstance(metadata, dict) else None
+    if not isinstance(ids, list):
+        return set()
+    return {value for value in ids if isinstance(value, int) and not isinstance(value, bool)}
+
+
+def store_mentions(message, summary=''):
+    """Index and notify the members mentioned in ``message``. Returns their user ids."""
+    usernames = mentioned_usernames(message.content)
+    user_ids = _mentioned_ids(message.metadata)
+    if not usernames and not user_ids:
+        return []
+
+    mentioned = list(
+        ChatParticipant.objects.filter(chat_room_id=message.chat_room_id, is_active=True)
+        .filter(Q(user__username__in=usernames) | Q(user_id__in=user_ids))
+        .exclude(user_id=message.sender_id)
+        .values_list('user_id', flat=True)
+    )
+    MessageMention.objects.bulk_create(
+        [
+            MessageMention(
+                message=message,
+                mentioned_user_id=user_id,
+                chat_room_id=message.chat_room_id,
+                created_at=message.created_at,
+            )
+            for user_id in mentioned
+        ],
+        ignore_conflicts=True,
+    )
+    notify(
+        mentioned, 'mention', f"{message.sender.username} te mencionó",
+        summary or message.content[:120],
+        chat_room=message.chat_room, chat_message=message,
+    )
+    return mentioned
+
+
+def mentions_for(user):
+    """The user's mentions, newest first, with the message and its room joined"""
+    return (
+        MessageMention.objects.filter(mentioned_user=user, message__is_deleted=False)
+        .select_related(
+            'message__chat_room', 'message__sender', 'message__reply_to', 'message__attachment'
+        )
+        .order_by('-created_at', '-id')
+    )
+
+
+def room_media(room, kind=None):
+    """Images and files shared in ``room``, newest first"""
+    types = [kind] if kind in MEDIA_TYPES else MEDIA_TYPES
+    return (
+        ChatMessage.objects.filter(chat_room=room, message_type__in=types, is_deleted=False)
+        .select_related('sender', 'attachment')
+        .order_by('-created_at', '-id')
+    )
@@ -0,0 +1,117 @@
+"""
+Writing chat messages.
+
+Every message, whether it arrives over the WebSocket gateway or any other
+path, is stored through ``post_message`` so the bookkeeping that depends on
+new messages lives in one place.
+"""
+import json
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChatAttachment, ChatMessage, ChatParticipant
+from .mentions import store_mentions
+from .notifications import notify_new_message
+from .reads import advance_read, next_seq
+from .serializers import ChatMessageSerializer
+
+PREVIEW_LENGTH = 120
+
+
+class ChatError(Exception):
+    """A chat action is not allowed"""
+
+
+def active_participant(room_id, user):
+    """The user's active membership in the room, or ``None``"""
+    return (
+        ChatParticipant.objects.filter(
+            chat_room__room_id=room_id, chat_room__is_active=True, user=user, is_active=True
+        )
+        .select_related('chat_room')
+        .first()
+    )
+
+
+def parse_id(value, name):
+    """``value`` as a UUID, raising ``ChatError`` if it is not one"""
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise ChatError(f"{name} inválido")
+
+
+def preview(content):
+    content = ' '.join(content.split())
+    if len(content) <= PREVIEW_LENGTH:
+        return content
+    return content[:PREVIEW_LENGTH - 1] + '…'
+
+
+def post_message(participant, content, message_type='text', reply_to=None, metadata=None, attachment=None):
+    """
+    Store a message sent by ``participant`` and return it. ``attachment`` is
+    the ``attachment_id`` of an upload (chat.attachments); the message then
+    becomes an image or file message and the caption is optional.
+    """
+    if not participant.can_send_messages:
+        raise ChatError('No tienes permiso para enviar mensajes en este chat')
+    content = (content or '').strip()
+
+    upload = None
+    if attachment:
+        if not participant.can_send_files:
+            raise ChatError('No tienes permiso para enviar archivos en este chat')
+        # Only the sender's own upload, and only if no other room has it
+        upload = ChatAttachment.objects.filter(
+            attachment_id=parse_id(attachment, 'attachment_id'), uploaded_by=participant.user
+        ).first()
+        if upload is None or upload.messages.exclude(chat_room=participant.chat_room).exists():
+            raise ChatError('El archivo adjunto no existe')
+        message_type = 'image' if upload.is_image else 'file'
+        content = content or upload.file_name
+    if not content:
+        raise ChatError('El mensaje está vacío')
+
+    room = participant.chat_room
+    summary = preview(content)
+    reply = None
+    if reply_to:
+        reply = ChatMessage.objects.filter(chat_room=room, message_id=parse_id(reply_to, 'reply_to')).first()
+        if reply is None:
+            raise ChatError('El mensaje al que respondes no existe')
+
+    with transaction.atomic():
+        message = ChatMessage.objects.create(
+            chat_room=room,
+            sender=participant.user,
+            seq=next_seq(
+                room,
+                last_message_at=timezone.now(),
+                last_message_preview=summary,
+                last_message_sender=participant.user,
+            ),
+            message_type=message_type,
+            content=content,
+            reply_to=reply,
+            metadata=metadata or {},
+            attachment=upload,
+            file_name=upload.file_name if upload else '',
+            file_size=upload.size if upload else None,
+        )
+        # Sending a message means the sender has read the room up to it
+        advance_read(participant, message.seq, message.created_at)
+        store_mentions(message, summary)
+        notify_new_message(message, summary)
+    return message
+
+
+def message_event(message):
+    """The message as the JSON text pushed to subscribers, encoded once"""
+    return json.dumps(
+        {'type': 'message', 'message': ChatMessageSerializer(message).data},
+        cls=DjangoJSONEncoder,
+    )
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0003_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="chatnotification",
+            name="notification_type",
+            field=models.CharField(
+                choices=[
+                    ("new_message", "Nuevo Mensaje"),
+                    ("mention", "Mencionado"),
+                    ("room_invite", "Invitación a Chat"),
+                    ("room_update", "Actualización de Chat"),
+                    ("event_reminder", "Recordatorio de Evento"),
+                    ("event_cancelled", "Evento Cancelado"),
+                ],
+                max_length=20,
+            ),
+        ),
+    ]
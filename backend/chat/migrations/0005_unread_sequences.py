@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:47
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def number_messages(apps, schema_editor):
+    ChatMessage = apps.get_model("chat", "ChatMessage")
+    ChatParticipant = apps.get_model("chat", "ChatParticipant")
+    ChatRoom = apps.get_model("chat", "ChatRoom")
+
+    for room_id in ChatRoom.objects.values_list("pk", flat=True).iterator():
+        batch = []
+        messages = ChatMessage.objects.filter(chat_room_id=room_id).order_by("created_at", "id")
+        for seq, message in enumerate(messages.only("pk").iterator(chunk_size=1000), start=1):
+            message.seq = seq
+            batch.append(message)
+            if len(batch) >= 1000:
+                ChatMessage.objects.bulk_update(batch, ["seq"])
+                batch = []
+        ChatMessage.objects.bulk_update(batch, ["seq"])
+
+    latest = ChatMessage.objects.filter(chat_room=OuterRef("pk")).order_by("-seq").values("seq")[:1]
+    ChatRoom.objects.update(message_count=Coalesce(Subquery(latest), 0))
+    read = (
+        ChatMessage.objects.filter(chat_room=OuterRef("chat_room"), created_at__lte=OuterRef("last_read_at"))
+        .order_by("-seq")
+        .values("seq")[:1]
+    )
+    ChatParticipant.objects.update(last_read_seq=Coalesce(Subquery(read), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0004_chatnotification_event_cancelled"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="seq",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatparticipant",
+            name="last_read_seq",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="chatmessage",
+            constraint=models.UniqueConstraint(
+                fields=("chat_room", "seq"), name="chatmessage_room_seq"
+            ),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Left
+
+
+def summarize_rooms(apps, schema_editor):
+    ChatMessage = apps.get_model("chat", "ChatMessage")
+    ChatParticipant = apps.get_model("chat", "ChatParticipant")
+    ChatRoom = apps.get_model("chat", "ChatRoom")
+
+    latest = ChatMessage.objects.filter(chat_room=OuterRef("pk")).order_by("-created_at", "-id")
+    members = (
+        ChatParticipant.objects.filter(chat_room=OuterRef("pk"), is_active=True)
+        .values("chat_room")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    ChatRoom.objects.update(
+        last_message_at=Coalesce(Subquery(latest.values("created_at")[:1]), F("created_at")),
+        last_message_preview=Coalesce(Left(Subquery(latest.values("content")[:1]), 120), models.Value("")),
+        last_message_sender=Subquery(latest.values("sender")[:1]),
+        member_count=Coalesce(Subquery(members), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("chat", "0005_unread_sequences"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatroom",
+            name="last_message_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="last_message_preview",
+            field=models.CharField(blank=True, max_length=120),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="last_message_sender",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="member_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(summarize_rooms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0006_room_inbox_summary"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["chat_room", "created_at", "id"],
+                name="chatmessage_room_created",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:57
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_delivered(apps, schema_editor):
+    # Notifications from before the delivery pipeline are not sent retroactively
+    ChatNotification = apps.get_model("chat", "ChatNotification")
+    ChatNotification.objects.update(delivered_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_message_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatnotification",
+            name="delivered_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_delivered, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="chatnotification",
+            index=models.Index(
+                condition=models.Q(("delivered_at__isnull", True)),
+                fields=["user", "created_at"],
+                name="chatnotification_pending",
+            ),
+        ),
+    ]
@@ -0,0 +1,136 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+
+MENTION_PATTERN = re.compile(r"(?<![\w@.+-])@([\w.@+-]+)")
+
+
+def index_mentions(apps, schema_editor):
+    # Mentions in existing messages are indexed without notifying anyone
+    ChatMessage = apps.get_model("chat", "ChatMessage")
+    ChatParticipant = apps.get_model("chat", "ChatParticipant")
+    MessageMention = apps.get_model("chat", "MessageMention")
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+
+    messages = ChatMessage.objects.filter(content__contains="@").only(
+        "pk", "chat_room_id", "sender_id", "content", "created_at"
+    )
+    chunk = []
+    for message in messages.iterator(chunk_size=1000):
+        chunk.append(message)
+        if len(chunk) >= 1000:
+            _index_chunk(chunk, ChatParticipant, MessageMention, User)
+            chunk = []
+    _index_chunk(chunk, ChatParticipant, MessageMention, User)
+
+
+def _index_chunk(messages, ChatParticipant, MessageMention, User):
+    names = {
+        message.pk: {name.rstrip(".") for name in MENTION_PATTERN.findall(message.content)}
+        for message in messages
+    }
+    user_ids = dict(
+        User.objects.filter(username__in=set().union(*names.values()) if names else [])
+        .values_list("username", "pk")
+    )
+    members = set(
+        ChatParticipant.objects.filter(
+            chat_room_id__in={message.chat_room_id for message in messages},
+            user_id__in=user_ids.values(),
+            is_active=True,
+        ).values_list("chat_room_id", "user_id")
+    )
+    MessageMention.objects.bulk_create(
+        [
+            MessageMention(
+                message_id=message.pk,
+                mentioned_user_id=user_ids[name],
+                chat_room_id=message.chat_room_id,
+                created_at=message.created_at,
+            )
+            for message in messages
+            for name in names[message.pk]
+            if name in user_ids
+            and user_ids[name] != message.sender_id
+            and (message.chat_room_id, user_ids[name]) in members
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("chat", "0009_notification_delivery"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageMention",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                condition=models.Q(
+                    ("is_deleted", False), ("message_type__in", ["image", "file"])
+                ),
+                fields=["chat_room", "message_type", "created_at", "id"],
+                name="chatmessage_room_media",
+            ),
+        ),
+        migrations.AddField(
+            model_name="messagemention",
+            name="chat_room",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="chat.chatroom",
+            ),
+        ),
+        migrations.AddField(
+            model_name="messagemention",
+            name="mentioned_user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chat_mentions",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="messagemention",
+            name="message",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="mentions",
+                to="chat.chatmessage",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="messagemention",
+            index=models.Index(
+                fields=["mentioned_user", "created_at", "id"],
+                name="messagemention_user_created",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="messagemention",
+            unique_together={("message", "mentioned_user")},
+        ),
+        migrations.RunPython(index_mentions, migrations.RunPython.noop),
+    ]
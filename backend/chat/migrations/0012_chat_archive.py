@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0011_chat_attachments"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatroom",
+            name="archived_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="ChatArchiveSegment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("first_seq", models.PositiveIntegerField()),
+                ("last_seq", models.PositiveIntegerField()),
+                ("message_count", models.PositiveIntegerField()),
+                ("first_created_at", models.DateTimeField()),
+                ("last_created_at", models.DateTimeField()),
+                ("file", models.FileField(max_length=255, upload_to="chat/archive/")),
+                ("size", models.PositiveBigIntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "chat_room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archive_segments",
+                        to="chat.chatroom",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["chat_room", "first_seq"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="chatarchivesegment",
+            constraint=models.UniqueConstraint(
+                fields=("chat_room", "first_seq"), name="chatarchivesegment_room_seq"
+            ),
+        ),
+    ]
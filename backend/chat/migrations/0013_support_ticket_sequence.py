@@ -0,0 +1,38 @@
+# Support ticket numbers come from a sequence instead of COUNT(*) + 1
+
+from django.db import migrations
+
+
+def create_sequence(apps, schema_editor):
+    SupportTicket = apps.get_model("chat", "SupportTicket")
+    NumberSequence = apps.get_model("payments", "NumberSequence")
+
+    start = 1
+    for number in SupportTicket.objects.values_list("ticket_number", flat=True).iterator():
+        digits = number.rsplit("-", 1)[-1]
+        if digits.isdigit():
+            start = max(start, int(digits) + 1)
+
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE SEQUENCE IF NOT EXISTS numberseq_support_ticket START WITH %s CACHE 20", [start]
+        )
+    NumberSequence.objects.update_or_create(name="support_ticket", defaults={"next_value": start})
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP SEQUENCE IF EXISTS numberseq_support_ticket")
+    apps.get_model("payments", "NumberSequence").objects.filter(name="support_ticket").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0012_chat_archive"),
+        ("payments", "0009_number_sequence"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
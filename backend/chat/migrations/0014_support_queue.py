@@ -0,0 +1,88 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:10
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# chat.support.sla_deadline as of this migration
+DEFAULT_SLA_MINUTES = {"urgent": 30, "high": 2 * 60, "normal": 8 * 60, "low": 24 * 60}
+
+
+def set_due_dates(apps, schema_editor):
+    """SLA deadline of existing tickets, counted from when they were opened"""
+    SupportTicket = apps.get_model("chat", "SupportTicket")
+    minutes = {**DEFAULT_SLA_MINUTES, **getattr(settings, "SUPPORT_SLA_MINUTES", {})}
+    by_category = getattr(settings, "SUPPORT_CATEGORY_SLA_MINUTES", {})
+    tickets = SupportTicket.objects.filter(due_at__isnull=True).order_by("pk")
+    last_pk = 0
+    while True:
+        batch = list(tickets.filter(pk__gt=last_pk).only("category", "priority", "created_at")[:1000])
+        if not batch:
+            break
+        for ticket in batch:
+            sla = {**minutes, **by_category.get(ticket.category, {})}
+            ticket.due_at = ticket.created_at + timedelta(minutes=sla.get(ticket.priority, sla["normal"]))
+        SupportTicket.objects.bulk_update(batch, ["due_at"])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("chat", "0013_support_ticket_sequence"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SupportAgent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("categories", models.JSONField(blank=True, default=list)),
+                ("is_available", models.BooleanField(default=True)),
+                ("max_open_tickets", models.PositiveIntegerField(default=10)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="supportticket",
+            name="due_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_due_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="supportticket",
+            index=models.Index(
+                condition=models.Q(("assigned_to__isnull", True), ("status", "open")),
+                fields=["category", "due_at", "id"],
+                name="supportticket_queue",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="supportticket",
+            index=models.Index(
+                fields=["assigned_to", "status"], name="supportticket_agent_status"
+            ),
+        ),
+        migrations.AddField(
+            model_name="supportagent",
+            name="user",
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="support_agent",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0015_notification_retries"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="chatattachment",
+            name="sha256",
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+    ]
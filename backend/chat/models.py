@@ -1,7 +1,10 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 import uuid
 
+from casaroja.sequences import next_value
+
 User = get_user_model()
 
 
@@ -42,6 +45,22 @@ class ChatRoom(models.Model):
     
     # Metadata
     description = models.TextField(blank=True)
+    message_count = models.PositiveIntegerField(default=0)  # seq of the latest message
+    
+    # Denormalized for the inbox, kept by chat.messaging and chat.rooms
+    last_message_at = models.DateTimeField(default=timezone.now)  # creation time until the first message
+    last_message_preview = models.CharField(max_length=120, blank=True)
+    last_message_sender = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    member_count = models.PositiveIntegerField(default=0)
+    
+    # Set once all messages have been moved to archive segments (chat.archive)
+    archived_at = models.DateTimeField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -53,7 +72,7 @@ class ChatRoom(models.Model):
 
     @property
     def participant_count(self):
-        return self.participants.count()
+        return self.member_count
 
     @property
     def last_message(self):
@@ -83,6 +102,7 @@ class ChatParticipant(models.Model):
     # Notifications
     notifications_enabled = models.BooleanField(default=True)
     last_read_at = models.DateTimeField(auto_now_add=True)
+    last_read_seq = models.PositiveIntegerField(default=0)  # seq of the last message read
     
     # Permissions
     can_send_messages = models.BooleanField(default=True)
@@ -96,10 +116,50 @@ class ChatParticipant(models.Model):
 
     @property
     def unread_count(self):
-        return self.chat_room.messages.filter(
-            created_at__gt=self.last_read_at,
-            sender__ne=self.user
-        ).count()
+        return max(self.chat_room.message_count - self.last_read_seq, 0)
+
+
+class ChatAttachment(models.Model):
+    """
+    One upload of a file. The file itself is stored once per content hash
+    and shared by every upload of it. Images get a thumbnail and a blurhash
+    placeholder in the background (chat.attachments)
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pendiente'),
+        ('ready', 'Lista'),
+        ('failed', 'Fallida'),
+    )
+
+    attachment_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField()  # in bytes
+    content_type = models.CharField(max_length=100, blank=True)
+    file_name = models.CharField(max_length=255, blank=True)  # as uploaded
+    file = models.FileField(upload_to='chat/attachments/', max_length=255)
+
+    # Images only
+    thumbnail = models.ImageField(upload_to='chat/thumbnails/', null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    blurhash = models.CharField(max_length=64, blank=True)
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], name='chatattachment_pending', condition=models.Q(status='pending')),
+        ]
+
+    def __str__(self):
+        return f"{self.file_name or self.sha256} ({self.size} bytes)"
+
+    @property
+    def is_image(self):
+        return self.content_type.startswith('image/')
 
 
 class ChatMessage(models.Model):
@@ -119,6 +179,7 @@ class ChatMessage(models.Model):
     message_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
+    seq = models.PositiveIntegerField(null=True, blank=True)  # 1, 2, 3... within the room
     
     # Content
     message_type = models.CharField(max_length=20, choices=MESSAGE_TYPES, default='text')
@@ -129,6 +190,13 @@ class ChatMessage(models.Model):
     file_attachment = models.FileField(upload_to='chat/files/', null=True, blank=True)
     file_name = models.CharField(max_length=255, blank=True)
     file_size = models.PositiveIntegerField(null=True, blank=True)  # in bytes
+    attachment = models.ForeignKey(
+        ChatAttachment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='messages'
+    )
     
     # Location data (for location messages)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
@@ -151,6 +219,19 @@ class ChatMessage(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['chat_room', 'seq'], name='chatmessage_room_seq'),
+        ]
+        indexes = [
+            # Keyset pagination of a room's history, see chat.history
+            models.Index(fields=['chat_room', 'created_at', 'id'], name='chatmessage_room_created'),
+            # A room's images and files, see chat.mentions.room_media
+            models.Index(
+                fields=['chat_room', 'message_type', 'created_at', 'id'],
+                name='chatmessage_room_media',
+                condition=models.Q(message_type__in=['image', 'file'], is_deleted=False),
+            ),
+        ]
 
     def __str__(self):
         content_preview = self.content[:50] + "..." if len(self.content) > 50 else self.content
@@ -161,9 +242,35 @@ class ChatMessage(models.Model):
         return self.message_type == 'system'
 
 
+class ChatArchiveSegment(models.Model):
+    """
+    A run of consecutive messages of a closed room, moved out of
+    ChatMessage into a compressed JSON-lines file (chat.archive)
+    """
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archive_segments')
+    first_seq = models.PositiveIntegerField()
+    last_seq = models.PositiveIntegerField()
+    message_count = models.PositiveIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    file = models.FileField(upload_to='chat/archive/', max_length=255)
+    size = models.PositiveBigIntegerField()  # compressed, in bytes
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['chat_room', 'first_seq']
+        constraints = [
+            models.UniqueConstraint(fields=['chat_room', 'first_seq'], name='chatarchivesegment_room_seq'),
+        ]
+
+    def __str__(self):
+        return f"{self.chat_room_id}: {self.first_seq}-{self.last_seq}"
+
+
 class MessageRead(models.Model):
     """
-    Track which messages have been read by which users
+    Track which messages have been read by which users. Only written for
+    direct chats; other rooms use ChatParticipant.last_read_seq (chat.reads)
     """
     message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, related_name='read_receipts')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='message_reads')
@@ -176,6 +283,26 @@ class MessageRead(models.Model):
         return f"{self.user.username} read message {self.message.message_id}"
 
 
+class MessageMention(models.Model):
+    """
+    A user mentioned in a message. Extracted when the message is stored
+    (chat.mentions) so "my mentions" is an index lookup, not a JSON scan
+    """
+    message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, related_name='mentions')
+    mentioned_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_mentions')
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()  # the message's, so mentions sort like messages
+
+    class Meta:
+        unique_together = ['message', 'mentioned_user']
+        indexes = [
+            models.Index(fields=['mentioned_user', 'created_at', 'id'], name='messagemention_user_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.mentioned_user.username} mentioned in {self.message.message_id}"
+
+
 class ChatNotification(models.Model):
     """
     Notifications for chat events
@@ -186,6 +313,7 @@ class ChatNotification(models.Model):
         ('room_invite', 'Invitación a Chat'),
         ('room_update', 'Actualización de Chat'),
         ('event_reminder', 'Recordatorio de Evento'),
+        ('event_cancelled', 'Evento Cancelado'),
     )
     
     STATUS_CHOICES = (
@@ -210,14 +338,25 @@ class ChatNotification(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='unread')
     read_at = models.DateTimeField(null=True, blank=True)
     
-    # Delivery
+    # Delivery, see chat.notifications
     sent_via_email = models.BooleanField(default=False)
     sent_via_push = models.BooleanField(default=False)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    delivery_attempts = models.PositiveIntegerField(default=0)
+    # Not sent before this: a run's claim on it, or the backoff after a failure
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['user', 'created_at'],
+                name='chatnotification_pending',
+                condition=models.Q(delivered_at__isnull=True),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.notification_type} for {self.user.username}: {self.title}"
@@ -276,6 +415,9 @@ class SupportTicket(models.Model):
     
     # Status and resolution
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    # SLA deadline, the queue order (chat.support). Kept by save() and
+    # support.change_tickets; QuerySet.update() of priority/category leaves it stale.
+    due_at = models.DateTimeField(null=True, blank=True)
     resolution = models.TextField(blank=True)
     resolved_at = models.DateTimeField(null=True, blank=True)
     
@@ -286,18 +428,67 @@ class SupportTicket(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        ticket = super().from_db(db, field_names, values)
+        # What the SLA deadline was computed from, to notice changes on save
+        ticket._sla_key = (ticket.__dict__.get('category'), ticket.__dict__.get('priority'))
+        return ticket
+
     def save(self, *args, **kwargs):
+        from .support import sla_deadline
+
         if not self.ticket_number:
-            # Generate ticket number
-            count = SupportTicket.objects.count() + 1
-            self.ticket_number = f"SUP-{count:06d}"
+            self.ticket_number = f"SUP-{next_value('support_ticket'):06d}"
+        loaded = getattr(self, '_sla_key', None)
+        if not self.due_at:
+            self.due_at = sla_deadline(self.category, self.priority)
+        elif self.created_at and (
+            loaded is None or (None not in loaded and loaded != (self.category, self.priority))
+        ):
+            # A new priority or category moves the deadline, still counted from opening.
+            # Without a loaded key (an instance built by hand) it is recomputed anyway.
+            self.due_at = sla_deadline(self.category, self.priority, self.created_at)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'due_at'}
         super().save(*args, **kwargs)
+        self._sla_key = (self.category, self.priority)
 
     def __str__(self):
         return f"{self.ticket_number}: {self.title}"
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The unassigned queue of each category, most overdue first
+            models.Index(
+                fields=['category', 'due_at', 'id'],
+                name='supportticket_queue',
+                condition=models.Q(status='open', assigned_to__isnull=True),
+            ),
+            models.Index(fields=['assigned_to', 'status'], name='supportticket_agent_status'),
+        ]
+
+
+class SupportAgent(models.Model):
+    """
+    A staff member who takes support tickets. ``categories`` limits which
+    queues they serve (empty: all of them)
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='support_agent')
+    categories = models.JSONField(default=list, blank=True)
+    is_available = models.BooleanField(default=True)
+    max_open_tickets = models.PositiveIntegerField(default=10)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} ({'disponible' if self.is_available else 'no disponible'})"
+
+    def handles(self, category):
+        return not self.categories or category in self.categories
 
 
 class ChatModerationLog(models.Model):
@@ -0,0 +1,249 @@
+"""
+Notification fan-out and digest delivery.
+
+``notify`` stores one ``ChatNotification`` per recipient with chunked bulk
+inserts. Chat messages coalesce when the notification is created: a member
+who still has an undelivered ``new_message`` notification for the room
+does not get another one.
+
+``deliver_notifications`` sends digests. A user's pending notifications
+wait until the oldest is ``window`` old and then go out together as one
+email and one push. Senders run on bounded thread pools with a per-channel
+rate limit (``chat.delivery``). Each run first claims the notifications it
+sends by pushing their ``next_attempt_at`` past ``CLAIM_TIMEOUT``, so
+concurrent runs never send the same digest. Notifications are marked
+delivered only once a channel accepted them (``sent_via_email`` and
+``sent_via_push`` record which). If every channel failed, they wait with
+exponential backoff and are given up after ``MAX_DELIVERY_ATTEMPTS``.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Min, Q
+from django.utils import timezone
+
+from events.models import Event
+from tickets.models import Ticket
+
+from .delivery import RateLimiter, get_sender
+from .models import ChatNotification, ChatParticipant, ChatRoom
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_WORKERS = 8
+DIGEST_LINES = 10
+MAX_DELIVERY_ATTEMPTS = 5
+RETRY_BACKOFF = timedelta(minutes=1)  # doubled after every failed attempt
+# A run that claimed notifications and died leaves them claimed this long
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def notify(user_ids, notification_type, title, message, chat_room=None, chat_message=None,
+           chunk_size=DEFAULT_CHUNK_SIZE):
+    """Create the same notification for every user in ``user_ids``. Returns how many."""
+    user_ids = list(dict.fromkeys(user_ids))
+    for start in range(0, len(user_ids), chunk_size):
+        ChatNotification.objects.bulk_create([
+            ChatNotification(
+                user_id=user_id,
+                notification_type=notification_type,
+                title=title,
+                message=message,
+                chat_room=chat_room,
+                chat_message=chat_message,
+            )
+            for user_id in user_ids[start:start + chunk_size]
+        ])
+    return len(user_ids)
+
+
+def notify_new_message(message, summary=''):
+    """
+    Notify the room's members about ``message``, skipping the sender, muted
+    members and anyone already waiting on a notification for this room.
+    """
+    room = message.chat_room
+    waiting = ChatNotification.objects.filter(
+        chat_room=room, notification_type='new_message', delivered_at__isnull=True,
+        delivery_attempts__lt=MAX_DELIVERY_ATTEMPTS,
+    ).values('user_id')
+    recipients = (
+        ChatParticipant.objects.filter(chat_room=room, is_active=True, notifications_enabled=True)
+        .exclude(user_id=message.sender_id)
+        .exclude(user_id__in=waiting)
+        .values_list('user_id', flat=True)
+    )
+    title = room.name or 'Nuevo mensaje'
+    return notify(
+        recipients, 'new_message', title, summary or message.content[:120],
+        chat_room=room, chat_message=message,
+    )
+
+
+def event_attendees(event):
+    return (
+        Ticket.objects.filter(event=event, status__in=['confirmed', 'used'])
+        .order_by()
+        .values_list('customer_id', flat=True)
+        .distinct()
+    )
+
+
+def remind_event(event):
+    """Send the reminder for ``event`` to its ticket holders once. Returns how many."""
+    start = timezone.localtime(event.start_datetime)
+    with transaction.atomic():
+        claimed = Event.objects.filter(pk=event.pk, reminder_sent_at__isnull=True).update(
+            reminder_sent_at=timezone.now()
+        )
+        if not claimed:
+            return 0
+        return notify(
+            event_attendees(event),
+            'event_reminder',
+            f"Recordatorio: {event.title}",
+            f"Tu evento comienza el {start:%d/%m a las %H:%M}.",
+            chat_room=ChatRoom.objects.filter(event=event, room_type='event').first(),
+        )
+
+
+def digest(notifications):
+    """Subject and body of one email/push covering ``notifications``"""
+    if len(notifications) == 1:
+        return notifications[0].title, notifications[0].message
+    lines = [
+        f"• {notification.title}: {notification.message}"
+        for notification in notifications[:DIGEST_LINES]
+    ]
+    if len(notifications) > DIGEST_LINES:
+        lines.append(f"… y {len(notifications) - DIGEST_LINES} más")
+    return f"Tienes {len(notifications)} notificaciones nuevas", '\n'.join(lines)
+
+
+def _send(channel, limiter, user, subject, body):
+    """``True`` if the channel accepted the digest, ``False`` if it declined, ``None`` on error"""
+    limiter.acquire()
+    try:
+        return bool(get_sender(channel).send(user, subject, body))
+    except Exception:
+        logger.exception('Fallo al enviar notificación por %s a %s', channel, user.pk)
+        return None
+
+
+def ready(now):
+    """Notifications not claimed by a run nor backing off at ``now``"""
+    return Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+
+
+def claim_notifications(notifications, now):
+    """
+    Claim ``notifications`` for this run and return the ids claimed.
+    Notifications another run has claimed are skipped.
+    """
+    claimed_until = now + CLAIM_TIMEOUT
+    candidates = notifications.filter(ready(now)).values_list('pk', flat=True)
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidates.select_for_update(skip_locked=True, of=('self',)))
+            ChatNotification.objects.filter(pk__in=ids).update(next_attempt_at=claimed_until)
+        return ids
+    # Without SKIP LOCKED, claim row by row with a conditional UPDATE
+    return [
+        pk for pk in list(candidates)
+        if ChatNotification.objects.filter(ready(now), pk=pk, delivered_at__isnull=True)
+        .update(next_attempt_at=claimed_until)
+    ]
+
+
+def deliver_notifications(window=None, now=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS,
+                          progress=None):
+    """
+    Send digests to every user whose oldest pending notification is at
+    least ``window`` old. ``progress`` is called as ``progress(done, total)``
+    with users. Returns the number of notifications delivered.
+    """
+    now = now or timezone.now()
+    if window is None:
+        window = timedelta(seconds=getattr(settings, 'NOTIFICATION_DIGEST_WINDOW', 300))
+    pending = ChatNotification.objects.filter(
+        ready(now), delivered_at__isnull=True, created_at__lte=now,
+        delivery_attempts__lt=MAX_DELIVERY_ATTEMPTS,
+    )
+    due = (
+        pending.order_by().values('user_id')
+        .annotate(oldest=Min('created_at'))
+        .filter(oldest__lte=now - window)
+    )
+    total = due.count()
+    limiters = {
+        channel: RateLimiter(getattr(settings, f"NOTIFICATION_{channel.upper()}_RATE", 50))
+        for channel in ('email', 'push')
+    }
+    delivered = 0
+    done = 0
+    last_user = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as email_pool, \
+            ThreadPoolExecutor(max_workers=workers) as push_pool:
+        while True:
+            user_ids = list(
+                due.filter(user_id__gt=last_user)
+                .order_by('user_id')
+                .values_list('user_id', flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+            last_user = user_ids[-1]
+
+            by_user = {}
+            claimed = claim_notifications(pending.filter(user_id__in=user_ids), now)
+            notifications = (
+                ChatNotification.objects.filter(pk__in=claimed).select_related('user').order_by('created_at')
+            )
+            for notification in notifications:
+                by_user.setdefault(notification.user_id, []).append(notification)
+            # Notifications read or dismissed in the app meanwhile are not sent
+            digests = [
+                (items[0].user, [n for n in items if n.status == 'unread'], items)
+                for items in by_user.values()
+            ]
+            to_send = [(user, *digest(unread)) for user, unread, _ in digests if unread]
+            emails = email_pool.map(lambda args: _send('email', limiters['email'], *args), to_send)
+            pushes = push_pool.map(lambda args: _send('push', limiters['push'], *args), to_send)
+            sent = {user.pk: (email, push) for (user, _, _), email, push in zip(to_send, emails, pushes)}
+
+            # One UPDATE per combination of channel outcomes, at most four,
+            # and one per attempt count for the digests that failed
+            outcomes = {}
+            retries = {}
+            for user, unread, items in digests:
+                email, push = sent.get(user.pk, (False, False))
+                failed = not (email or push) and None in (email, push)
+                for notification in items:
+                    if notification.status != 'unread':
+                        outcomes.setdefault((False, False), []).append(notification.pk)
+                    elif failed:
+                        retries.setdefault(notification.delivery_attempts, []).append(notification.pk)
+                    else:
+                        outcomes.setdefault((bool(email), bool(push)), []).append(notification.pk)
+            for (email, push), ids in outcomes.items():
+                for start in range(0, len(ids), chunk_size):
+                    ChatNotification.objects.filter(pk__in=ids[start:start + chunk_size]).update(
+                        delivered_at=now, sent_via_email=email, sent_via_push=push, next_attempt_at=None
+                    )
+                delivered += len(ids)
+            for attempts, ids in retries.items():
+                for start in range(0, len(ids), chunk_size):
+                    ChatNotification.objects.filter(pk__in=ids[start:start + chunk_size]).update(
+                        delivery_attempts=F('delivery_attempts') + 1,
+                        next_attempt_at=now + RETRY_BACKOFF * 2 ** attempts,
+                    )
+            done += len(user_ids)
+            if progress:
+                progress(done, total)
+
+    return delivered
@@ -0,0 +1,120 @@
+"""
+Room fan-out for the WebSocket gateway.
+
+Each process has one ``Broker`` that maps ``room_id`` to the connections
+subscribed in this process. Messages are encoded once and published
+through a backend that delivers them to the broker of every process:
+
+* ``LocalBackend`` delivers straight back to this process (single worker,
+  development, tests);
+* ``RedisBackend`` relays through Redis pub/sub, with one Redis
+  subscription per room per process instead of one per connection.
+
+The backend is chosen with the ``CHAT_PUBSUB_BACKEND`` setting.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend:
+    """In-process only: publishing delivers to this process' subscribers"""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    async def subscribe(self, room_id):
+        pass
+
+    async def unsubscribe(self, room_id):
+        pass
+
+    async def publish(self, room_id, text):
+        await self.deliver(room_id, text)
+
+
+class RedisBackend:
+    """Cross-process fan-out over Redis pub/sub (``CHAT_PUBSUB_URL``)"""
+    prefix = 'chat:'
+
+    def __init__(self, deliver, url=None):
+        import redis.asyncio as redis
+
+        self.deliver = deliver
+        self.client = redis.from_url(url or settings.CHAT_PUBSUB_URL)
+        self.pubsub = self.client.pubsub()
+        self.listener = None
+
+    async def subscribe(self, room_id):
+        await self.pubsub.subscribe(f"{self.prefix}{room_id}")
+        if self.listener is None:
+            self.listener = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, room_id):
+        await self.pubsub.unsubscribe(f"{self.prefix}{room_id}")
+
+    async def publish(self, room_id, text):
+        await self.client.publish(f"{self.prefix}{room_id}", text)
+
+    async def _listen(self):
+        try:
+            async for message in self.pubsub.listen():
+                if message['type'] != 'message':
+                    continue
+                room_id = message['channel'].decode()[len(self.prefix):]
+                await self.deliver(room_id, message['data'].decode())
+        finally:
+            self.listener = None
+
+
+class Broker:
+    def __init__(self, backend_class=None):
+        self.rooms = defaultdict(set)
+        backend_class = backend_class or import_string(settings.CHAT_PUBSUB_BACKEND)
+        self.backend = backend_class(self.deliver)
+
+    async def subscribe(self, room_id, connection):
+        room_id = str(room_id)
+        first = not self.rooms[room_id]
+        self.rooms[room_id].add(connection)
+        if first:
+            await self.backend.subscribe(room_id)
+
+    async def unsubscribe(self, room_id, connection):
+        room_id = str(room_id)
+        connections = self.rooms.get(room_id)
+        if not connections:
+            return
+        connections.discard(connection)
+        if not connections:
+            del self.rooms[room_id]
+            await self.backend.unsubscribe(room_id)
+
+    async def publish(self, room_id, text):
+        await self.backend.publish(str(room_id), text)
+
+    async def deliver(self, room_id, text):
+        """Push ``text`` to every local connection subscribed to the room"""
+        connections = list(self.rooms.get(str(room_id), ()))
+        results = await asyncio.gather(
+            *(connection.deliver(text) for connection in connections),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning('Chat delivery failed: %s', result)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = Broker()
+    return _broker
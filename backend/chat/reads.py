@@ -0,0 +1,172 @@
+"""
+Read positions and unread counts.
+
+Every message gets a per-room sequence number (``ChatMessage.seq``) and the
+room keeps the latest one in ``ChatRoom.message_count``. A participant's
+read position is ``ChatParticipant.last_read_seq``, so
+
+    unread = chat_room.message_count - last_read_seq
+
+Posting a message costs one UPDATE on the room and one on the sender's
+read position, whatever the size of the room. Reading costs one UPDATE.
+
+Read receipts come from the same watermark: a message has been seen by
+every participant whose ``last_read_seq`` is at or past its ``seq``. Only
+direct chats also store per-message ``MessageRead`` rows, to show when each
+message was read; there it is at most one row per message.
+``recount_unread`` rebuilds both counters from the messages and is what the
+``recount_chat_unread`` job runs.
+"""
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import ChatMessage, ChatParticipant, ChatRoom, MessageRead
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def next_seq(room, **changes):
+    """
+    Reserve the next sequence number in ``room``, applying ``changes`` to the
+    room in the same UPDATE. Call inside a transaction.
+    """
+    ChatRoom.objects.filter(pk=room.pk).update(message_count=F('message_count') + 1, **changes)
+    # The UPDATE holds the row lock, so this read sees our own increment
+    room.message_count = ChatRoom.objects.filter(pk=room.pk).values_list('message_count', flat=True).get()
+    return room.message_count
+
+
+def advance_read(participant, seq, read_at):
+    """Move the participant's read position forward to ``seq``; never backwards"""
+    previous = participant.last_read_seq
+    updated = ChatParticipant.objects.filter(pk=participant.pk, last_read_seq__lt=seq).update(
+        last_read_seq=seq, last_read_at=read_at
+    )
+    if updated:
+        participant.last_read_seq = seq
+        participant.last_read_at = read_at
+        if participant.chat_room.room_type == 'direct':
+            _store_receipts(participant, previous, seq)
+    return bool(updated)
+
+
+def _store_receipts(participant, after_seq, up_to_seq):
+    message_ids = ChatMessage.objects.filter(
+        chat_room_id=participant.chat_room_id, seq__gt=after_seq, seq__lte=up_to_seq
+    ).exclude(sender_id=participant.user_id).values_list('pk', flat=True)
+    MessageRead.objects.bulk_create(
+        [MessageRead(message_id=pk, user_id=participant.user_id) for pk in message_ids],
+        ignore_conflicts=True,
+    )
+
+
+def seen_by(message):
+    """
+    Who has seen ``message``, as ``(user_id, username, read_at)`` tuples.
+    ``read_at`` is only known in direct chats and is ``None`` elsewhere.
+    """
+    if message.chat_room.room_type == 'direct':
+        return list(
+            MessageRead.objects.filter(message=message)
+            .order_by('read_at')
+            .values_list('user_id', 'user__username', 'read_at')
+        )
+    readers = (
+        ChatParticipant.objects.filter(
+            chat_room_id=message.chat_room_id, is_active=True, last_read_seq__gte=message.seq
+        )
+        .exclude(user_id=message.sender_id)
+        .order_by('user__username')
+        .values_list('user_id', 'user__username')
+    )
+    return [(user_id, username, None) for user_id, username in readers]
+
+
+def mark_read(participant, message=None):
+    """
+    Mark the room as read up to ``message`` (default: the latest message).
+    Returns ``True`` if the read position moved.
+    """
+    if message is None:
+        message = (
+            ChatMessage.objects.filter(chat_room_id=participant.chat_room_id, seq__isnull=False)
+            .order_by('-seq')
+            .only('seq', 'created_at')
+            .first()
+        )
+        if message is None:
+            return False
+    return advance_read(participant, message.seq, message.created_at)
+
+
+def with_unread(participants):
+    """Annotate participants with ``unread`` computed in the same query"""
+    return participants.annotate(
+        unread=Greatest(
+            ExpressionWrapper(F('chat_room__message_count') - F('last_read_seq'), output_field=IntegerField()),
+            0,
+        )
+    )
+
+
+def unread_counts(user):
+    """``{room_id: unread}`` for all of the user's active rooms, in one query"""
+    return dict(
+        with_unread(ChatParticipant.objects.filter(user=user, is_active=True))
+        .values_list('chat_room__room_id', 'unread')
+    )
+
+
+def number_messages(room_ids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Give sequence numbers to messages stored without one (imports, old rows)"""
+    numbered = 0
+    for room_id in room_ids:
+        with transaction.atomic():
+            last = ChatMessage.objects.filter(chat_room_id=room_id).aggregate(last=Max('seq'))['last'] or 0
+            pending = ChatMessage.objects.filter(chat_room_id=room_id, seq__isnull=True).order_by('created_at', 'id')
+            batch = []
+            for message in pending.only('pk').iterator(chunk_size=chunk_size):
+                last += 1
+                message.seq = last
+                batch.append(message)
+                if len(batch) >= chunk_size:
+                    ChatMessage.objects.bulk_update(batch, ['seq'])
+                    numbered += len(batch)
+                    batch = []
+            ChatMessage.objects.bulk_update(batch, ['seq'])
+            numbered += len(batch)
+    return numbered
+
+
+def recount_unread(rooms=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Rebuild ``message_count`` and ``last_read_seq`` from the messages for
+    ``rooms`` (default: all). Returns the number of rooms processed.
+    """
+    rooms = rooms if rooms is not None else ChatRoom.objects.all()
+    done = 0
+    last_pk = 0
+    while True:
+        room_ids = list(rooms.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not room_ids:
+            break
+        last_pk = room_ids[-1]
+        unnumbered = list(
+            ChatMessage.objects.filter(chat_room_id__in=room_ids, seq__isnull=True)
+            .order_by().values_list('chat_room_id', flat=True).distinct()
+        )
+        number_messages(unnumbered, chunk_size)
+        latest = ChatMessage.objects.filter(chat_room=OuterRef('pk')).order_by('-seq').values('seq')[:1]
+        read = (
+            ChatMessage.objects.filter(chat_room=OuterRef('chat_room'), created_at__lte=OuterRef('last_read_at'))
+            .order_by('-seq')
+            .values('seq')[:1]
+        )
+        with transaction.atomic():
+            ChatRoom.objects.filter(pk__in=room_ids).update(message_count=Coalesce(Subquery(latest), 0))
+            ChatParticipant.objects.filter(chat_room_id__in=room_ids).update(
+                last_read_seq=Coalesce(Subquery(read), 0)
+            )
+        done += len(room_ids)
+    return done
@@ -0,0 +1,76 @@
+"""
+Room membership.
+
+Joining and leaving go through these functions so ``ChatRoom.member_count``
+stays in step with the active ``ChatParticipant`` rows. ``refresh_summaries``
+rebuilds the denormalized inbox columns from the source rows.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .messaging import preview
+from .models import ChatMessage, ChatParticipant, ChatRoom
+
+
+def _count_members(room_ids):
+    members = (
+        ChatParticipant.objects.filter(chat_room=OuterRef('pk'), is_active=True)
+        .order_by()
+        .values('chat_room')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    ChatRoom.objects.filter(pk__in=room_ids).update(member_count=Coalesce(Subquery(members), 0))
+
+
+def add_participants(room, users, role='member'):
+    """Add ``users`` to ``room`` (re-activating former members) in a few bulk statements"""
+    user_ids = [getattr(user, 'pk', user) for user in users]
+    room.refresh_from_db(fields=['message_count'])
+    with transaction.atomic():
+        ChatParticipant.objects.bulk_create(
+            [
+                # A new member starts with the existing history marked as read
+                ChatParticipant(chat_room=room, user_id=user_id, role=role, last_read_seq=room.message_count)
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True,
+        )
+        ChatParticipant.objects.filter(chat_room=room, user_id__in=user_ids, is_active=False).update(
+            is_active=True, left_at=None
+        )
+        _count_members([room.pk])
+    room.refresh_from_db(fields=['member_count'])
+
+
+def leave_room(participant):
+    with transaction.atomic():
+        left = ChatParticipant.objects.filter(pk=participant.pk, is_active=True).update(
+            is_active=False, left_at=timezone.now()
+        )
+        if left:
+            ChatRoom.objects.filter(pk=participant.chat_room_id).update(member_count=F('member_count') - 1)
+    participant.is_active = False
+
+
+def refresh_summaries(room_ids):
+    """Recompute member counts and the last-message columns for ``room_ids``"""
+    latest = ChatMessage.objects.filter(chat_room=OuterRef('pk')).order_by('-seq')
+    with transaction.atomic():
+        _count_members(room_ids)
+        ChatRoom.objects.filter(pk__in=room_ids).update(
+            last_message_at=Coalesce(Subquery(latest.values('created_at')[:1]), F('created_at')),
+            last_message_sender=Subquery(latest.values('sender')[:1]),
+            last_message_preview=Coalesce(Subquery(latest.values('content')[:1]), Value('')),
+        )
+        # Previews are normalised in Python; only rooms whose text needs it are rewritten
+        rooms = ChatRoom.objects.filter(pk__in=room_ids).only('pk', 'last_message_preview')
+        changed = []
+        for room in rooms:
+            short = preview(room.last_message_preview)
+            if short != room.last_message_preview:
+                room.last_message_preview = short
+                changed.append(room)
+        ChatRoom.objects.bulk_update(changed, ['last_message_preview'])
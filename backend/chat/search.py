@@ -0,0 +1,130 @@
+"""
+Full-text search over chat messages.
+
+PostgreSQL searches a GIN expression index on
+``to_tsvector('spanish', content)``; there is no extra column, so an
+insert only pays for the index entry. SQLite keeps an external-content
+FTS5 table (``chat_message_fts``) in step with ``chat_chatmessage``
+through triggers. Both are created by migration 0008 and ranked by the
+engine (``ts_rank`` / ``bm25``).
+
+Searches are always scoped to a list of rooms: the user's own rooms, or
+for staff a customer's rooms or a single room. Deleted messages are never
+returned. ``benchmark_chat_search`` measures what the index costs on insert.
+"""
+from django.db import connection
+
+from .models import ChatMessage, ChatParticipant, ChatRoom
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+SEARCH_CONFIG = 'spanish'
+
+# Statements that build/drop the index on each engine. The migration keeps
+# its own copy; these are used by the insert benchmark.
+POSTGRES_INDEX = [
+    f"CREATE INDEX chatmessage_content_search ON chat_chatmessage "
+    f"USING gin (to_tsvector('{SEARCH_CONFIG}', content))",
+]
+POSTGRES_DROP = ['DROP INDEX IF EXISTS chatmessage_content_search']
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE chat_message_fts USING fts5("
+    "content, content='chat_chatmessage', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_chatmessage BEGIN "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_chatmessage BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content ON chat_chatmessage BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS chat_message_fts_insert',
+    'DROP TRIGGER IF EXISTS chat_message_fts_delete',
+    'DROP TRIGGER IF EXISTS chat_message_fts_update',
+    'DROP TABLE IF EXISTS chat_message_fts',
+]
+
+
+class SearchUnavailable(Exception):
+    """The database engine has no message search index"""
+
+
+def index_statements(vendor):
+    return {'postgresql': POSTGRES_INDEX, 'sqlite': SQLITE_INDEX}.get(vendor, [])
+
+
+def drop_statements(vendor):
+    return {'postgresql': POSTGRES_DROP, 'sqlite': SQLITE_DROP}.get(vendor, [])
+
+
+def searchable_rooms(user, customer=None, room=None):
+    """
+    Primary keys of the rooms ``user`` may search. Staff can search any
+    single ``room`` or all the rooms of a ``customer``; everyone else only
+    the rooms they are an active member of.
+    """
+    if room is not None:
+        if user.is_staff or ChatParticipant.objects.filter(chat_room=room, user=user, is_active=True).exists():
+            return [room.pk]
+        return []
+    if customer is not None and user.is_staff:
+        return list(ChatRoom.objects.filter(chatparticipant__user=customer).values_list('pk', flat=True).distinct())
+    return list(
+        ChatParticipant.objects.filter(user=user, is_active=True).values_list('chat_room_id', flat=True)
+    )
+
+
+def _fts5_query(text):
+    """Quote every term so user input can't inject FTS5 syntax; terms are ANDed"""
+    terms = ['"%s"' % term.replace('"', '""') for term in text.split()]
+    return ' '.join(terms)
+
+
+def _postgres_ids(query, room_ids, limit, offset):
+    placeholders = ', '.join(['%s'] * len(room_ids))
+    sql = (
+        f"SELECT m.id FROM chat_chatmessage m, websearch_to_tsquery('{SEARCH_CONFIG}', %s) q "
+        f"WHERE to_tsvector('{SEARCH_CONFIG}', m.content) @@ q "
+        f"AND m.is_deleted = false AND m.chat_room_id IN ({placeholders}) "
+        f"ORDER BY ts_rank(to_tsvector('{SEARCH_CONFIG}', m.content), q) DESC, m.id DESC "
+        f"LIMIT %s OFFSET %s"
+    )
+    return sql, [query, *room_ids, limit, offset]
+
+
+def _sqlite_ids(query, room_ids, limit, offset):
+    placeholders = ', '.join(['%s'] * len(room_ids))
+    sql = (
+        "SELECT m.id FROM chat_message_fts f JOIN chat_chatmessage m ON m.id = f.rowid "
+        "WHERE chat_message_fts MATCH %s "
+        f"AND m.is_deleted = 0 AND m.chat_room_id IN ({placeholders}) "
+        "ORDER BY f.rank, m.id DESC "
+        "LIMIT %s OFFSET %s"
+    )
+    return sql, [_fts5_query(query), *room_ids, limit, offset]
+
+
+def search_messages(query, room_ids, page=1, limit=DEFAULT_LIMIT):
+    """
+    Messages in ``room_ids`` matching ``query``, best match first. Returns
+    ``(messages, has_next)`` for the 1-based ``page``.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    query = query.strip()
+    if not query or not room_ids:
+        return [], False
+
+    build = {'postgresql': _postgres_ids, 'sqlite': _sqlite_ids}.get(connection.vendor)
+    if build is None:
+        raise SearchUnavailable(connection.vendor)
+    sql, params = build(query, room_ids, limit + 1, (page - 1) * limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+
+    messages = ChatMessage.objects.select_related('chat_room', 'sender', 'attachment', 'reply_to')
+    found = messages.in_bulk(ids[:limit])
+    return [found[pk] for pk in ids[:limit] if pk in found], len(ids) > limit
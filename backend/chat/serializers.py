@@ -0,0 +1,166 @@
+from rest_framework import serializers
+from . import history, search
+from .models import ChatAttachment, ChatMessage, ChatParticipant, MessageMention, SupportTicket
+
+
+class AttachmentSerializer(serializers.ModelSerializer):
+    """``url`` is the thumbnail when there is one; ``original_url`` the uploaded file"""
+    url = serializers.SerializerMethodField()
+    original_url = serializers.FileField(source='file', read_only=True)
+
+    class Meta:
+        model = ChatAttachment
+        fields = [
+            'attachment_id', 'url', 'original_url', 'content_type', 'file_name', 'size',
+            'width', 'height', 'blurhash', 'status'
+        ]
+        read_only_fields = fields
+
+    def get_url(self, attachment):
+        url = (attachment.thumbnail or attachment.file).url
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
+class ChatMessageSerializer(serializers.ModelSerializer):
+    room_id = serializers.UUIDField(source='chat_room.room_id', read_only=True)
+    sender_name = serializers.CharField(source='sender.username', read_only=True)
+    reply_to = serializers.UUIDField(source='reply_to.message_id', read_only=True, default=None)
+    attachment = AttachmentSerializer(read_only=True)
+
+    class Meta:
+        model = ChatMessage
+        fields = [
+            'message_id', 'room_id', 'sender', 'sender_name', 'message_type',
+            'content', 'reply_to', 'attachment', 'is_edited', 'is_deleted', 'created_at'
+        ]
+        read_only_fields = fields
+
+
+class ReplyPreviewSerializer(serializers.ModelSerializer):
+    sender_name = serializers.CharField(source='sender.username', read_only=True)
+    content = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatMessage
+        fields = ['message_id', 'sender_name', 'content', 'is_deleted']
+        read_only_fields = fields
+
+    def get_content(self, message):
+        return '' if message.is_deleted else message.content[:200]
+
+
+class HistoryMessageSerializer(ChatMessageSerializer):
+    """A message in a history page, with a preview of the message it answers"""
+    reply_to_message = ReplyPreviewSerializer(source='reply_to', read_only=True)
+
+    class Meta(ChatMessageSerializer.Meta):
+        fields = ChatMessageSerializer.Meta.fields + ['seq', 'reply_to_message']
+        read_only_fields = fields
+
+    def to_representation(self, message):
+        data = super().to_representation(message)
+        if message.is_deleted:
+            data['content'] = ''
+            data['attachment'] = None
+        return data
+
+
+class MentionSerializer(serializers.ModelSerializer):
+    message = ChatMessageSerializer(read_only=True)
+
+    class Meta:
+        model = MessageMention
+        fields = ['message', 'created_at']
+        read_only_fields = fields
+
+
+class MediaSerializer(serializers.ModelSerializer):
+    sender_name = serializers.CharField(source='sender.username', read_only=True)
+    attachment = AttachmentSerializer(read_only=True)
+
+    class Meta:
+        model = ChatMessage
+        fields = [
+            'message_id', 'sender', 'sender_name', 'message_type', 'attachment', 'image',
+            'file_attachment', 'file_name', 'file_size', 'created_at'
+        ]
+        read_only_fields = fields
+
+
+class SupportTicketSerializer(serializers.ModelSerializer):
+    room_id = serializers.UUIDField(source='chat_room.room_id', read_only=True)
+    customer_name = serializers.CharField(source='customer.username', read_only=True)
+
+    class Meta:
+        model = SupportTicket
+        fields = [
+            'ticket_number', 'title', 'description', 'category', 'priority', 'status', 'customer',
+            'customer_name', 'assigned_to', 'room_id', 'due_at', 'created_at'
+        ]
+        read_only_fields = fields
+
+
+class NextTicketSerializer(serializers.Serializer):
+    category = serializers.ChoiceField(choices=SupportTicket.CATEGORIES, required=False)
+
+
+class InboxSerializer(serializers.ModelSerializer):
+    """A room as seen by one participant; reads only denormalized columns"""
+    room_id = serializers.UUIDField(source='chat_room.room_id', read_only=True)
+    name = serializers.CharField(source='chat_room.name', read_only=True)
+    room_type = serializers.CharField(source='chat_room.room_type', read_only=True)
+    member_count = serializers.IntegerField(source='chat_room.member_count', read_only=True)
+    last_message_at = serializers.DateTimeField(read_only=True)
+    last_message_preview = serializers.CharField(source='chat_room.last_message_preview', read_only=True)
+    last_message_sender = serializers.CharField(
+        source='chat_room.last_message_sender.username', read_only=True, default=None
+    )
+    unread = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ChatParticipant
+        fields = [
+            'room_id', 'name', 'room_type', 'role', 'member_count',
+            'last_message_at', 'last_message_preview', 'last_message_sender',
+            'unread', 'notifications_enabled', 'last_read_at'
+        ]
+        read_only_fields = fields
+
+
+class MarkReadSerializer(serializers.Serializer):
+    message_id = serializers.UUIDField(required=False)
+
+
+class SeenBySerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    username = serializers.CharField()
+    read_at = serializers.DateTimeField(allow_null=True)
+
+
+class HistoryQuerySerializer(serializers.Serializer):
+    before = serializers.UUIDField(required=False)
+    after = serializers.UUIDField(required=False)
+    around = serializers.UUIDField(required=False)
+    limit = serializers.IntegerField(
+        required=False, min_value=1, max_value=history.MAX_LIMIT, default=history.DEFAULT_LIMIT
+    )
+
+    def validate(self, attrs):
+        if len([key for key in ('before', 'after', 'around') if attrs.get(key)]) > 1:
+            raise serializers.ValidationError('Usa solo uno de before, after o around')
+        return attrs
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    room_id = serializers.UUIDField(required=False)
+    customer = serializers.IntegerField(required=False)
+    page = serializers.IntegerField(required=False, min_value=1, default=1)
+    limit = serializers.IntegerField(
+        required=False, min_value=1, max_value=search.MAX_LIMIT, default=search.DEFAULT_LIMIT
+    )
+
+
+class AttachmentUploadSerializer(serializers.Serializer):
+    file = serializers.FileField()
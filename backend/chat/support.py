@@ -0,0 +1,233 @@
+"""
+Support desk queue.
+
+Every ticket gets an SLA deadline when it is created (``due_at``, from its
+priority and category; see ``SUPPORT_SLA_MINUTES``), moved whenever either
+changes through ``save()`` or ``change_tickets``; a plain ``.update()`` of
+those fields does not move it. The open, unassigned tickets of a category are served in
+``due_at`` order, read from the partial ``supportticket_queue`` index. A
+``low`` ticket that has waited long enough therefore ages past a fresh
+``normal`` one, and urgent work never waits behind a backlog.
+
+Tickets reach agents in two ways:
+
+* ``claim_next`` – an agent asks for the next ticket. Like ``auto_assign``
+  it only serves available agents with fewer than ``max_open_tickets``
+  open tickets; the agent row is locked while checking, so one agent's
+  concurrent requests can't exceed it. On PostgreSQL the ticket is taken
+  with ``SELECT ... FOR UPDATE SKIP LOCKED``, so concurrent agents never
+  block on or receive the same ticket; other engines fall back to a
+  conditional UPDATE.
+* ``auto_assign`` – the ``assign_support_tickets`` job hands queued tickets
+  to the least-loaded available agent for the category. Loads come from an
+  in-memory ``LoadIndex`` refreshed from the database every
+  ``SUPPORT_LOAD_REFRESH`` seconds and updated locally on each assignment.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import SupportAgent, SupportTicket
+from .rooms import add_participants
+
+DEFAULT_SLA_MINUTES = {
+    'urgent': 30,
+    'high': 2 * 60,
+    'normal': 8 * 60,
+    'low': 24 * 60,
+}
+ACTIVE_STATUSES = ['open', 'in_progress', 'waiting_customer']
+CLAIM_ATTEMPTS = 5
+
+
+class SupportError(Exception):
+    """An agent can't take a ticket"""
+
+
+def sla_deadline(category, priority, start=None):
+    """When a ticket of ``category`` and ``priority`` opened at ``start`` should be answered"""
+    minutes = {
+        **DEFAULT_SLA_MINUTES,
+        **getattr(settings, 'SUPPORT_SLA_MINUTES', {}),
+        **getattr(settings, 'SUPPORT_CATEGORY_SLA_MINUTES', {}).get(category, {}),
+    }
+    return (start or timezone.now()) + timedelta(minutes=minutes.get(priority, minutes['normal']))
+
+
+def change_tickets(tickets, **changes):
+    """
+    Set ``priority`` and/or ``category`` on every ticket in ``tickets`` and
+    move their deadlines to match. Returns the number of tickets changed.
+    """
+    unknown = set(changes) - {'priority', 'category'}
+    if unknown:
+        raise ValueError(f"Campos no soportados: {sorted(unknown)}")
+    now = timezone.now()
+    with transaction.atomic():
+        changed = []
+        for pk, category, priority, created_at in tickets.select_for_update().values_list(
+            'pk', 'category', 'priority', 'created_at'
+        ):
+            category = changes.get('category', category)
+            priority = changes.get('priority', priority)
+            changed.append(SupportTicket(
+                pk=pk, category=category, priority=priority,
+                due_at=sla_deadline(category, priority, created_at), updated_at=now,
+            ))
+        SupportTicket.objects.bulk_update(
+            changed, ['category', 'priority', 'due_at', 'updated_at'], batch_size=500
+        )
+    return len(changed)
+
+
+def queue(categories=None):
+    """Open, unassigned tickets, most overdue first"""
+    tickets = SupportTicket.objects.filter(status='open', assigned_to__isnull=True)
+    if categories:
+        tickets = tickets.filter(category__in=categories)
+    return tickets.order_by('due_at', 'id')
+
+
+def _take(ticket_id, user, now):
+    """Assign one queued ticket to ``user``; ``False`` if someone else got it first"""
+    return bool(
+        SupportTicket.objects.filter(pk=ticket_id, status='open', assigned_to__isnull=True).update(
+            assigned_to=user, status='in_progress', updated_at=now
+        )
+    )
+
+
+def _joined(ticket_id, user):
+    ticket = SupportTicket.objects.select_related('chat_room', 'customer').get(pk=ticket_id)
+    add_participants(ticket.chat_room, [user], role='moderator')
+    return ticket
+
+
+def claim_next(user, categories=None):
+    """
+    Assign the most overdue queued ticket in ``categories`` to ``user``,
+    join them to its chat and return it (``None`` if the queue is empty).
+    Raises ``SupportError`` if ``user`` is not an available agent with room
+    for another ticket.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        agent = SupportAgent.objects.select_for_update().filter(user=user).first()
+        if agent is None or not agent.is_available or not user.is_active:
+            raise SupportError('No estás disponible para atender tickets')
+        open_tickets = SupportTicket.objects.filter(assigned_to=user, status__in=ACTIVE_STATUSES).count()
+        if open_tickets >= agent.max_open_tickets:
+            raise SupportError('Ya tienes el máximo de tickets abiertos')
+
+        if connection.features.has_select_for_update_skip_locked:
+            ticket_id = (
+                queue(categories).select_for_update(skip_locked=True).values_list('pk', flat=True).first()
+            )
+            if ticket_id is None or not _take(ticket_id, user, now):
+                return None
+        else:
+            for ticket_id in queue(categories).values_list('pk', flat=True)[:CLAIM_ATTEMPTS]:
+                if _take(ticket_id, user, now):
+                    break
+            else:
+                return None
+        ticket = _joined(ticket_id, user)
+    load_index().add(user.pk)
+    return ticket
+
+
+class LoadIndex:
+    """
+    Open tickets per available agent, held in memory. ``refresh`` reloads
+    agents and counts from the database (one query each); between refreshes
+    assignments made through this index keep it current.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'SUPPORT_LOAD_REFRESH', 30)
+        self.agents = {}
+        self.loads = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        agents = {
+            agent.user_id: agent
+            for agent in (
+                SupportAgent.objects.filter(is_available=True, user__is_active=True).select_related('user')
+            )
+        }
+        loads = dict(
+            SupportTicket.objects.filter(assigned_to__in=list(agents), status__in=ACTIVE_STATUSES)
+            .order_by()
+            .values('assigned_to')
+            .annotate(open=Count('id'))
+            .values_list('assigned_to', 'open')
+        )
+        with self.lock:
+            self.agents = agents
+            self.loads = {user_id: loads.get(user_id, 0) for user_id in agents}
+            self.loaded_at = time.monotonic()
+
+    def _fresh(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+            self.refresh()
+
+    def least_loaded(self, category):
+        """The available agent for ``category`` with the fewest open tickets and room for one more"""
+        self._fresh()
+        with self.lock:
+            candidates = [
+                (self.loads[user_id], user_id)
+                for user_id, agent in self.agents.items()
+                if agent.handles(category) and self.loads[user_id] < agent.max_open_tickets
+            ]
+        return min(candidates)[1] if candidates else None
+
+    def add(self, user_id, delta=1):
+        with self.lock:
+            if user_id in self.loads:
+                self.loads[user_id] += delta
+
+
+_load_index = None
+
+
+def load_index():
+    """The process-wide ``LoadIndex``"""
+    global _load_index
+    if _load_index is None:
+        _load_index = LoadIndex()
+    return _load_index
+
+
+def auto_assign(limit=None, categories=None, index=None):
+    """
+    Hand queued tickets, most overdue first, to the least-loaded available
+    agent of their category, skipping those nobody can take. Returns the
+    number assigned.
+    """
+    index = index or load_index()
+    index.refresh()
+    assigned = 0
+    pending = queue(categories).values_list('pk', 'category')
+    if limit:
+        pending = pending[:limit]
+    now = timezone.now()
+    for ticket_id, category in pending:
+        user_id = index.least_loaded(category)
+        if user_id is None:
+            continue
+        with transaction.atomic():
+            agent = index.agents[user_id].user
+            if not _take(ticket_id, agent, now):
+                continue
+            _joined(ticket_id, agent)
+        index.add(user_id)
+        assigned += 1
+    return assigned
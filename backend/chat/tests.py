@@ -1,3 +1,515 @@
-from django.test import TestCase
+import importlib
+import uuid
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from PIL import Image
+from rest_framework.test import APIClient
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+
+from accounts.models import User
+from events.models import Event
+from tickets.tests import TicketTestCase
+from . import archive, notifications
+from .attachments import store_upload
+from .consumers import ChatConsumer
+from .delivery import DeliveryError, LocalPushSender, get_sender
+from .history import MessageNotFound, history_page
+from .management.commands import chat_load_test
+from .mentions import mentioned_usernames, mentions_for
+from .messaging import ChatError, active_participant, post_message
+from .models import (
+    ChatAttachment, ChatMessage, ChatNotification, ChatParticipant, ChatRoom, MessageRead, SupportAgent,
+    SupportTicket,
+)
+from .notifications import MAX_DELIVERY_ATTEMPTS, RETRY_BACKOFF, deliver_notifications, notify, remind_event
+from .reads import mark_read, recount_unread, seen_by, unread_counts
+from .rooms import add_participants
+from .search import POSTGRES_INDEX, _postgres_ids, search_messages
+from .support import LoadIndex, SupportError, change_tickets, claim_next, queue
+
+
+class ChatTestCase(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(room_type='group')
+        add_participants(self.room, [self.alice, self.bob])
+
+    def participant(self, user=None):
+        return active_participant(self.room.room_id, user or self.alice)
+
+
+class PostMessageTests(ChatTestCase):
+    def test_reply_to_must_be_a_message_in_the_room(self):
+        participant = self.participant()
+        message = post_message(participant, 'hola')
+        self.assertEqual(post_message(participant, 're', reply_to=str(message.message_id)).reply_to, message)
+
+        with self.assertRaisesMessage(ChatError, 'reply_to inválido'):
+            post_message(participant, 're', reply_to='not-a-uuid')
+        with self.assertRaisesMessage(ChatError, 'El mensaje al que respondes no existe'):
+            post_message(participant, 're', reply_to=str(uuid.uuid4()))
+
+
+class ReadPositionTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.messages = [post_message(self.participant(self.bob), f'm{n}') for n in range(3)]
+
+    def test_read_position_never_moves_backwards(self):
+        participant = self.participant()
+        self.assertEqual(unread_counts(self.alice), {self.room.room_id: 3})
+
+        self.assertTrue(mark_read(participant, self.messages[2]))
+        self.assertFalse(mark_read(participant, self.messages[0]))
+        self.assertFalse(mark_read(participant))
+        self.assertEqual(ChatParticipant.objects.get(pk=participant.pk).last_read_seq, 3)
+        self.assertEqual(unread_counts(self.alice), {self.room.room_id: 0})
+
+        post_message(self.participant(self.bob), 'otro')
+        self.assertEqual(unread_counts(self.alice), {self.room.room_id: 1})
+        self.assertEqual(unread_counts(self.bob), {self.room.room_id: 0})
+
+    def test_recount_rebuilds_counters_from_messages(self):
+        mark_read(self.participant(), self.messages[1])
+        ChatRoom.objects.update(message_count=0)
+        ChatParticipant.objects.update(last_read_seq=0)
+
+        self.assertEqual(recount_unread(), 1)
+        self.assertEqual(ChatRoom.objects.get(pk=self.room.pk).message_count, 3)
+        self.assertEqual(unread_counts(self.alice), {self.room.room_id: 1})
+        self.assertEqual(unread_counts(self.bob), {self.room.room_id: 0})
+
+
+class ReadReceiptTests(ChatTestCase):
+    def test_group_receipts_come_from_read_positions(self):
+        carol = User.objects.create_user('carol', password='x')
+        add_participants(self.room, [carol])
+        first = post_message(self.participant(self.bob), 'uno')
+        second = post_message(self.participant(self.bob), 'dos')
+
+        mark_read(self.participant(), second)
+        mark_read(self.participant(carol), first)
+        self.assertEqual(seen_by(first), [(self.alice.pk, 'alice', None), (carol.pk, 'carol', None)])
+        self.assertEqual(seen_by(second), [(self.alice.pk, 'alice', None)])
+        self.assertFalse(MessageRead.objects.exists())
+
+    def test_direct_receipts_are_stored_once_per_message(self):
+        room = ChatRoom.objects.create(room_type='direct')
+        add_participants(room, [self.alice, self.bob])
+        bob = active_participant(room.room_id, self.bob)
+        first, second = post_message(bob, 'uno'), post_message(bob, 'dos')
+        alice = active_participant(room.room_id, self.alice)
+
+        mark_read(alice, first)
+        mark_read(alice, second)
+        mark_read(alice, first)
+        self.assertEqual(MessageRead.objects.filter(user=self.alice).count(), 2)
+        self.assertEqual([row[:2] for row in seen_by(second)], [(self.alice.pk, 'alice')])
+        self.assertIsNotNone(seen_by(second)[0][2])
+        self.assertEqual(seen_by(post_message(alice, 'tres')), [])
+
+
+class HistoryTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        participant = self.participant()
+        self.messages = [post_message(participant, f'm{n}') for n in range(5)]
+        # Same timestamp: the id breaks the tie
+        ChatMessage.objects.update(created_at=timezone.now())
+
+    def page(self, **cursor):
+        messages, has_before, has_after = history_page(self.room, **{'limit': 2, **cursor})
+        return [message.content for message in messages], has_before, has_after
+
+    def test_paging_back_through_equal_timestamps_visits_every_message_once(self):
+        seen = []
+        content, has_before, _ = self.page()
+        while True:
+            seen = content + seen
+            if not has_before:
+                break
+            oldest = next(m for m in self.messages if m.content == content[0])
+            content, has_before, _ = self.page(before=oldest.message_id)
+        self.assertEqual(seen, ['m0', 'm1', 'm2', 'm3', 'm4'])
+
+    def test_cursors_at_the_ends(self):
+        first, last = self.messages[0].message_id, self.messages[-1].message_id
+        self.assertEqual(self.page(), (['m3', 'm4'], True, False))
+        self.assertEqual(self.page(before=first), ([], False, True))
+        self.assertEqual(self.page(after=last), ([], True, False))
+        self.assertEqual(self.page(after=first), (['m1', 'm2'], True, True))
+        self.assertEqual(self.page(around=first, limit=3), (['m0', 'm1', 'm2'], False, True))
+        self.assertEqual(self.page(around=last, limit=3), (['m3', 'm4'], True, False))
+        self.assertEqual(self.page(limit=0), (['m4'], True, False))
+
+    def test_cursor_from_another_room_is_not_found(self):
+        other = ChatRoom.objects.create(room_type='group')
+        with self.assertRaises(MessageNotFound):
+            history_page(other, before=self.messages[0].message_id)
+
+
+class SearchTests(ChatTestCase):
+    def search(self, query, room_ids=None, **kwargs):
+        messages, has_next = search_messages(query, room_ids or [self.room.pk], **kwargs)
+        return [message.content for message in messages], has_next
+
+    def test_search_follows_edits_and_deleted_flag(self):
+        message = post_message(self.participant(), 'concierto de cumbia')
+        self.assertEqual(self.search('cumbia'), (['concierto de cumbia'], False))
+
+        ChatMessage.objects.filter(pk=message.pk).update(content='concierto de salsa')
+        self.assertEqual(self.search('cumbia'), ([], False))
+        self.assertEqual(self.search('salsa'), (['concierto de salsa'], False))
+
+        ChatMessage.objects.filter(pk=message.pk).update(is_deleted=True)
+        self.assertEqual(self.search('salsa'), ([], False))
+
+    def test_scoped_to_rooms_and_paged(self):
+        for n in range(3):
+            post_message(self.participant(), f'entrada {n}')
+        other = ChatRoom.objects.create(room_type='group')
+        add_participants(other, [self.alice])
+        post_message(active_participant(other.room_id, self.alice), 'entrada ajena')
+
+        first, has_next = self.search('entrada', limit=2)
+        self.assertEqual((len(first), has_next), (2, True))
+        rest, has_next = self.search('entrada', limit=2, page=2)
+        self.assertEqual((len(rest), has_next), (1, False))
+        self.assertNotIn('entrada ajena', first + rest)
+        self.assertEqual(self.search('entrada ajena'), ([], False))
+        self.assertEqual(self.search('   '), ([], False))
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 index')
+    def test_fts5_triggers_keep_the_index_in_step(self):
+        def indexed(term):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT rowid FROM chat_message_fts WHERE chat_message_fts MATCH %s', [term])
+                return [row[0] for row in cursor.fetchall()]
+
+        message = post_message(self.participant(), 'Canción de cuna')
+        self.assertEqual(indexed('cancion'), [message.pk])
+        ChatMessage.objects.filter(pk=message.pk).update(content='Himno')
+        self.assertEqual((indexed('cancion'), indexed('himno')), ([], [message.pk]))
+        ChatMessage.objects.filter(pk=message.pk).delete()
+        self.assertEqual(indexed('himno'), [])
+        # Input is quoted, never parsed as FTS5 syntax
+        self.assertEqual(self.search('himno OR "cuna'), ([], False))
+
+    def test_postgres_branch(self):
+        sql, params = _postgres_ids('rock & "blues"', [3, 4], 21, 20)
+        self.assertIn("websearch_to_tsquery('spanish', %s)", sql)
+        self.assertIn("to_tsvector('spanish', m.content) @@ q", sql)
+        self.assertEqual(params, ['rock & "blues"', 3, 4, 21, 20])
+
+        migration = importlib.import_module('chat.migrations.0008_message_search_index')
+        operation = migration.Migration.operations[0]
+        schema_editor = mock.Mock(connection=mock.Mock(vendor='postgresql'))
+        operation.code(None, schema_editor)
+        self.assertEqual([c.args[0] for c in schema_editor.execute.call_args_list], migration.POSTGRES_INDEX)
+        self.assertIn("USING gin (to_tsvector('spanish', content))", POSTGRES_INDEX[0])
+
+
+class MentionTests(ChatTestCase):
+    def test_parsing(self):
+        for content, expected in (
+            ('gracias @bob.', {'bob'}),
+            ('(@bob), @bob', {'bob'}),
+            ('@juan.perez y @maría_1!', {'juan.perez', 'maría_1'}),
+            ('@a+b-c', {'a+b-c'}),
+            ('escribe a bob@correo.cl', set()),
+            ('hola @ y @.', set()),
+        ):
+            with self.subTest(content=content):
+                self.assertEqual(mentioned_usernames(content), expected)
+
+    def test_only_other_active_members_are_mentioned(self):
+        carol = User.objects.create_user('carol', password='x')
+        dave = User.objects.create_user('dave', password='x')
+        add_participants(self.room, [dave])
+        message = post_message(
+            self.participant(), '@bob @carol @alice', metadata={'mentions': [dave.pk, True, str(carol.pk)]}
+        )
+
+        self.assertEqual(list(mentions_for(self.bob).values_list('message', flat=True)), [message.pk])
+        self.assertEqual(list(mentions_for(dave).values_list('message', flat=True)), [message.pk])
+        self.assertFalse(mentions_for(carol).exists())
+        self.assertFalse(mentions_for(self.alice).exists())
+        notified = ChatNotification.objects.filter(notification_type='mention')
+        self.assertEqual(sorted(notified.values_list('user__username', flat=True)), ['bob', 'dave'])
+
+
+class InboxTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def inbox(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/chat/inbox/')
+        return [(row['name'], row['member_count'], row['unread'], row['last_message_preview'])
+                for row in response.data['results']]
+
+    def test_rooms_come_newest_first_in_one_query(self):
+        quiet = ChatRoom.objects.create(room_type='group', name='quieta')
+        add_participants(quiet, [self.alice])
+        post_message(self.participant(self.bob), 'hola')
+        post_message(self.participant(self.bob), 'qué tal')
+        self.assertEqual(self.inbox(), [('', 2, 2, 'qué tal'), ('quieta', 1, 0, '')])
+
+        for n in range(3):
+            room = ChatRoom.objects.create(room_type='group', name=f'sala {n}')
+            add_participants(room, [self.alice, self.bob])
+            post_message(active_participant(room.room_id, self.alice), 'mío')
+        self.assertEqual(len(self.inbox()), 5)
+
+
+class AttachmentTests(ChatTestCase):
+    def upload(self, user, name='nota.txt'):
+        return store_upload(SimpleUploadedFile(name, b'hola', 'text/plain'), user)
+
+    def test_same_content_gets_a_row_per_upload(self):
+        first = self.upload(self.alice)
+        second = self.upload(self.bob, name='copia.txt')
+
+        self.assertNotEqual(first.attachment_id, second.attachment_id)
+        self.assertEqual((second.uploaded_by, second.file_name), (self.bob, 'copia.txt'))
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(ChatAttachment.objects.filter(uploaded_by=self.alice).get(), first)
+
+    def test_content_type_comes_from_the_bytes(self):
+        png = BytesIO()
+        Image.new('RGB', (4, 4)).save(png, format='PNG')
+        image = store_upload(SimpleUploadedFile('foto', png.getvalue(), 'text/plain'), self.alice)
+        self.assertEqual((image.content_type, image.status), ('image/png', 'pending'))
+
+        for name in ('falsa.jpg', 'pagina.html', 'dibujo.svg'):
+            with self.subTest(name=name):
+                fake = store_upload(SimpleUploadedFile(name, b'<html><script></script>', 'image/jpeg'), self.alice)
+                self.assertEqual((fake.content_type, fake.status), ('application/octet-stream', 'ready'))
+                self.assertTrue(fake.file.name.endswith('.bin'))
+
+    def test_only_the_uploader_can_send_an_attachment(self):
+        attachment = self.upload(self.alice)
+
+        with self.assertRaisesMessage(ChatError, 'El archivo adjunto no existe'):
+            post_message(self.participant(self.bob), '', attachment=str(attachment.attachment_id))
+        message = post_message(self.participant(), '', attachment=str(attachment.attachment_id))
+        self.assertEqual((message.attachment, message.content), (attachment, 'nota.txt'))
+
+    def test_attachment_stays_in_its_room(self):
+        attachment = self.upload(self.alice)
+        post_message(self.participant(), '', attachment=str(attachment.attachment_id))
+        other = ChatRoom.objects.create(room_type='group')
+        ChatParticipant.objects.create(chat_room=other, user=self.alice)
+
+        with self.assertRaisesMessage(ChatError, 'El archivo adjunto no existe'):
+            post_message(active_participant(other.room_id, self.alice), '', attachment=str(attachment.attachment_id))
+        post_message(self.participant(), 'otra vez', attachment=str(attachment.attachment_id))
+
+
+class ArchiveTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        participant = self.participant()
+        self.messages = [post_message(participant, f'm{n}') for n in range(23)]
+        archive.archive_room(self.room, segment_size=10)
+        archive._segment_index.cache_clear()
+
+    def page(self, **cursor):
+        rows, has_before, has_after = archive.history_page(self.room, limit=5, **cursor)
+        return [row['content'] for row in rows], has_before, has_after
+
+    def test_pages_are_read_through_the_segment_index(self):
+        self.assertEqual(self.page(), (['m18', 'm19', 'm20', 'm21', 'm22'], True, False))
+        self.assertEqual(self.page(before=self.messages[10].message_id), (['m5', 'm6', 'm7', 'm8', 'm9'], True, True))
+        self.assertEqual(self.page(after=self.messages[8].message_id), (['m9', 'm10', 'm11', 'm12', 'm13'], True, True))
+        self.assertEqual(self.page(around=self.messages[0].message_id), (['m0', 'm1', 'm2', 'm3', 'm4'], False, True))
+        self.assertEqual(archive._segment_index.cache_info().currsize, 3)
+
+    def test_unknown_cursor_is_not_found(self):
+        with self.assertRaises(MessageNotFound):
+            self.page(before=uuid.uuid4())
+
+
+class SupportQueueTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agent = SupportAgent.objects.create(user=self.bob, max_open_tickets=2)
+
+    def open_ticket(self, priority='normal'):
+        return SupportTicket.objects.create(
+            title='Ayuda', description='d', category='general', priority=priority, customer=self.alice,
+            chat_room=ChatRoom.objects.create(room_type='support'),
+        )
+
+    def test_claims_most_overdue_ticket_first(self):
+        normal = self.open_ticket()
+        urgent = self.open_ticket(priority='urgent')
+
+        self.assertEqual(claim_next(self.bob), urgent)
+        self.assertEqual(claim_next(self.bob), normal)
+        self.assertEqual(SupportTicket.objects.get(pk=normal.pk).assigned_to, self.bob)
+
+    def test_unavailable_agent_cannot_claim(self):
+        ticket = self.open_ticket()
+        SupportAgent.objects.filter(pk=self.agent.pk).update(is_available=False)
+
+        with self.assertRaisesMessage(SupportError, 'No estás disponible para atender tickets'):
+            claim_next(self.bob)
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        self.assertEqual(client.post('/api/chat/support/next/').status_code, 409)
+        self.assertIsNone(SupportTicket.objects.get(pk=ticket.pk).assigned_to)
+
+    def test_agent_at_capacity_cannot_claim(self):
+        for _ in range(3):
+            self.open_ticket()
+        claim_next(self.bob)
+        claim_next(self.bob)
+
+        with self.assertRaisesMessage(SupportError, 'Ya tienes el máximo de tickets abiertos'):
+            claim_next(self.bob)
+        self.assertEqual(queue().count(), 1)
+
+    def test_priority_change_moves_due_at(self):
+        ticket = SupportTicket.objects.get(pk=self.open_ticket(priority='low').pk)
+        fresh = self.open_ticket()
+        self.assertEqual(list(queue()), [fresh, ticket])
+
+        ticket.priority = 'urgent'
+        ticket.save(update_fields=['priority'])
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.due_at, ticket.created_at + timedelta(minutes=30))
+        self.assertEqual(list(queue()), [ticket, fresh])
+
+    def test_bulk_change_moves_due_at(self):
+        tickets = [self.open_ticket(priority='low') for _ in range(2)]
+        fresh = self.open_ticket()
+
+        self.assertEqual(change_tickets(SupportTicket.objects.filter(pk=tickets[1].pk), priority='urgent'), 1)
+        moved = SupportTicket.objects.get(pk=tickets[1].pk)
+        self.assertEqual((moved.priority, moved.due_at), ('urgent', moved.created_at + timedelta(minutes=30)))
+        self.assertEqual(list(queue()), [moved, fresh, tickets[0]])
+        with self.assertRaises(ValueError):
+            change_tickets(SupportTicket.objects.all(), status='closed')
+
+    def test_ticket_built_by_hand_gets_its_due_at_recomputed(self):
+        ticket = self.open_ticket(priority='low')
+        copy = SupportTicket(**{
+            field.attname: getattr(ticket, field.attname) for field in SupportTicket._meta.concrete_fields
+        })
+        copy.priority = 'urgent'
+        copy.save()
+        self.assertEqual(SupportTicket.objects.get(pk=ticket.pk).due_at, ticket.created_at + timedelta(minutes=30))
+
+    def test_load_index_loads_agent_users_with_agents(self):
+        index = LoadIndex()
+        with self.assertNumQueries(2):
+            index.refresh()
+            self.assertEqual(index.agents[self.bob.pk].user, self.bob)
+
+
+class ConsumerTests(ChatTestCase):
+    def consumer(self):
+        consumer = ChatConsumer()
+        consumer.user = self.alice
+        consumer.rooms = set()
+        consumer.send_json = mock.AsyncMock()
+        consumer.close = mock.AsyncMock()
+        return consumer
+
+    def test_bad_reply_to_sends_error_frame(self):
+        consumer = self.consumer()
+        frame = {'type': 'message', 'room_id': str(self.room.room_id), 'content': 're',
+                 'reply_to': 'not-a-uuid', 'client_id': 'c1'}
+
+        async_to_sync(consumer.receive_json)(frame)
+        consumer.send_json.assert_awaited_once_with(
+            {'type': 'error', 'error': 'reply_to inválido', 'client_id': 'c1'}
+        )
+
+        consumer.send_json.reset_mock()
+        with mock.patch.object(ChatConsumer, 'store_message', side_effect=ValidationError('bad')):
+            async_to_sync(consumer.receive_json)(frame)
+        consumer.send_json.assert_awaited_once_with(
+            {'type': 'error', 'error': 'Solicitud inválida', 'client_id': 'c1'}
+        )
+        consumer.close.assert_not_called()
+
+
+class NotificationTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        notify([self.alice.pk], 'room_update', 'Sala', 'Cambió la sala', chat_room=self.room)
+        self.notification = ChatNotification.objects.get()
+        self.push_outbox = get_sender('push').outbox
+        self.push_outbox.clear()
+
+    def deliver(self, after=timedelta(0)):
+        return deliver_notifications(window=timedelta(0), now=timezone.now() + after)
+
+    def failing_push(self):
+        return mock.patch.object(LocalPushSender, 'send', side_effect=DeliveryError('caído'))
+
+    def test_failed_digest_is_retried_with_backoff(self):
+        with self.failing_push():
+            self.assertEqual(self.deliver(), 0)
+        self.notification.refresh_from_db()
+        self.assertIsNone(self.notification.delivered_at)
+        self.assertEqual(self.notification.delivery_attempts, 1)
+
+        # Still backing off
+        self.assertEqual(self.deliver(), 0)
+        self.assertEqual(self.push_outbox, [])
+
+        self.assertEqual(self.deliver(after=RETRY_BACKOFF * 2), 1)
+        self.notification.refresh_from_db()
+        self.assertIsNotNone(self.notification.delivered_at)
+        self.assertTrue(self.notification.sent_via_push)
+        self.assertEqual(len(self.push_outbox), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        ChatNotification.objects.update(delivery_attempts=MAX_DELIVERY_ATTEMPTS - 1)
+        with self.failing_push():
+            self.deliver()
+        self.assertEqual(self.deliver(after=timedelta(days=1)), 0)
+        self.assertEqual(self.push_outbox, [])
+        self.assertEqual(ChatNotification.objects.get().delivery_attempts, MAX_DELIVERY_ATTEMPTS)
+
+    def test_claimed_notification_is_not_sent_twice(self):
+        # Claimed by a run still sending it
+        ChatNotification.objects.update(next_attempt_at=timezone.now() + notifications.CLAIM_TIMEOUT)
+        self.assertEqual(self.deliver(), 0)
+        self.assertEqual(self.push_outbox, [])
+
+    def test_reminder_is_not_marked_sent_if_notifying_fails(self):
+        self.create_ticket()
+        with mock.patch.object(notifications, 'notify', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                remind_event(self.event)
+        self.assertIsNone(Event.objects.get(pk=self.event.pk).reminder_sent_at)
+        self.assertEqual(remind_event(self.event), 1)
+
+
+class ChatLoadTestCommandTests(ChatTestCase):
+    def test_room_is_created_through_add_participants(self):
+        seen = []
+
+        def run(coroutine):
+            # Inspect the room instead of opening connections
+            coroutine.close()
+            room = ChatRoom.objects.get(name='Prueba de carga')
+            seen.append((room.member_count, room.chatparticipant_set.get().role))
+
+        with mock.patch.object(chat_load_test.asyncio, 'run', run):
+            call_command('chat_load_test', '--user', 'alice', '--connections', '1')
+        self.assertEqual(seen, [(1, 'owner')])
+        self.assertFalse(ChatRoom.objects.filter(name='Prueba de carga').exists())
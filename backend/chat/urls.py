@@ -1,9 +1,26 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import views
 
 router = DefaultRouter()
 
 urlpatterns = [
     path('', include(router.urls)),
-    # Chat endpoints will be implemented later
+    path('inbox/', views.InboxView.as_view(), name='chat_inbox'),
+    path('mentions/', views.MentionsView.as_view(), name='chat_mentions'),
+    path('search/', views.MessageSearchView.as_view(), name='chat_search'),
+    path('support/next/', views.NextTicketView.as_view(), name='chat_support_next'),
+    path('rooms/<uuid:room_id>/messages/', views.RoomHistoryView.as_view(), name='chat_history'),
+    path(
+        'rooms/<uuid:room_id>/attachments/',
+        views.AttachmentUploadView.as_view(),
+        name='chat_attachment_upload'
+    ),
+    path('rooms/<uuid:room_id>/media/', views.RoomMediaView.as_view(), name='chat_room_media'),
+    path('rooms/<uuid:room_id>/read/', views.MarkReadView.as_view(), name='chat_mark_read'),
+    path(
+        'rooms/<uuid:room_id>/messages/<uuid:message_id>/seen/',
+        views.SeenByView.as_view(),
+        name='chat_message_seen'
+    ),
 ]
@@ -1,3 +1,267 @@
-from django.shortcuts import render
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.shortcuts import get_object_or_404
+from rest_framework import generics, status
+from rest_framework.pagination import CursorPagination
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import archive
+from .models import ChatMessage, ChatParticipant, ChatRoom, SupportAgent
+from .attachments import AttachmentError, store_upload
+from .history import MessageNotFound, history_page
+from .mentions import mentions_for, room_media
+from .reads import mark_read, seen_by, with_unread
+from .search import SearchUnavailable, searchable_rooms, search_messages
+from .support import SupportError, claim_next
+from .serializers import (
+    AttachmentSerializer, AttachmentUploadSerializer, ChatMessageSerializer, HistoryMessageSerializer,
+    HistoryQuerySerializer, InboxSerializer, MarkReadSerializer, MediaSerializer, MentionSerializer,
+    NextTicketSerializer, SearchQuerySerializer, SeenBySerializer, SupportTicketSerializer
+)
 
-# Create your views here.
+User = get_user_model()
+
+
+class InboxPagination(CursorPagination):
+    """Keyset pagination on last activity; no COUNT, stable while messages arrive"""
+    ordering = ('-last_message_at', '-pk')
+    page_size = 30
+
+
+class NewestFirstPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 30
+
+
+class InboxView(generics.ListAPIView):
+    """
+    The user's rooms, most recently active first, with preview, member
+    count and unread count. One query per page.
+    """
+    serializer_class = InboxSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = InboxPagination
+
+    def get_queryset(self):
+        return with_unread(
+            ChatParticipant.objects.filter(user=self.request.user, is_active=True)
+            .select_related('chat_room__last_message_sender')
+            .annotate(last_message_at=F('chat_room__last_message_at'))
+        )
+
+
+class MarkReadView(APIView):
+    """Advance the read position to ``message_id`` (default: the latest message)"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, room_id):
+        participant = get_object_or_404(
+            ChatParticipant.objects.select_related('chat_room'),
+            chat_room__room_id=room_id, user=request.user, is_active=True
+        )
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        message = None
+        if serializer.validated_data.get('message_id'):
+            message = ChatMessage.objects.filter(
+                chat_room=participant.chat_room,
+                message_id=serializer.validated_data['message_id'],
+            ).only('seq', 'created_at').first()
+            if message is None or message.seq is None:
+                return Response(
+                    {'error': 'El mensaje no existe en este chat'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        mark_read(participant, message)
+        return Response({
+            'last_read_at': participant.last_read_at,
+            'unread': participant.unread_count,
+        })
+
+
+class SeenByView(APIView):
+    """Participants who have read a message, derived from their read positions"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_id, message_id):
+        get_object_or_404(
+            ChatParticipant, chat_room__room_id=room_id, user=request.user, is_active=True
+        )
+        message = get_object_or_404(
+            ChatMessage.objects.select_related('chat_room'),
+            chat_room__room_id=room_id, message_id=message_id, seq__isnull=False
+        )
+        readers = [
+            {'user': user_id, 'username': username, 'read_at': read_at}
+            for user_id, username, read_at in seen_by(message)
+        ]
+        return Response({
+            'message_id': message.message_id,
+            'count': len(readers),
+            'seen_by': SeenBySerializer(readers, many=True).data,
+        })
+
+
+class RoomHistoryView(APIView):
+    """
+    Messages of a room in chronological order. Without parameters returns
+    the latest page; ``before``/``after`` page from a message id and
+    ``around`` jumps to a message with context. Archived rooms are read
+    from their archive segments.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_id):
+        participant = get_object_or_404(
+            ChatParticipant.objects.select_related('chat_room'),
+            chat_room__room_id=room_id, user=request.user, is_active=True
+        )
+        query = HistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        room = participant.chat_room
+        try:
+            if room.archived_at:
+                results, has_before, has_after = archive.history_page(room, **query.validated_data)
+            else:
+                messages, has_before, has_after = history_page(room, **query.validated_data)
+                results = HistoryMessageSerializer(messages, many=True).data
+        except MessageNotFound:
+            return Response(
+                {'error': 'El mensaje no existe en este chat'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response({
+            'results': results,
+            'has_before': has_before,
+            'has_after': has_after,
+        })
+
+
+class MessageSearchView(APIView):
+    """
+    Ranked full-text search over the messages of the user's rooms. Staff
+    can narrow it to one ``room_id`` or widen it to a ``customer``'s rooms.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        room = None
+        if params.get('room_id'):
+            room = get_object_or_404(ChatRoom, room_id=params['room_id'])
+        customer = None
+        if params.get('customer') and request.user.is_staff:
+            customer = get_object_or_404(User, pk=params['customer'])
+
+        room_ids = searchable_rooms(request.user, customer=customer, room=room)
+        if room is not None and not room_ids:
+            return Response(
+                {'error': 'No participas en este chat'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            messages, has_next = search_messages(
+                params['q'], room_ids, page=params['page'], limit=params['limit']
+            )
+        except SearchUnavailable:
+            return Response(
+                {'error': 'La búsqueda no está disponible'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return Response({
+            'results': ChatMessageSerializer(messages, many=True).data,
+            'page': params['page'],
+            'has_next': has_next,
+        })
+
+
+class MentionsView(generics.ListAPIView):
+    """Messages that mention the user, newest first"""
+    serializer_class = MentionSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = NewestFirstPagination
+
+    def get_queryset(self):
+        return mentions_for(self.request.user)
+
+
+class RoomMediaView(generics.ListAPIView):
+    """Images and files shared in a room, newest first; ``?kind=image|file``"""
+    serializer_class = MediaSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = NewestFirstPagination
+
+    def get_queryset(self):
+        participant = get_object_or_404(
+            ChatParticipant.objects.select_related('chat_room'),
+            chat_room__room_id=self.kwargs['room_id'], user=self.request.user, is_active=True
+        )
+        return room_media(participant.chat_room, self.request.query_params.get('kind'))
+
+
+class AttachmentUploadView(APIView):
+    """
+    Upload a file to send in a room. Returns the attachment; the message is
+    then sent with its ``attachment_id``. Identical files are stored once.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request, room_id):
+        participant = get_object_or_404(
+            ChatParticipant, chat_room__room_id=room_id, user=request.user, is_active=True
+        )
+        if not participant.can_send_files:
+            return Response(
+                {'error': 'No tienes permiso para enviar archivos en este chat'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        serializer = AttachmentUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            attachment = store_upload(serializer.validated_data['file'], request.user)
+        except AttachmentError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            AttachmentSerializer(attachment, context={'request': request}).data,
+            status=status.HTTP_201_CREATED
+        )
+
+
+class NextTicketView(APIView):
+    """
+    Assign the most overdue queued support ticket to the calling agent and
+    join them to its chat. ``category`` narrows it to one of their queues.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        agent = SupportAgent.objects.filter(user=request.user).first()
+        if agent is None:
+            return Response(
+                {'error': 'No eres agente de soporte'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        serializer = NextTicketSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        category = serializer.validated_data.get('category')
+        if category and not agent.handles(category):
+            return Response(
+                {'error': 'No atiendes esta categoría'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            ticket = claim_next(request.user, [category] if category else agent.categories)
+        except SupportError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        if ticket is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(SupportTicketSerializer(ticket).data)
@@ -0,0 +1,120 @@
+"""
+Event cancellation pipeline.
+
+Cancelling an event fans out into a ``TicketCancellation``, a
+``PaymentRefund`` and a ``ChatNotification`` per ticket. Tickets are
+processed in primary-key chunks with bulk inserts and a single status
+UPDATE per chunk, so the pipeline can be re-run after a crash and only
+picks up whatever was not finished.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from chat.notifications import notify
+from payments.models import Payment, PaymentRefund
+from payments.refunds import refund_remaining, submit_refunds as submit_payment_refunds
+from tickets.models import Ticket, TicketCancellation
+
+CANCELLABLE_STATUSES = ['pending', 'confirmed']
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_GATEWAY_WORKERS = 8
+
+
+def cancel_event(event, cancelled_by, chunk_size=DEFAULT_CHUNK_SIZE,
+                 workers=DEFAULT_GATEWAY_WORKERS, progress=None):
+    """
+    Cancel ``event`` and all of its tickets.
+
+    ``progress`` is called as ``progress(stage, done, total)``. Returns a
+    dict with the number of tickets cancelled and refunds submitted.
+    """
+    if event.status != 'cancelled':
+        event.status = 'cancelled'
+        event.save(update_fields=['status', 'updated_at'])
+
+    cancelled = cancel_tickets(event, cancelled_by, chunk_size, progress)
+    refunded = submit_refunds(event, chunk_size, workers, progress)
+    return {'tickets_cancelled': cancelled, 'refunds_processed': refunded}
+
+
+def cancel_tickets(event, cancelled_by, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    pending = Ticket.objects.filter(
+        event=event,
+        status__in=CANCELLABLE_STATUSES,
+        cancellation__isnull=True,
+    )
+    total = pending.count()
+    done = 0
+    last_pk = 0
+
+    while True:
+        chunk = list(
+            pending.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .values_list('pk', 'customer_id')[:chunk_size]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        _cancel_chunk(event, cancelled_by, chunk)
+        done += len(chunk)
+        if progress:
+            progress('cancel', done, total)
+
+    return done
+
+
+def _cancel_chunk(event, cancelled_by, chunk):
+    ticket_ids = [pk for pk, _ in chunk]
+
+    with transaction.atomic():
+        new_refunds = refund_remaining(
+            Payment.objects.filter(ticket_id__in=ticket_ids),
+            cancelled_by,
+            reason='event_cancelled',
+        )
+        ticket_by_payment = dict(
+            Payment.objects.filter(pk__in=[refund.payment_id for refund in new_refunds])
+            .values_list('pk', 'ticket_id')
+        )
+        refund_by_ticket = {}
+        for refund in new_refunds:
+            ticket_id = ticket_by_payment[refund.payment_id]
+            refund_by_ticket[ticket_id] = refund_by_ticket.get(ticket_id, 0) + refund.refund_amount
+
+        TicketCancellation.objects.bulk_create(
+            [
+                TicketCancellation(
+                    ticket_id=pk,
+                    reason='event_cancelled',
+                    description=f"Evento cancelado: {event.title}",
+                    refund_amount=refund_by_ticket.get(pk, 0),
+                    cancelled_by=cancelled_by,
+                )
+                for pk in ticket_ids
+            ],
+            ignore_conflicts=True,
+        )
+        notify(
+            [customer_id for _, customer_id in chunk],
+            'event_cancelled',
+            f"{event.title} ha sido cancelado",
+            "Tu ticket fue cancelado y el reembolso está en proceso.",
+        )
+        Ticket.objects.filter(pk__in=ticket_ids).update(
+            status='cancelled', updated_at=timezone.now()
+        )
+
+
+def submit_refunds(event, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_GATEWAY_WORKERS,
+                   progress=None):
+    """
+    Send the event's pending refunds to the gateway through the refund
+    engine.
+    """
+    return submit_payment_refunds(
+        PaymentRefund.objects.filter(payment__ticket__event=event, reason='event_cancelled'),
+        chunk_size=chunk_size,
+        workers=workers,
+        progress=lambda done, total: progress('refund', done, total) if progress else None,
+    )
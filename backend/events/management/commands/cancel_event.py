@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from events.cancellation import cancel_event, DEFAULT_CHUNK_SIZE, DEFAULT_GATEWAY_WORKERS
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = 'Cancel an event, its tickets and refund its payments. Safe to re-run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int)
+        parser.add_argument('--user', help='Username recorded as the canceller (defaults to the organizer)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, default=DEFAULT_GATEWAY_WORKERS)
+
+    def handle(self, *args, **options):
+        try:
+            event = Event.objects.get(pk=options['event_id'])
+        except Event.DoesNotExist:
+            raise CommandError(f"Evento {options['event_id']} no existe")
+
+        cancelled_by = event.organizer
+        if options['user']:
+            try:
+                cancelled_by = get_user_model().objects.get(username=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Usuario {options['user']} no existe")
+
+        def progress(stage, done, total):
+            self.stdout.write(f"[{stage}] {done}/{total}")
+
+        result = cancel_event(
+            event,
+            cancelled_by,
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['tickets_cancelled']} tickets cancelados, "
+            f"{result['refunds_processed']} reembolsos procesados"
+        ))
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from events.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups from tickets, payments and refunds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild, YYYY-MM-DD')
+        parser.add_argument('--until', help='Last day to rebuild (inclusive), YYYY-MM-DD')
+        parser.add_argument('--days', type=int, default=2,
+                            help='Without --since, rebuild this many days up to --until')
+
+    def handle(self, *args, **options):
+        end = self._parse(options['until']) or timezone.localdate()
+        start = self._parse(options['since']) or end - timedelta(days=options['days'] - 1)
+        if start > end:
+            raise CommandError('--since debe ser anterior a --until')
+
+        rows = rebuild_rollups(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rollups reconstruidos del {start} al {end}: {rows} filas por evento"
+        ))
+
+    def _parse(self, value):
+        if not value:
+            return None
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise CommandError(f"Fecha inválida: {value}")
+        return day
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.notifications import remind_event
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = 'Notify ticket holders of events starting soon. Each event is reminded once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Remind events starting within this many hours')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        events = Event.objects.filter(
+            status__in=['published', 'sold_out'],
+            reminder_sent_at__isnull=True,
+            start_datetime__gt=now,
+            start_datetime__lte=now + timedelta(hours=options['hours']),
+        )
+        total = 0
+        for event in events.iterator():
+            sent = remind_event(event)
+            total += sent
+            self.stdout.write(f"{event.title}: {sent} recordatorios")
+        self.stdout.write(self.style.SUCCESS(f"{total} recordatorios creados"))
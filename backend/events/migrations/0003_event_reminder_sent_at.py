@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0002_daily_sales_rollups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="reminder_sent_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -116,6 +116,7 @@ class Event(models.Model):
     # Status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     featured = models.BooleanField(default=False)
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
     
     # Metadata
     tags = models.JSONField(default=list, blank=True)
@@ -221,3 +222,58 @@ class Review(models.Model):
 
     def __str__(self):
         return f"Review by {self.reviewer.username} for {self.event.title} - {self.rating}★"
+
+
+class DailySales(models.Model):
+    """
+    Pre-aggregated sales per day, kept by events.rollups so dashboards never
+    scan tickets or payments
+    """
+    day = models.DateField()
+    tickets_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refunds = models.PositiveIntegerField(default=0)
+    refunded_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    check_ins = models.PositiveIntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+        ordering = ['day']
+
+
+class EventDailySales(DailySales):
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta(DailySales.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'day'], name='eventdailysales_event_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} {self.day}: {self.tickets_sold} tickets"
+
+
+class CultorDailySales(DailySales):
+    cultor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta(DailySales.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['cultor', 'day'], name='cultordailysales_cultor_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.cultor_id} {self.day}: {self.tickets_sold} tickets"
+
+
+class CategoryDailySales(DailySales):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta(DailySales.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'day'], name='categorydailysales_category_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.category_id} {self.day}: {self.tickets_sold} tickets"
@@ -0,0 +1,158 @@
+"""
+Sales rollups for the organizer dashboard.
+
+``EventDailySales``, ``CultorDailySales`` and ``CategoryDailySales`` hold
+tickets sold, revenue, refunds and check-ins per local day. They are kept
+current by the code paths that change state (payment completion, refund
+results, check-in): each calls one of the ``record_*`` functions, which
+aggregates the affected rows with one query and adds the deltas with one
+``F()`` UPDATE per (key, day). ``rebuild_rollups`` recomputes whole days from
+the source tables and is what the ``rebuild_sales_rollups`` catch-up job runs.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from payments.models import Payment, PaymentRefund
+from tickets.models import Ticket
+
+from .models import CategoryDailySales, CultorDailySales, EventDailySales
+
+SOLD_STATUSES = ['completed', 'partially_refunded', 'refunded']
+METRICS = ['tickets_sold', 'revenue', 'refunds', 'refunded_amount', 'check_ins']
+
+# (model, key field, position of the key in a delta key)
+TABLES = [
+    (EventDailySales, 'event_id', 0),
+    (CultorDailySales, 'cultor_id', 1),
+    (CategoryDailySales, 'category_id', 2),
+]
+
+
+def _collect(rows, event_path, deltas, **metrics):
+    """
+    Add aggregated ``rows`` (already grouped by event and ``day``) to
+    ``deltas``, keyed by ``(event_id, cultor_id, category_id, day)``.
+    """
+    for row in rows:
+        key = (
+            row[f'{event_path}_id'],
+            row[f'{event_path}__cultor_id'],
+            row[f'{event_path}__category_id'],
+            row['day'],
+        )
+        for metric, column in metrics.items():
+            deltas[key][metric] += row[column] or 0
+
+
+def _grouped(queryset, event_path, moment, **aggregates):
+    return (
+        queryset.annotate(day=TruncDate(moment))
+        .values(f'{event_path}_id', f'{event_path}__cultor_id', f'{event_path}__category_id', 'day')
+        .annotate(**aggregates)
+        .order_by()
+    )
+
+
+def sales_deltas(payments, deltas=None):
+    deltas = deltas if deltas is not None else defaultdict(lambda: defaultdict(int))
+    rows = _grouped(
+        payments.filter(status__in=SOLD_STATUSES, processed_at__isnull=False),
+        'ticket__event', 'processed_at',
+        sold=Count('id'), amount=Sum('total_amount'),
+    )
+    _collect(rows, 'ticket__event', deltas, tickets_sold='sold', revenue='amount')
+    return deltas
+
+
+def refund_deltas(refunds, deltas=None):
+    deltas = deltas if deltas is not None else defaultdict(lambda: defaultdict(int))
+    rows = _grouped(
+        refunds.filter(status='completed', processed_at__isnull=False),
+        'payment__ticket__event', 'processed_at',
+        count=Count('id'), amount=Sum('refund_amount'),
+    )
+    _collect(rows, 'payment__ticket__event', deltas, refunds='count', refunded_amount='amount')
+    return deltas
+
+
+def check_in_deltas(tickets, deltas=None):
+    deltas = deltas if deltas is not None else defaultdict(lambda: defaultdict(int))
+    rows = _grouped(
+        tickets.filter(checked_in_at__isnull=False),
+        'event', 'checked_in_at',
+        count=Count('id'),
+    )
+    _collect(rows, 'event', deltas, check_ins='count')
+    return deltas
+
+
+def _per_table(deltas, index):
+    totals = defaultdict(lambda: defaultdict(int))
+    for key, metrics in deltas.items():
+        for metric, value in metrics.items():
+            totals[(key[index], key[3])][metric] += value
+    return totals
+
+
+def apply_deltas(deltas):
+    """Add ``deltas`` to the three rollup tables"""
+    if not deltas:
+        return
+    now = timezone.now()
+    with transaction.atomic():
+        for model, field, index in TABLES:
+            totals = _per_table(deltas, index)
+            model.objects.bulk_create(
+                [model(**{field: key, 'day': day}) for key, day in totals],
+                ignore_conflicts=True,
+            )
+            for (key, day), metrics in sorted(totals.items()):
+                model.objects.filter(**{field: key, 'day': day}).update(
+                    updated_at=now,
+                    **{metric: F(metric) + value for metric, value in metrics.items() if value},
+                )
+
+
+def record_sales(payments):
+    apply_deltas(sales_deltas(payments))
+
+
+def record_refunds(refunds):
+    apply_deltas(refund_deltas(refunds))
+
+
+def record_check_ins(tickets):
+    apply_deltas(check_in_deltas(tickets))
+
+
+def rebuild_rollups(start, end):
+    """
+    Recompute the rollups for the local days ``start`` to ``end`` (both
+    inclusive) from payments, refunds and tickets. Returns the number of
+    event-day rows written.
+    """
+    tz = timezone.get_current_timezone()
+    since = timezone.make_aware(datetime.combine(start, time.min), tz)
+    until = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz)
+
+    deltas = sales_deltas(Payment.objects.filter(processed_at__gte=since, processed_at__lt=until))
+    refund_deltas(PaymentRefund.objects.filter(processed_at__gte=since, processed_at__lt=until), deltas)
+    check_in_deltas(Ticket.objects.filter(checked_in_at__gte=since, checked_in_at__lt=until), deltas)
+
+    written = 0
+    with transaction.atomic():
+        for model, field, index in TABLES:
+            model.objects.filter(day__gte=start, day__lte=end).delete()
+            rows = [
+                model(**{field: key, 'day': day}, **{m: metrics.get(m, 0) for m in METRICS})
+                for (key, day), metrics in _per_table(deltas, index).items()
+            ]
+            model.objects.bulk_create(rows, batch_size=1000)
+            if model is EventDailySales:
+                written = len(rows)
+    return written
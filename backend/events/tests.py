@@ -1,3 +1,158 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chat.models import ChatNotification
+from payments.commissions import create_commissions
+from payments.models import Commission, Payment, PaymentMethod, PaymentRefund
+from payments.payouts import build_payout_run
+from tickets.models import Ticket, TicketCancellation
+from tickets.tests import TicketTestCase
+from .cancellation import cancel_event
+from .models import CategoryDailySales, CultorDailySales, EventDailySales
+from .rollups import METRICS, rebuild_rollups, record_check_ins, record_refunds, record_sales
+
+
+class SalesTestCase(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        method = PaymentMethod.objects.create(name='Webpay', payment_type='webpay')
+        now = timezone.now()
+        for _ in range(2):
+            payment = Payment.objects.create(
+                user=self.alice, ticket=self.create_ticket(checked_in_at=now), payment_method=method,
+                status='completed', subtotal=Decimal('10000'), total_amount=Decimal('10000'), processed_at=now,
+            )
+        PaymentRefund.objects.create(
+            payment=payment, processed_by=self.organizer, refund_amount=Decimal('4000'), reason='x',
+            status='completed', processed_at=now,
+        )
+        self.today = timezone.localdate()
+
+
+class SalesRollupTests(SalesTestCase):
+    def metrics(self, model=EventDailySales):
+        return model.objects.values(*METRICS).get()
+
+    def test_rebuild_job_recomputes_the_day(self):
+        EventDailySales.objects.create(event=self.event, day=self.today, revenue=Decimal('1'))
+
+        call_command('rebuild_sales_rollups', '--days', '1', stdout=io.StringIO())
+        expected = {
+            'tickets_sold': 2, 'revenue': Decimal('20000'), 'refunds': 1,
+            'refunded_amount': Decimal('4000'), 'check_ins': 2,
+        }
+        self.assertEqual(self.metrics(), expected)
+        self.assertEqual(self.metrics(CultorDailySales), expected)
+        self.assertEqual(self.metrics(CategoryDailySales), expected)
+
+    def test_recorded_deltas_match_rebuild(self):
+        record_sales(Payment.objects.all())
+        record_refunds(PaymentRefund.objects.all())
+        record_check_ins(Ticket.objects.all())
+        recorded = self.metrics()
+
+        self.assertEqual(rebuild_rollups(self.today, self.today), 1)
+        self.assertEqual(self.metrics(), recorded)
+
+    def test_invalid_day_is_a_command_error(self):
+        with self.assertRaisesMessage(CommandError, 'Fecha inválida: 2026-02-31'):
+            call_command('rebuild_sales_rollups', '--since', '2026-02-31')
+
+
+class SalesDashboardTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        rebuild_rollups(self.today, self.today)
+        self.client = APIClient()
+
+    def dashboard(self, user, **params):
+        self.client.force_authenticate(user)
+        return self.client.get('/api/events/dashboard/sales/', params)
+
+    def test_totals_for_organizer_and_cultor(self):
+        response = self.dashboard(self.organizer)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['totals']['revenue'], Decimal('20000'))
+        self.assertEqual(response.data['daily'][0]['day'], self.today)
+        self.assertEqual(self.dashboard(self.cultor).data['as_cultor']['tickets_sold'], 2)
+        self.assertIsNone(self.dashboard(self.bob).data['totals']['revenue'])
+
+    def test_days_outside_the_range_are_left_out(self):
+        yesterday = (self.today - timedelta(days=1)).isoformat()
+        response = self.dashboard(self.organizer, end=yesterday)
+        self.assertEqual(response.data['daily'], [])
+
+    def test_invalid_ranges_are_rejected(self):
+        for params in (
+            {'start': '2026-02-31'},
+            {'end': 'ayer'},
+            {'start': '2026-03-02', 'end': '2026-03-01'},
+            {'start': '2025-01-01', 'end': '2026-03-01'},
+        ):
+            with self.subTest(**params):
+                self.assertEqual(self.dashboard(self.organizer, **params).status_code, 400)
+
+
+class CancelEventTests(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.method = PaymentMethod.objects.create(name='Webpay', payment_type='webpay')
+        self.paid = self.pay(self.create_ticket())
+        self.partly_refunded = self.pay(
+            self.create_ticket(customer=self.bob), status='partially_refunded',
+            refunded_total=Decimal('3000'), refund_completed_total=Decimal('3000'),
+        )
+        self.unpaid = self.create_ticket(status='pending')
+        self.used = self.create_ticket(status='used')
+        create_commissions(Payment.objects.all())
+
+    def pay(self, ticket, status='completed', **kwargs):
+        return Payment.objects.create(
+            user=ticket.customer, ticket=ticket, payment_method=self.method, status=status,
+            subtotal=Decimal('10000'), total_amount=Decimal('10000'), processed_at=timezone.now(), **kwargs
+        )
+
+    def test_cancels_tickets_and_refunds_what_is_left(self):
+        result = cancel_event(self.event, self.organizer, chunk_size=1)
+
+        self.assertEqual(result, {'tickets_cancelled': 3, 'refunds_processed': 2})
+        self.assertEqual(
+            dict(Ticket.objects.values_list('pk', 'status')),
+            {self.paid.ticket_id: 'refunded', self.partly_refunded.ticket_id: 'refunded',
+             self.unpaid.pk: 'cancelled', self.used.pk: 'used'},
+        )
+        self.assertEqual(
+            sorted(PaymentRefund.objects.values_list('refund_amount', 'status')),
+            [(Decimal('7000'), 'completed'), (Decimal('10000'), 'completed')],
+        )
+        for payment in Payment.objects.all():
+            self.assertEqual((payment.status, payment.refund_completed_total), ('refunded', Decimal('10000')))
+        self.assertEqual(
+            TicketCancellation.objects.get(ticket_id=self.partly_refunded.ticket_id).refund_amount, Decimal('7000')
+        )
+        self.assertEqual(ChatNotification.objects.filter(notification_type='event_cancelled').count(), 3)
+
+    def test_commissions_are_reversed_and_not_paid_out(self):
+        cancel_event(self.event, self.organizer)
+
+        self.assertEqual(
+            list(Commission.objects.values_list('gross_amount', 'cultor_earning', 'is_paid_to_cultor')),
+            [(Decimal('0'), Decimal('0'), False)] * 2,
+        )
+        self.assertIsNone(build_payout_run(payout_method='cash'))
+
+    def test_second_run_does_nothing(self):
+        cancel_event(self.event, self.organizer)
+        notified = ChatNotification.objects.filter(notification_type='event_cancelled').count()
+
+        self.assertEqual(
+            cancel_event(self.event, self.organizer), {'tickets_cancelled': 0, 'refunds_processed': 0}
+        )
+        self.assertEqual(PaymentRefund.objects.count(), 2)
+        self.assertEqual(TicketCancellation.objects.count(), 3)
+        self.assertEqual(ChatNotification.objects.filter(notification_type='event_cancelled').count(), notified)
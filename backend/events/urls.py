@@ -11,4 +11,5 @@ urlpatterns = [
     path('', include(router.urls)),
     path('featured/', views.FeaturedEventsView.as_view(), name='featured_events'),
     path('upcoming/', views.UpcomingEventsView.as_view(), name='upcoming_events'),
+    path('dashboard/sales/', views.SalesDashboardView.as_view(), name='sales_dashboard'),
 ]
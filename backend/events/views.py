@@ -1,15 +1,23 @@
-from rest_framework import viewsets, generics, filters
+from datetime import timedelta
+
+from rest_framework import viewsets, generics, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db.models import Q, Sum
 from django.utils import timezone
-from .models import Event, Category, Location
+from django.utils.dateparse import parse_date
+from .models import Event, Category, Location, EventDailySales, CultorDailySales, CategoryDailySales
+from .rollups import METRICS
 from .serializers import (
     EventListSerializer, EventDetailSerializer, EventCreateSerializer,
     CategorySerializer, LocationSerializer
 )
 
+MAX_DASHBOARD_DAYS = 366
+
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.filter(is_active=True)
@@ -78,3 +86,65 @@ class UpcomingEventsView(generics.ListAPIView):
             status='published',
             start_datetime__gte=timezone.now()
         ).order_by('start_datetime')[:10]
+
+
+class SalesDashboardView(APIView):
+    """
+    Sales for the events the user organizes or performs in, read from the
+    daily rollups. ``start``/``end`` are inclusive days (default: last 30),
+    at most ``MAX_DASHBOARD_DAYS`` apart.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        days = {}
+        for param in ('start', 'end'):
+            value = request.query_params.get(param)
+            try:
+                days[param] = parse_date(value) if value else None
+            except ValueError:
+                days[param] = None
+            if value and days[param] is None:
+                return Response(
+                    {'error': f'Fecha inválida en {param}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        end = days['end'] or timezone.localdate()
+        start = days['start'] or end - timedelta(days=29)
+        if start > end:
+            return Response(
+                {'error': 'La fecha de inicio debe ser anterior a la de término'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if (end - start).days >= MAX_DASHBOARD_DAYS:
+            return Response(
+                {'error': f'El rango no puede superar {MAX_DASHBOARD_DAYS} días'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        user = request.user
+        sums = {metric: Sum(metric) for metric in METRICS}
+        events = EventDailySales.objects.filter(
+            Q(event__organizer=user) | Q(event__cultor=user),
+            day__gte=start, day__lte=end,
+        )
+        data = {
+            'start': start,
+            'end': end,
+            'totals': events.aggregate(**sums),
+            'daily': list(events.values('day').annotate(**sums).order_by('day')),
+            'events': list(
+                events.values('event_id', 'event__title').annotate(**sums).order_by('-revenue')
+            ),
+            'as_cultor': CultorDailySales.objects.filter(
+                cultor=user, day__gte=start, day__lte=end
+            ).aggregate(**sums),
+        }
+        if user.is_staff:
+            data['categories'] = list(
+                CategoryDailySales.objects.filter(day__gte=start, day__lte=end)
+                .values('category_id', 'category__name')
+                .annotate(**sums)
+                .order_by('-revenue')
+            )
+        return Response(data)
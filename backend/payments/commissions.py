@@ -0,0 +1,199 @@
+"""
+Set-based commission generation.
+
+Paid payments without a ``Commission``, including those refunded since,
+are read in primary-key
+chunks with one joined query each. Amounts are computed from the
+commission rates, which are loaded once, and each chunk is written with
+a single ``bulk_create`` plus one batch of ledger postings. Payment
+completion and historic backfills go through the same path.
+
+Commissions are computed on the share of the sale that was not refunded.
+When a refund completes later, the commission of its payment is brought down to
+the share of the sale that was kept and the difference is posted back
+against the refunds account.
+"""
+import logging
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .ledger import commission_posting, commission_reversal_posting, post_transactions
+from .models import Commission, CommissionRate, Payment
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 2000
+# Payments that were captured, whether or not they were refunded since
+COMMISSIONABLE_STATUSES = ['completed', 'partially_refunded', 'refunded']
+CENT = Decimal('0.01')
+
+
+def load_rates():
+    """Active rate overrides as ``({cultor_id: pct}, {category_id: pct})``"""
+    by_cultor = {}
+    by_category = {}
+    for cultor_id, category_id, percentage in CommissionRate.objects.filter(
+        is_active=True
+    ).values_list('cultor_id', 'category_id', 'platform_percentage'):
+        if cultor_id:
+            by_cultor[cultor_id] = percentage
+        else:
+            by_category[category_id] = percentage
+    return by_cultor, by_category
+
+
+def platform_percentage(rates, cultor_id, category_id):
+    by_cultor, by_category = rates
+    if cultor_id in by_cultor:
+        return by_cultor[cultor_id]
+    if category_id in by_category:
+        return by_category[category_id]
+    return Decimal(str(settings.PLATFORM_COMMISSION_PERCENTAGE))
+
+
+def kept_share(total_amount, refunded):
+    """Fraction of a payment that has not been refunded"""
+    if not total_amount:
+        return Decimal('1')
+    return (total_amount - refunded) / total_amount
+
+
+def split(subtotal, transport_fee, percentage, kept=Decimal('1')):
+    """``(gross, platform, transport)`` for the ``kept`` share of a sale"""
+    gross = (subtotal * kept).quantize(CENT, rounding=ROUND_HALF_UP)
+    transport = min(((transport_fee or Decimal('0')) * kept).quantize(CENT, rounding=ROUND_HALF_UP), gross)
+    platform = ((gross - transport) * percentage / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+    return gross, platform, transport
+
+
+def build_commission(row, rates):
+    """Build an unsaved Commission from a joined payment row"""
+    percentage = platform_percentage(rates, row['ticket__event__cultor_id'], row['ticket__event__category_id'])
+    gross, platform, transport = split(
+        row['subtotal'], row['ticket__transport_fee'], percentage,
+        kept_share(row['total_amount'], row['refund_completed_total']),
+    )
+    return Commission(
+        payment_id=row['pk'],
+        cultor_id=row['ticket__event__cultor_id'],
+        event_id=row['ticket__event_id'],
+        gross_amount=gross,
+        platform_percentage=percentage,
+        platform_commission=platform,
+        transport_commission=transport,
+        transport_provider_id=row['ticket__transport_assigned__driver_id'],
+        cultor_earning=gross - platform - transport,
+    )
+
+
+def pending_payments(start=None, end=None):
+    payments = Payment.objects.filter(status__in=COMMISSIONABLE_STATUSES, commission__isnull=True)
+    if start:
+        payments = payments.filter(processed_at__gte=start)
+    if end:
+        payments = payments.filter(processed_at__lt=end)
+    return payments
+
+
+def _insert(commissions):
+    """
+    Insert ``commissions`` in one statement. If a concurrent run got to some
+    of the payments first, fall back to row by row and skip those. Returns
+    the number inserted.
+    """
+    try:
+        with transaction.atomic():
+            Commission.objects.bulk_create(commissions)
+        return len(commissions)
+    except IntegrityError:
+        pass
+    inserted = 0
+    for commission in commissions:
+        commission.pk = None
+        try:
+            with transaction.atomic():
+                commission.save(force_insert=True)
+        except IntegrityError:
+            continue
+        inserted += 1
+    return inserted
+
+
+def create_commissions(payments, chunk_size=DEFAULT_CHUNK_SIZE, rates=None, progress=None):
+    """
+    Create commissions for the paid payments in ``payments`` that do not
+    have one yet, on the amount not refunded. Returns the number created.
+    """
+    rates = rates or load_rates()
+    created = 0
+    last_pk = 0
+    while True:
+        rows = list(
+            payments.filter(status__in=COMMISSIONABLE_STATUSES, commission__isnull=True, pk__gt=last_pk)
+            .order_by('pk')
+            .values(
+                'pk', 'subtotal', 'total_amount', 'refund_completed_total', 'ticket__event_id', 'ticket__event__cultor_id',
+                'ticket__event__category_id', 'ticket__transport_fee',
+                'ticket__transport_assigned__driver_id',
+            )[:chunk_size]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1]['pk']
+
+        with transaction.atomic():
+            created += _insert([build_commission(row, rates) for row in rows])
+            commissions = Commission.objects.filter(
+                payment_id__in=[row['pk'] for row in rows]
+            )
+            post_transactions([commission_posting(commission) for commission in commissions])
+
+        if progress:
+            progress(created)
+    return created
+
+
+def create_commission_for_payment(payment):
+    """Create the commission for a single payment that just completed"""
+    return create_commissions(Payment.objects.filter(pk=payment.pk))
+
+
+def reverse_commissions(refunds):
+    """
+    Bring the commissions of the payments of ``refunds``, which have just
+    completed, down to the share of each payment that was not refunded.
+    Earnings already paid out stay paid; what was reversed on them is left
+    as a debt on the recipient's ledger account. Returns the number of
+    commissions changed.
+    """
+    last_refund = {}
+    for refund in refunds:
+        last_refund[refund.payment_id] = max(refund.pk, last_refund.get(refund.payment_id, 0))
+    commissions = list(
+        Commission.objects.select_for_update(of=('self',))
+        .filter(payment_id__in=list(last_refund))
+        .select_related('payment__ticket')
+        .order_by('pk')
+    )
+    postings = []
+    for commission in commissions:
+        payment = commission.payment
+        before = commission_posting(commission)
+        commission.gross_amount, commission.platform_commission, commission.transport_commission = split(
+            payment.subtotal, payment.ticket.transport_fee, commission.platform_percentage,
+            kept_share(payment.total_amount, payment.refund_completed_total),
+        )
+        commission.cultor_earning = (
+            commission.gross_amount - commission.platform_commission - commission.transport_commission
+        )
+        postings.append(commission_reversal_posting(before, commission, last_refund[payment.pk]))
+        if commission.is_paid_to_cultor or commission.is_paid_to_transport_provider:
+            logger.warning('Commission %s was paid out before payment %s was refunded', commission.pk, payment.pk)
+
+    Commission.objects.bulk_update(
+        commissions, ['gross_amount', 'platform_commission', 'transport_commission', 'cultor_earning']
+    )
+    post_transactions(postings)
+    return len(commissions)
@@ -0,0 +1,123 @@
+"""
+Streaming financial exports.
+
+Rows are read with ``values_list().iterator(chunk_size=...)`` (a
+server-side cursor on PostgreSQL). They are encoded to CSV one chunk at
+a time and optionally gzip-compressed on the fly, so memory stays flat
+whatever the size of the export.
+"""
+import csv
+import zlib
+
+from .models import Commission, Invoice, Payment, PaymentRefund
+
+DEFAULT_CHUNK_SIZE = 2000
+
+EXPORTS = {
+    'sales': (Payment, [
+        ('payment_id', 'payment_id'),
+        ('created_at', 'created_at'),
+        ('processed_at', 'processed_at'),
+        ('status', 'status'),
+        ('customer_email', 'user__email'),
+        ('event', 'ticket__event__title'),
+        ('payment_type', 'payment_method__payment_type'),
+        ('subtotal', 'subtotal'),
+        ('tax_amount', 'tax_amount'),
+        ('fee_amount', 'fee_amount'),
+        ('total_amount', 'total_amount'),
+        ('currency', 'currency'),
+        ('external_id', 'external_id'),
+    ]),
+    'commissions': (Commission, [
+        ('commission_id', 'id'),
+        ('created_at', 'created_at'),
+        ('payment_id', 'payment__payment_id'),
+        ('event', 'event__title'),
+        ('cultor', 'cultor__username'),
+        ('gross_amount', 'gross_amount'),
+        ('platform_percentage', 'platform_percentage'),
+        ('platform_commission', 'platform_commission'),
+        ('transport_commission', 'transport_commission'),
+        ('transport_provider', 'transport_provider__username'),
+        ('cultor_earning', 'cultor_earning'),
+        ('is_paid_to_cultor', 'is_paid_to_cultor'),
+        ('payout_reference', 'payout_reference'),
+        ('is_paid_to_transport_provider', 'is_paid_to_transport_provider'),
+        ('transport_payout_reference', 'transport_payout_reference'),
+    ]),
+    'refunds': (PaymentRefund, [
+        ('refund_id', 'refund_id'),
+        ('created_at', 'created_at'),
+        ('processed_at', 'processed_at'),
+        ('payment_id', 'payment__payment_id'),
+        ('status', 'status'),
+        ('refund_amount', 'refund_amount'),
+        ('reason', 'reason'),
+        ('external_id', 'external_id'),
+    ]),
+    'invoices': (Invoice, [
+        ('invoice_number', 'invoice_number'),
+        ('invoice_type', 'invoice_type'),
+        ('created_at', 'created_at'),
+        ('folio', 'folio'),
+        ('payment_id', 'payment__payment_id'),
+        ('customer_name', 'customer_name'),
+        ('customer_rut', 'customer_rut'),
+        ('customer_email', 'customer_email'),
+        ('subtotal', 'subtotal'),
+        ('tax_rate', 'tax_rate'),
+        ('tax_amount', 'tax_amount'),
+        ('total_amount', 'total_amount'),
+        ('is_sent', 'is_sent'),
+    ]),
+}
+
+
+class Echo:
+    """File-like object that hands back what is written, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(name, start=None, end=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the header and then every row of an export, ordered by primary key"""
+    model, columns = EXPORTS[name]
+    rows = model.objects.all()
+    if start:
+        rows = rows.filter(created_at__gte=start)
+    if end:
+        rows = rows.filter(created_at__lt=end)
+    yield [header for header, _ in columns]
+    yield from rows.order_by('pk').values_list(
+        *[field for _, field in columns]
+    ).iterator(chunk_size=chunk_size)
+
+
+def csv_chunks(rows, rows_per_chunk=500):
+    """Encode rows as UTF-8 CSV, yielding one bytes chunk per ``rows_per_chunk`` rows"""
+    writer = csv.writer(Echo())
+    buffer = []
+    for row in rows:
+        buffer.append(writer.writerow(row))
+        if len(buffer) >= rows_per_chunk:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of bytes chunks on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(name, start=None, end=None, compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    chunks = csv_chunks(export_rows(name, start, end, chunk_size))
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,179 @@
+"""
+Payment gateway clients.
+
+Each ``PaymentMethod.payment_type`` maps to a gateway class through the
+``PAYMENT_GATEWAYS`` setting. The default mapping points at deterministic
+simulators so development and tests never talk to a real provider.
+Gateway I/O runs on a shared, bounded thread pool with a timeout, so a
+slow provider cannot pin a web worker.
+"""
+import hashlib
+import hmac
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class GatewayError(Exception):
+    """Raised when a payment gateway rejects or fails a request"""
+
+
+class GatewayTimeout(GatewayError):
+    """Raised when a payment gateway does not answer in time"""
+
+
+class PaymentGateway:
+    """
+    Interface every gateway client implements. ``reference`` is our own
+    identifier for the operation and is passed to the provider as its
+    idempotency key, so repeating a call never charges or refunds twice.
+    """
+    name = None
+
+    def __init__(self, payment_method=None):
+        self.payment_method = payment_method
+
+    def charge(self, payment, reference, data=None):
+        raise NotImplementedError
+
+    def refund(self, payment, amount, reference):
+        raise NotImplementedError
+
+    def verify_webhook(self, body, signature):
+        """Check the HMAC-SHA256 signature the gateway sent with a callback"""
+        secret = getattr(self.payment_method, 'secret_key', '')
+        if not secret or not signature:
+            return False
+        expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def parse_webhook(self, payload):
+        """
+        Normalise a callback payload into ``event_id``, ``event_type``,
+        ``reference`` (our payment_id) and the gateway ``response``.
+        """
+        return {
+            'event_id': str(payload['id']),
+            'event_type': payload['type'],
+            'reference': str(payload.get('reference', '')),
+            'response': payload.get('data', {}),
+        }
+
+
+class SimulatorGateway(PaymentGateway):
+    """
+    Deterministic local stand-in for a real gateway. Results depend only on
+    the inputs: card numbers ending in ``0002`` are declined and the same
+    reference always yields the same external id.
+    """
+    name = 'local'
+    declined_suffix = '0002'
+
+    def _external_id(self, kind, reference):
+        digest = hashlib.sha1(f"{self.name}:{kind}:{reference}".encode()).hexdigest()
+        return f"{self.name}-{kind}-{digest[:16]}"
+
+    def _simulate_latency(self):
+        latency = getattr(settings, 'PAYMENT_SIMULATOR_LATENCY', 0)
+        if latency:
+            time.sleep(latency)
+
+    def charge(self, payment, reference, data=None):
+        self._simulate_latency()
+        data = data or {}
+        if str(data.get('card_number', '')).endswith(self.declined_suffix):
+            return {
+                'status': 'failed',
+                'external_id': self._external_id('charge', reference),
+                'error': 'Transacción rechazada',
+            }
+        return {
+            'status': 'completed',
+            'external_id': self._external_id('charge', reference),
+            'amount': str(payment.total_amount),
+            'currency': payment.currency,
+        }
+
+    def refund(self, payment, amount, reference):
+        self._simulate_latency()
+        return {
+            'status': 'completed',
+            'external_id': self._external_id('refund', reference),
+            'amount': str(amount),
+        }
+
+
+class WebpaySimulator(SimulatorGateway):
+    name = 'webpay'
+
+    def charge(self, payment, reference, data=None):
+        response = super().charge(payment, reference, data)
+        response['authorization_code'] = response['external_id'][-6:].upper()
+        response['response_code'] = 0 if response['status'] == 'completed' else -1
+        return response
+
+
+class MercadoPagoSimulator(SimulatorGateway):
+    name = 'mercadopago'
+
+    def _external_id(self, kind, reference):
+        digest = hashlib.sha1(f"{self.name}:{kind}:{reference}".encode()).hexdigest()
+        return str(int(digest[:12], 16))
+
+    def charge(self, payment, reference, data=None):
+        response = super().charge(payment, reference, data)
+        response['status_detail'] = 'accredited' if response['status'] == 'completed' else 'cc_rejected_other_reason'
+        return response
+
+
+class KhipuSimulator(SimulatorGateway):
+    name = 'khipu'
+
+    def charge(self, payment, reference, data=None):
+        response = super().charge(payment, reference, data)
+        response['payment_url'] = f"https://khipu.local/payment/{response['external_id']}"
+        return response
+
+
+DEFAULT_GATEWAYS = {
+    'webpay': 'payments.gateways.WebpaySimulator',
+    'mercadopago': 'payments.gateways.MercadoPagoSimulator',
+    'khipu': 'payments.gateways.KhipuSimulator',
+}
+
+_executor = None
+
+
+def get_gateway(payment_method=None):
+    """Return the gateway client configured for a payment method"""
+    gateways = {**DEFAULT_GATEWAYS, **getattr(settings, 'PAYMENT_GATEWAYS', {})}
+    payment_type = getattr(payment_method, 'payment_type', None)
+    gateway_class = gateways.get(payment_type, 'payments.gateways.SimulatorGateway')
+    return import_string(gateway_class)(payment_method)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'PAYMENT_GATEWAY_WORKERS', 16),
+            thread_name_prefix='payment-gateway',
+        )
+    return _executor
+
+
+def call_gateway(method, *args, timeout=None):
+    """
+    Run a gateway call on the shared pool and wait at most ``timeout``
+    seconds for it. The call keeps running in the background if it times
+    out; its idempotency reference makes the eventual retry safe.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'PAYMENT_GATEWAY_TIMEOUT', 10)
+    future = _get_executor().submit(method, *args)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        raise GatewayTimeout('La pasarela de pago no respondió a tiempo')
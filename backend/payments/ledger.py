@@ -0,0 +1,284 @@
+"""
+Double-entry ledger postings.
+
+Every money movement is posted as a balanced ``LedgerTransaction``. Account
+balances are updated incrementally under a row lock, and each entry records
+``balance_after``. A balance is therefore one row read, and a statement is
+one range scan on the (account, created_at, id) index.
+
+Accounts (balances are debit minus credit):
+
+* ``clearing`` (asset): money held at the gateways.
+* ``unearned`` (liability): ticket sales not yet split into commissions.
+* ``fee_revenue`` / ``platform_revenue`` (revenue): platform income.
+* ``refunds`` (expense): money returned to customers.
+* ``cultor:<id>`` / ``transport:<id>`` (liability): earnings owed to a recipient.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import LedgerAccount, LedgerEntry, LedgerTransaction, Payment
+
+SYSTEM_ACCOUNTS = {
+    'clearing': ('Fondos en pasarelas', 'asset'),
+    'unearned': ('Ventas por distribuir', 'liability'),
+    'fee_revenue': ('Ingresos por cargos', 'revenue'),
+    'platform_revenue': ('Comisiones de plataforma', 'revenue'),
+    'refunds': ('Reembolsos', 'expense'),
+}
+
+
+class UnbalancedTransaction(Exception):
+    """The lines of a posting do not add up to zero"""
+
+
+def cultor_account(user_id):
+    return f"cultor:{user_id}"
+
+
+def transport_account(user_id):
+    return f"transport:{user_id}"
+
+
+def _account_defaults(code):
+    if code in SYSTEM_ACCOUNTS:
+        name, account_type = SYSTEM_ACCOUNTS[code]
+        return {'name': name, 'account_type': account_type, 'owner_id': None}
+    kind, user_id = code.split(':', 1)
+    names = {'cultor': 'Saldo cultor', 'transport': 'Saldo transportista'}
+    return {'name': f"{names[kind]} {user_id}", 'account_type': 'liability', 'owner_id': int(user_id)}
+
+
+def post_transactions(postings):
+    """
+    Post many transactions at once. Each posting is a dict with
+    ``reference``, ``lines`` (``[(account_code, amount), ...]``), an
+    optional ``description`` and source ids (``payment_id``, ``refund_id``,
+    ``commission_id`` or ``payout_id``). Postings whose reference already exists
+    are skipped. Returns the number of transactions posted.
+    """
+    for posting in postings:
+        if sum(amount for _, amount in posting['lines']) != 0:
+            raise UnbalancedTransaction(posting['reference'])
+    try:
+        return _post(postings)
+    except IntegrityError:
+        # A concurrent post of the same reference committed first: re-read and skip it
+        return _post(postings)
+
+
+def _post(postings):
+    with transaction.atomic():
+        codes = sorted({code for p in postings for code, _ in p['lines']})
+        LedgerAccount.objects.bulk_create(
+            [LedgerAccount(code=code, **_account_defaults(code)) for code in codes],
+            ignore_conflicts=True,
+        )
+        # Lock in a stable order so concurrent postings cannot deadlock. A
+        # concurrent post of the same reference locks the same accounts, so
+        # it is committed (and seen below) before we get past this point.
+        accounts = {
+            account.code: account
+            for account in LedgerAccount.objects.select_for_update().filter(code__in=codes).order_by('code')
+        }
+
+        existing = set(
+            LedgerTransaction.objects.filter(
+                reference__in=[p['reference'] for p in postings]
+            ).values_list('reference', flat=True)
+        )
+        seen = set()
+        new = []
+        for posting in postings:
+            if posting['reference'] in existing or posting['reference'] in seen:
+                continue
+            seen.add(posting['reference'])
+            new.append(posting)
+        if not new:
+            return 0
+
+        LedgerTransaction.objects.bulk_create([
+            LedgerTransaction(
+                reference=p['reference'],
+                description=p.get('description', ''),
+                payment_id=p.get('payment_id'),
+                refund_id=p.get('refund_id'),
+                commission_id=p.get('commission_id'),
+                payout_id=p.get('payout_id'),
+            )
+            for p in new
+        ])
+        transactions = dict(
+            LedgerTransaction.objects.filter(reference__in=seen).values_list('reference', 'pk')
+        )
+
+        now = timezone.now()
+        entries = []
+        for posting in new:
+            for code, amount in posting['lines']:
+                if not amount:
+                    continue
+                account = accounts[code]
+                account.balance += amount
+                account.updated_at = now
+                entries.append(LedgerEntry(
+                    transaction_id=transactions[posting['reference']],
+                    account=account,
+                    amount=amount,
+                    balance_after=account.balance,
+                ))
+        LedgerEntry.objects.bulk_create(entries)
+        LedgerAccount.objects.bulk_update(accounts.values(), ['balance', 'updated_at'])
+    return len(new)
+
+
+def post_transaction(reference, lines, description='', **source_ids):
+    return post_transactions([
+        {'reference': reference, 'lines': lines, 'description': description, **source_ids}
+    ])
+
+
+def payment_posting(payment):
+    """Customer money captured by a gateway"""
+    fee = payment.fee_amount
+    return {
+        'reference': f"payment:{payment.pk}:captured",
+        'description': f"Pago {payment.payment_id}",
+        'payment_id': payment.pk,
+        'lines': [
+            ('clearing', payment.total_amount),
+            ('unearned', -(payment.total_amount - fee)),
+            ('fee_revenue', -fee),
+        ],
+    }
+
+
+def commission_posting(commission):
+    """Split a sale between the cultor, the transport provider and the platform"""
+    lines = [
+        ('unearned', commission.gross_amount),
+        (cultor_account(commission.cultor_id), -commission.cultor_earning),
+        ('platform_revenue', -commission.platform_commission),
+    ]
+    if commission.transport_commission:
+        # Commissions without a provider keep the transport share on the platform
+        code = (
+            transport_account(commission.transport_provider_id)
+            if commission.transport_provider_id else 'platform_revenue'
+        )
+        lines.append((code, -commission.transport_commission))
+    return {
+        'reference': f"commission:{commission.pk}",
+        'description': f"Comisión evento {commission.event_id}",
+        'commission_id': commission.pk,
+        'payment_id': commission.payment_id,
+        'lines': lines,
+    }
+
+
+def commission_reversal_posting(before, commission, refund_id):
+    """
+    Take back from the recipients the part of a commission that was
+    refunded. ``before`` is the commission posting of its previous amounts.
+    """
+    lines = {}
+    for sign, posting in ((-1, before), (1, commission_posting(commission))):
+        for code, amount in posting['lines']:
+            if code != 'unearned':
+                lines[code] = lines.get(code, 0) + sign * amount
+    reversed_amount = sum(lines.values())
+    return {
+        'reference': f"commission:{commission.pk}:refund:{refund_id}",
+        'description': f"Reverso comisión evento {commission.event_id}",
+        'commission_id': commission.pk,
+        'payment_id': commission.payment_id,
+        'refund_id': refund_id,
+        'lines': [*lines.items(), ('refunds', -reversed_amount)],
+    }
+
+
+def refund_posting(refund):
+    """Money returned to a customer"""
+    return {
+        'reference': f"refund:{refund.pk}",
+        'description': f"Reembolso {refund.refund_id}",
+        'refund_id': refund.pk,
+        'payment_id': refund.payment_id,
+        'lines': [
+            ('refunds', refund.refund_amount),
+            ('clearing', -refund.refund_amount),
+        ],
+    }
+
+
+def payout_posting(payout, account_code):
+    """Money transferred out to a cultor or transport provider"""
+    return {
+        'reference': f"payout:{payout.pk}",
+        'description': f"Pago a {payout.recipient_id}",
+        'payout_id': payout.pk,
+        'lines': [
+            (account_code, payout.total_amount),
+            ('clearing', -payout.total_amount),
+        ],
+    }
+
+
+def account_balance(code):
+    """Current balance of an account (debits minus credits)"""
+    return LedgerAccount.objects.filter(code=code).values_list('balance', flat=True).first() or Decimal('0')
+
+
+def statement(code, start=None, end=None):
+    """Entries of an account in a date range, with running balances"""
+    entries = LedgerEntry.objects.filter(account__code=code).select_related('transaction')
+    if start:
+        entries = entries.filter(created_at__gte=start)
+    if end:
+        entries = entries.filter(created_at__lt=end)
+    return entries.order_by('created_at', 'id')
+
+
+def reconcile():
+    """
+    Check the ledger against itself and against payments. Returns a list of
+    human-readable problems; an empty list means the books reconcile.
+    """
+    problems = []
+
+    total = LedgerEntry.objects.aggregate(total=Sum('amount'))['total'] or 0
+    if total != 0:
+        problems.append(f"Las entradas no suman cero: {total}")
+
+    unbalanced = (
+        LedgerEntry.objects.values('transaction__reference')
+        .annotate(total=Sum('amount'))
+        .exclude(total=0)
+    )
+    for row in unbalanced:
+        problems.append(f"Transacción descuadrada {row['transaction__reference']}: {row['total']}")
+
+    sums = dict(LedgerEntry.objects.values('account_id').annotate(total=Sum('amount')).values_list('account_id', 'total'))
+    for account in LedgerAccount.objects.all():
+        if sums.get(account.pk, 0) != account.balance:
+            problems.append(
+                f"Saldo de {account.code} ({account.balance}) no coincide con sus entradas ({sums.get(account.pk, 0)})"
+            )
+
+    captured = dict(
+        LedgerEntry.objects.filter(
+            account__code='clearing', transaction__reference__endswith=':captured'
+        ).values_list('transaction__payment_id', 'amount')
+    )
+    paid = Payment.objects.filter(
+        status__in=['completed', 'partially_refunded', 'refunded']
+    ).values_list('pk', 'total_amount')
+    for payment_id, amount in paid:
+        if captured.get(payment_id) != amount:
+            problems.append(
+                f"Pago {payment_id}: total {amount}, contabilizado {captured.get(payment_id)}"
+            )
+    return problems
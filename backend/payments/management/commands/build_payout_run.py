@@ -0,0 +1,52 @@
+import sys
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.models import Payout
+from payments.payouts import DEFAULT_BATCH_SIZE, build_payout_run, write_bank_transfer_file
+from payments.utils import parse_moment_option
+
+
+class Command(BaseCommand):
+    help = (
+        'Pay out unpaid cultor and transport-provider earnings and export the '
+        'bank-transfer batch file. Recipients without bank details are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Path of the CSV batch file (default: stdout)')
+        parser.add_argument('--min-amount', type=Decimal, default=Decimal('0'),
+                            help='Skip recipients owed less than this amount')
+        parser.add_argument('--until', help='Only include commissions created before this date')
+        parser.add_argument('--payout-method', default='bank_transfer',
+                            choices=[choice for choice, _ in Payout.PAYOUT_TYPES])
+        parser.add_argument('--user', help='Username recorded as processed_by')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        processed_by = None
+        if options['user']:
+            try:
+                processed_by = get_user_model().objects.get(username=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Usuario {options['user']} no existe")
+
+        reference = build_payout_run(
+            processed_by=processed_by,
+            payout_method=options['payout_method'],
+            min_amount=options['min_amount'],
+            until=parse_moment_option(options['until']),
+            batch_size=options['batch_size'],
+        )
+        if reference is None:
+            self.stderr.write('No hay comisiones pendientes de pago')
+            return
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as stream:
+                rows = write_bank_transfer_file(reference, stream, options['batch_size'])
+        else:
+            rows = write_bank_transfer_file(reference, sys.stdout, options['batch_size'])
+        self.stderr.write(self.style.SUCCESS(f"{reference}: {rows} pagos generados"))
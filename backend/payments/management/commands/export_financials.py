@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from payments.exports import DEFAULT_CHUNK_SIZE, EXPORTS, export_stream
+from payments.utils import parse_moment_option
+
+
+class Command(BaseCommand):
+    help = 'Stream a financial export (sales, commissions, refunds, invoices) to CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS))
+        parser.add_argument('--since', help='created_at lower bound (inclusive)')
+        parser.add_argument('--until', help='created_at upper bound (exclusive)')
+        parser.add_argument('--output', help='Output file (default: stdout)')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        chunks = export_stream(
+            options['name'],
+            parse_moment_option(options['since']),
+            parse_moment_option(options['until']),
+            compress=options['gzip'],
+            chunk_size=options['chunk_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'wb') as stream:
+                for chunk in chunks:
+                    stream.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
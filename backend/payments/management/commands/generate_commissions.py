@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from payments.commissions import DEFAULT_CHUNK_SIZE, create_commissions, pending_payments
+from payments.utils import parse_moment_option
+
+
+class Command(BaseCommand):
+    help = 'Create missing commissions for paid payments in a processed_at window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Start of the window (inclusive), YYYY-MM-DD or ISO datetime')
+        parser.add_argument('--until', help='End of the window (exclusive), YYYY-MM-DD or ISO datetime')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        start = parse_moment_option(options['since'])
+        end = parse_moment_option(options['until'])
+
+        created = create_commissions(
+            pending_payments(start, end),
+            chunk_size=options['chunk_size'],
+            progress=lambda done: self.stdout.write(f"{done} comisiones creadas"),
+        )
+        self.stdout.write(self.style.SUCCESS(f"{created} comisiones creadas en total"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.dte import (
+    DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, FoliosExhausted, issue_invoices, send_invoices, sign_invoices
+)
+
+
+class Command(BaseCommand):
+    help = 'Issue, sign and send electronic invoices (DTE) for completed payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                            help='Processes used to sign and render invoices')
+        parser.add_argument('--no-send', action='store_true', help='Do not email the invoices')
+
+    def handle(self, *args, **options):
+        issued = 0
+        try:
+            while True:
+                count = issue_invoices(batch_size=options['batch_size'])
+                if not count:
+                    break
+                issued += count
+        except FoliosExhausted as exc:
+            raise CommandError(str(exc))
+
+        signed = sign_invoices(batch_size=options['batch_size'], workers=options['workers'])
+        sent = 0 if options['no_send'] else send_invoices(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{issued} documentos emitidos, {signed} firmados, {sent} enviados"
+        ))
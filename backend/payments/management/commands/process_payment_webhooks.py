@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.webhooks import process_webhooks, release_partition, webhook_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Apply queued payment gateway webhooks. Workers lease partitions, so '
+        'any number can run and each payment still sees its events in order.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partition', type=int, action='append',
+                            help='Partition(s) to drain (default: all)')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit')
+        parser.add_argument('--release', type=int, metavar='PARTITION',
+                            help='Resume a parked partition, retrying its failed event, and exit')
+        parser.add_argument('--skip', action='store_true',
+                            help='With --release, leave the failed event failed instead of retrying it')
+
+    def handle(self, *args, **options):
+        partitions = options['partition']
+        if partitions:
+            invalid = [p for p in partitions if not 0 <= p < webhook_partitions()]
+            if invalid:
+                raise CommandError(f"Particiones inválidas: {invalid}")
+
+        if options['release'] is not None:
+            if not release_partition(options['release'], skip=options['skip']):
+                raise CommandError(f"La partición {options['release']} no está detenida")
+            self.stdout.write(self.style.SUCCESS(f"Partición {options['release']} reanudada"))
+            return
+
+        while True:
+            handled = process_webhooks(partitions, options['batch_size'])
+            if handled:
+                self.stdout.write(f"{handled} webhooks procesados")
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
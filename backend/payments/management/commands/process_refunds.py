@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from payments.refunds import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_ATTEMPTS, DEFAULT_WORKERS, submit_refunds
+
+
+class Command(BaseCommand):
+    help = 'Send pending refunds to their payment gateways'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+        parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                            help='Gateway attempts per refund in this run when the gateway times out')
+
+    def handle(self, *args, **options):
+        submitted = submit_refunds(
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            max_attempts=options['max_attempts'],
+            progress=lambda done, total: self.stdout.write(f"{done}/{total}"),
+        )
+        self.stdout.write(self.style.SUCCESS(f"{submitted} reembolsos enviados"))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.ledger import payment_posting, post_transactions, reconcile
+from payments.models import Payment
+
+
+class Command(BaseCommand):
+    help = 'Verify that the ledger balances and matches captured payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help='Post captured payments that are missing from the ledger first')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            missing = Payment.objects.filter(
+                status__in=['completed', 'partially_refunded', 'refunded'],
+            ).exclude(
+                ledger_transactions__reference__endswith=':captured',
+            ).order_by('pk')
+            posted = 0
+            last_pk = 0
+            while True:
+                chunk = list(missing.filter(pk__gt=last_pk)[:options['chunk_size']])
+                if not chunk:
+                    break
+                last_pk = chunk[-1].pk
+                posted += post_transactions([payment_posting(payment) for payment in chunk])
+            self.stdout.write(f"{posted} pagos contabilizados")
+
+        problems = reconcile()
+        for problem in problems:
+            self.stderr.write(problem)
+        if problems:
+            raise CommandError(f"El libro mayor no cuadra ({len(problems)} diferencias)")
+        self.stdout.write(self.style.SUCCESS('El libro mayor cuadra'))
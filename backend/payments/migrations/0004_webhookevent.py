@@ -0,0 +1,80 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0003_payment_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "gateway",
+                    models.CharField(
+                        choices=[
+                            ("credit_card", "Tarjeta de Crédito"),
+                            ("debit_card", "Tarjeta de Débito"),
+                            ("bank_transfer", "Transferencia Bancaria"),
+                            ("cash", "Efectivo"),
+                            ("webpay", "Webpay"),
+                            ("paypal", "PayPal"),
+                            ("mercadopago", "MercadoPago"),
+                            ("khipu", "Khipu"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("external_id", models.CharField(max_length=200)),
+                ("event_type", models.CharField(max_length=100)),
+                ("payment_reference", models.CharField(blank=True, max_length=200)),
+                ("partition", models.PositiveSmallIntegerField(default=0)),
+                ("payload", models.JSONField(default=dict)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pendiente"),
+                            ("processed", "Procesado"),
+                            ("ignored", "Ignorado"),
+                            ("failed", "Fallido"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "partition", "id"], name="webhookevent_queue"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="webhookevent",
+            constraint=models.UniqueConstraint(
+                fields=("gateway", "external_id"),
+                name="webhookevent_gateway_external_id",
+            ),
+        ),
+    ]
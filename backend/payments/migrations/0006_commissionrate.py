@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("payments", "0005_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CommissionRate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "platform_percentage",
+                    models.DecimalField(decimal_places=2, max_digits=5),
+                ),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "category",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="commission_rates",
+                        to="events.category",
+                    ),
+                ),
+                (
+                    "cultor",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="commission_rates",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="commissionrate",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    ("category__isnull", False),
+                    ("cultor__isnull", False),
+                    _connector="OR",
+                ),
+                name="commissionrate_has_target",
+            ),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:38
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0006_commissionrate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FolioRange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "invoice_type",
+                    models.CharField(
+                        choices=[
+                            ("boleta", "Boleta"),
+                            ("factura", "Factura"),
+                            ("factura_exenta", "Factura Exenta"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("start_folio", models.PositiveIntegerField()),
+                ("end_folio", models.PositiveIntegerField()),
+                ("next_folio", models.PositiveIntegerField()),
+                ("authorization", models.TextField(blank=True)),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["invoice_type", "start_folio"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="foliorange",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    ("next_folio__gte", models.F("start_folio")),
+                    (
+                        "next_folio__lte",
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("end_folio"), "+", models.Value(1)
+                        ),
+                    ),
+                ),
+                name="foliorange_next_in_range",
+            ),
+        ),
+    ]
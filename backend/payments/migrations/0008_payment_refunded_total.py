@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:40
+
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Least
+
+ACTIVE_REFUND_STATUSES = ["pending", "processing", "completed", "failed"]
+
+
+def backfill_refunded_total(apps, schema_editor):
+    Payment = apps.get_model("payments", "Payment")
+    PaymentRefund = apps.get_model("payments", "PaymentRefund")
+    refunded = (
+        PaymentRefund.objects.filter(
+            payment=OuterRef("pk"), status__in=ACTIVE_REFUND_STATUSES
+        )
+        .values("payment")
+        .annotate(total=Sum("refund_amount"))
+        .values("total")
+    )
+    Payment.objects.filter(refunds__isnull=False).update(
+        refunded_total=Least(
+            Coalesce(Subquery(refunded, output_field=DecimalField()), 0, output_field=DecimalField()),
+            "total_amount",
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0007_foliorange"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="refunded_total",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_refunded_total, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="payment",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    ("refunded_total__gte", 0),
+                    ("refunded_total__lte", models.F("total_amount")),
+                ),
+                name="payment_refunded_within_total",
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:19
+
+from django.db import migrations, models
+from django.db.models import Count
+
+ACTIVE_STATUSES = ["pending", "processing", "completed", "partially_refunded"]
+
+
+def cancel_duplicate_intents(apps, schema_editor):
+    """
+    Keep one active payment per ticket: the paid one if there is one, else
+    the newest intent. The unfinished extras are cancelled.
+    """
+    Payment = apps.get_model("payments", "Payment")
+    active = Payment.objects.filter(status__in=ACTIVE_STATUSES)
+    tickets = (
+        active.order_by().values("ticket").annotate(n=Count("id")).filter(n__gt=1).values_list("ticket", flat=True)
+    )
+    for ticket_id in tickets:
+        payments = list(active.filter(ticket_id=ticket_id).order_by("-created_at", "-pk"))
+        paid = [p for p in payments if p.status in ("completed", "partially_refunded")]
+        keep = (paid or payments)[0]
+        Payment.objects.filter(pk__in=[p.pk for p in payments if p.pk != keep.pk]).exclude(
+            status__in=["completed", "partially_refunded"]
+        ).update(status="cancelled")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0009_number_sequence"),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_intents, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="payment",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    (
+                        "status__in",
+                        ["pending", "processing", "completed", "partially_refunded"],
+                    )
+                ),
+                fields=("ticket",),
+                name="payment_one_active_per_ticket",
+            ),
+        ),
+    ]
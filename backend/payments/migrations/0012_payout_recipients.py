@@ -0,0 +1,80 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("payments", "0011_webhook_partitions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="commission",
+            name="is_paid_to_transport_provider",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="commission",
+            name="paid_to_transport_provider_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="commission",
+            name="transport_payout_reference",
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name="payout",
+            name="recipient_type",
+            field=models.CharField(
+                choices=[("cultor", "Cultor"), ("transport", "Transporte")],
+                default="cultor",
+                max_length=20,
+            ),
+        ),
+        migrations.CreateModel(
+            name="PayoutAccount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bank_name", models.CharField(max_length=100)),
+                (
+                    "account_type",
+                    models.CharField(
+                        choices=[
+                            ("checking", "Cuenta Corriente"),
+                            ("vista", "Cuenta Vista"),
+                            ("savings", "Cuenta de Ahorro"),
+                        ],
+                        default="checking",
+                        max_length=20,
+                    ),
+                ),
+                ("account_number", models.CharField(max_length=50)),
+                ("account_holder_name", models.CharField(max_length=200)),
+                ("account_holder_rut", models.CharField(blank=True, max_length=12)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="payout_account",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
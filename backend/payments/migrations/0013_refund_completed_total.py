@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:32
+
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Least
+
+REFUND_STATUSES = ["completed", "partially_refunded", "refunded"]
+
+
+def backfill_refund_completed_total(apps, schema_editor):
+    Payment = apps.get_model("payments", "Payment")
+    PaymentRefund = apps.get_model("payments", "PaymentRefund")
+    completed = (
+        PaymentRefund.objects.filter(payment=OuterRef("pk"), status="completed")
+        .values("payment")
+        .annotate(total=Sum("refund_amount"))
+        .values("total")
+    )
+    Payment.objects.filter(pk__in=PaymentRefund.objects.filter(status="completed").values("payment")).update(
+        refund_completed_total=Least(
+            Coalesce(Subquery(completed, output_field=DecimalField()), 0, output_field=DecimalField()),
+            "refunded_total",
+        )
+    )
+    # The status used to follow refunds that were only requested
+    Payment.objects.filter(status__in=REFUND_STATUSES).update(
+        status=Case(
+            When(refund_completed_total__gte=F("total_amount"), then=Value("refunded")),
+            When(refund_completed_total__gt=0, then=Value("partially_refunded")),
+            default=Value("completed"),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0012_payout_recipients"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="refund_completed_total",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name="paymentrefund",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_refund_completed_total, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="payment",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    ("refund_completed_total__gte", 0),
+                    ("refund_completed_total__lte", models.F("refunded_total")),
+                ),
+                name="payment_refund_completed_within_refunded",
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0013_refund_completed_total"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="webhookevent",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pendiente"),
+                    ("processed", "Procesado"),
+                    ("ignored", "Ignorado"),
+                    ("rejected", "Rechazado"),
+                    ("failed", "Fallido"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -53,6 +53,10 @@ class PaymentMethod(models.Model):
         return self.fixed_fee + percentage_fee
 
 
+# A ticket has at most one payment in these states
+ACTIVE_PAYMENT_STATUSES = ['pending', 'processing', 'completed', 'partially_refunded']
+
+
 class Payment(models.Model):
     """
     Payment transactions
@@ -70,6 +74,7 @@ class Payment(models.Model):
     # Identification
     payment_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     external_id = models.CharField(max_length=200, blank=True)  # Gateway transaction ID
+    idempotency_key = models.CharField(max_length=100, null=True, blank=True)  # Client-supplied
     
     # Relations
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payments')
@@ -82,6 +87,10 @@ class Payment(models.Model):
     fee_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default='CLP')
+    # Refunds requested and not cancelled, kept by payments.refunds
+    refunded_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Refunds the gateway has completed; the refund status is decided from it
+    refund_completed_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
     # Status and dates
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -104,6 +113,27 @@ class Payment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'idempotency_key'],
+                name='payment_user_idempotency_key',
+            ),
+            models.UniqueConstraint(
+                fields=['ticket'],
+                condition=models.Q(status__in=ACTIVE_PAYMENT_STATUSES),
+                name='payment_one_active_per_ticket',
+            ),
+            models.CheckConstraint(
+                check=models.Q(refunded_total__gte=0)
+                & models.Q(refunded_total__lte=models.F('total_amount')),
+                name='payment_refunded_within_total',
+            ),
+            models.CheckConstraint(
+                check=models.Q(refund_completed_total__gte=0)
+                & models.Q(refund_completed_total__lte=models.F('refunded_total')),
+                name='payment_refund_completed_within_refunded',
+            ),
+        ]
 
     @property
     def is_successful(self):
@@ -115,6 +145,10 @@ class Payment(models.Model):
             refund_percentage = 100
         return (self.total_amount * Decimal(refund_percentage)) / 100
 
+    @property
+    def refundable_amount(self):
+        return self.total_amount - self.refunded_total
+
 
 class PaymentRefund(models.Model):
     """
@@ -143,6 +177,8 @@ class PaymentRefund(models.Model):
     # Status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     processed_at = models.DateTimeField(null=True, blank=True)
+    # Gateway calls made so far, across every submission
+    attempts = models.PositiveIntegerField(default=0)
     
     # Gateway response
     gateway_response = models.JSONField(default=dict, blank=True)
@@ -187,13 +223,17 @@ class Commission(models.Model):
     is_paid_to_cultor = models.BooleanField(default=False)
     paid_to_cultor_at = models.DateTimeField(null=True, blank=True)
     payout_reference = models.CharField(max_length=200, blank=True)
+    is_paid_to_transport_provider = models.BooleanField(default=False)
+    paid_to_transport_provider_at = models.DateTimeField(null=True, blank=True)
+    transport_payout_reference = models.CharField(max_length=200, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
 
     def save(self, *args, **kwargs):
-        if not self.platform_commission:
+        # A zero commission is a valid value, only compute the ones not set
+        if self.platform_commission is None:
             self.platform_commission = (self.gross_amount * self.platform_percentage) / 100
-        if not self.cultor_earning:
+        if self.cultor_earning is None:
             self.cultor_earning = self.gross_amount - self.platform_commission - self.transport_commission
         super().save(*args, **kwargs)
 
@@ -201,6 +241,44 @@ class Commission(models.Model):
         return f"Commission for {self.cultor.username} - Event: {self.event.title}"
 
 
+class CommissionRate(models.Model):
+    """
+    Platform percentage overrides. A cultor rate wins over a category rate,
+    which wins over the PLATFORM_COMMISSION_PERCENTAGE setting.
+    """
+    category = models.ForeignKey(
+        'events.Category', 
+        on_delete=models.CASCADE, 
+        null=True, 
+        blank=True,
+        related_name='commission_rates'
+    )
+    cultor = models.ForeignKey(
+        User, 
+        on_delete=models.CASCADE, 
+        null=True, 
+        blank=True,
+        related_name='commission_rates'
+    )
+    platform_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(category__isnull=False) | models.Q(cultor__isnull=False),
+                name='commissionrate_has_target',
+            ),
+        ]
+
+    def __str__(self):
+        target = self.cultor or self.category
+        return f"{target}: {self.platform_percentage}%"
+
+
 class Payout(models.Model):
     """
     Payouts to cultors and transport providers
@@ -220,11 +298,17 @@ class Payout(models.Model):
         ('cash', 'Efectivo'),
     )
     
+    RECIPIENT_TYPES = (
+        ('cultor', 'Cultor'),
+        ('transport', 'Transporte'),
+    )
+    
     # Identification
     payout_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     
     # Relations
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payouts')
+    recipient_type = models.CharField(max_length=20, choices=RECIPIENT_TYPES, default='cultor')
     commissions = models.ManyToManyField(Commission, related_name='payouts')
     
     # Amount and method
@@ -261,6 +345,30 @@ class Payout(models.Model):
         ordering = ['-created_at']
 
 
+class PayoutAccount(models.Model):
+    """
+    Bank account where a cultor or transport provider receives payouts
+    """
+    ACCOUNT_TYPES = (
+        ('checking', 'Cuenta Corriente'),
+        ('vista', 'Cuenta Vista'),
+        ('savings', 'Cuenta de Ahorro'),
+    )
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='payout_account')
+    bank_name = models.CharField(max_length=100)
+    account_type = models.CharField(max_length=20, choices=ACCOUNT_TYPES, default='checking')
+    account_number = models.CharField(max_length=50)
+    account_holder_name = models.CharField(max_length=200)
+    account_holder_rut = models.CharField(max_length=12, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.account_holder_name} - {self.bank_name} {self.account_number}"
+
+
 class Invoice(models.Model):
     """
     Invoices for payments (for tax purposes)
@@ -309,3 +417,213 @@ class Invoice(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+
+
+class WebhookEvent(models.Model):
+    """
+    Gateway callbacks, stored as received and applied later by the
+    process_payment_webhooks worker
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pendiente'),
+        ('processed', 'Procesado'),
+        ('ignored', 'Ignorado'),
+        ('rejected', 'Rechazado'),  # Refers to no payment of ours, never retried
+        ('failed', 'Fallido'),
+    )
+    
+    # Identification
+    gateway = models.CharField(max_length=20, choices=PaymentMethod.PAYMENT_TYPES)
+    external_id = models.CharField(max_length=200)  # Gateway event ID
+    event_type = models.CharField(max_length=100)
+    
+    # Payment the event refers to (our payment_id, as sent to the gateway)
+    payment_reference = models.CharField(max_length=200, blank=True)
+    partition = models.PositiveSmallIntegerField(default=0)
+    payload = models.JSONField(default=dict)
+    
+    # Processing
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)  # Backoff after a failed attempt
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['gateway', 'external_id'], name='webhookevent_gateway_external_id'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'partition', 'id'], name='webhookevent_queue'),
+        ]
+
+    def __str__(self):
+        return f"Webhook {self.gateway}:{self.external_id} - {self.event_type}"
+
+
+class WebhookPartition(models.Model):
+    """
+    Ownership of a webhook partition. A worker holds a time-limited lease
+    while it drains the partition; a partition whose event failed for good
+    is parked on that event until it is released.
+    """
+    number = models.PositiveSmallIntegerField(unique=True)
+    leased_by = models.CharField(max_length=100, blank=True)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    
+    parked_event = models.ForeignKey(
+        WebhookEvent, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    parked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['number']
+
+    def __str__(self):
+        return f"Webhook partition {self.number}"
+
+
+class FolioRange(models.Model):
+    """
+    Folio ranges authorised by the SII (CAF) for each document type.
+    Folios are handed out in blocks, see payments.dte.reserve_folios.
+    """
+    invoice_type = models.CharField(max_length=20, choices=Invoice.INVOICE_TYPES)
+    start_folio = models.PositiveIntegerField()
+    end_folio = models.PositiveIntegerField()
+    next_folio = models.PositiveIntegerField()
+    
+    authorization = models.TextField(blank=True)  # CAF XML
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['invoice_type', 'start_folio']
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(next_folio__gte=models.F('start_folio'))
+                & models.Q(next_folio__lte=models.F('end_folio') + 1),
+                name='foliorange_next_in_range',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_invoice_type_display()} {self.start_folio}-{self.end_folio} (siguiente {self.next_folio})"
+
+    @property
+    def remaining(self):
+        return self.end_folio - self.next_folio + 1
+
+
+class LedgerAccount(models.Model):
+    """
+    Ledger accounts. ``balance`` is kept as debits minus credits and is
+    updated in the same transaction as every entry posted to the account.
+    """
+    ACCOUNT_TYPES = (
+        ('asset', 'Activo'),
+        ('liability', 'Pasivo'),
+        ('revenue', 'Ingreso'),
+        ('expense', 'Gasto'),
+    )
+    
+    code = models.CharField(max_length=100, unique=True)  # e.g. 'clearing', 'cultor:42'
+    name = models.CharField(max_length=200)
+    account_type = models.CharField(max_length=20, choices=ACCOUNT_TYPES)
+    owner = models.ForeignKey(
+        User, 
+        on_delete=models.PROTECT, 
+        null=True, 
+        blank=True,
+        related_name='ledger_accounts'
+    )
+    
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.code} ({self.get_account_type_display()}) - ${self.balance}"
+
+    @property
+    def normal_balance(self):
+        """Balance in the account's natural sign (what is owed for liabilities)"""
+        if self.account_type in ('asset', 'expense'):
+            return self.balance
+        return -self.balance
+
+
+class LedgerTransaction(models.Model):
+    """
+    A balanced set of ledger entries. ``reference`` identifies the business
+    event being posted, so posting it twice is a no-op.
+    """
+    reference = models.CharField(max_length=200, unique=True)  # e.g. 'payment:12:captured'
+    description = models.CharField(max_length=500, blank=True)
+    
+    # Source documents
+    payment = models.ForeignKey(
+        Payment, on_delete=models.PROTECT, null=True, blank=True, related_name='ledger_transactions'
+    )
+    refund = models.ForeignKey(
+        PaymentRefund, on_delete=models.PROTECT, null=True, blank=True, related_name='ledger_transactions'
+    )
+    commission = models.ForeignKey(
+        Commission, on_delete=models.PROTECT, null=True, blank=True, related_name='ledger_transactions'
+    )
+    payout = models.ForeignKey(
+        Payout, on_delete=models.PROTECT, null=True, blank=True, related_name='ledger_transactions'
+    )
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Ledger transaction {self.reference}"
+
+
+class LedgerEntry(models.Model):
+    """
+    Append-only ledger lines. Positive amounts are debits, negative amounts
+    credits; ``balance_after`` is the account balance once the line posted.
+    """
+    transaction = models.ForeignKey(LedgerTransaction, on_delete=models.PROTECT, related_name='entries')
+    account = models.ForeignKey(LedgerAccount, on_delete=models.PROTECT, related_name='entries')
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=14, decimal_places=2)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['account', 'created_at', 'id'], name='ledgerentry_account_statement'),
+        ]
+
+    def __str__(self):
+        return f"{self.account.code}: {self.amount}"
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError('Las entradas contables no se pueden modificar')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Las entradas contables no se pueden eliminar')
+
+
+class NumberSequence(models.Model):
+    """
+    Named counters for document numbers (support tickets, invoices...).
+    On PostgreSQL the values come from a native sequence of the same name
+    and this row is only a registry; see casaroja.sequences.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} (siguiente {self.next_value})"
@@ -0,0 +1,215 @@
+"""
+Payout runs.
+
+A run pays every cultor their unpaid commission earnings and every
+transport provider their unpaid transport commissions. Each recipient
+type costs a fixed number of statements no matter how many recipients
+are paid:
+
+* one aggregate query finds who is owed at least ``min_amount``;
+* their unpaid commissions are claimed for the run with a conditional
+  UPDATE, so a concurrent run can never pay the same commission twice;
+* ``Payout`` rows and their commission links are bulk-inserted from what
+  was actually claimed;
+* the bank-transfer file is written while streaming the run's payouts.
+
+Commissions of payments with a refund requested and not yet completed
+are held until the gateway settles it; completed refunds have already
+reduced the commission, so a fully refunded sale pays nothing.
+
+Bank-transfer runs skip recipients without a ``PayoutAccount``; their
+commissions stay unpaid until the bank details are added. Commissions
+created while the run is in progress are left for the next run, because
+every query is bounded by the highest commission id seen at the start.
+"""
+import csv
+import logging
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+from .ledger import cultor_account, payout_posting, post_transactions, transport_account
+from .models import Commission, Payout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Commission fields holding what each recipient type is owed and paid
+RECIPIENTS = {
+    'cultor': {
+        'recipient': 'cultor',
+        'amount': 'cultor_earning',
+        'paid': 'is_paid_to_cultor',
+        'paid_at': 'paid_to_cultor_at',
+        'reference': 'payout_reference',
+        'account': cultor_account,
+    },
+    'transport': {
+        'recipient': 'transport_provider',
+        'amount': 'transport_commission',
+        'paid': 'is_paid_to_transport_provider',
+        'paid_at': 'paid_to_transport_provider_at',
+        'reference': 'transport_payout_reference',
+        'account': transport_account,
+    },
+}
+
+
+def unpaid_commissions(recipient_type, until=None):
+    fields = RECIPIENTS[recipient_type]
+    unpaid = Commission.objects.filter(**{
+        fields['paid']: False,
+        f"{fields['amount']}__gt": 0,
+        f"{fields['recipient']}__isnull": False,
+        # Held while a refund of the payment is in flight
+        'payment__refunded_total': F('payment__refund_completed_total'),
+    }).exclude(payment__status='refunded')
+    if until:
+        unpaid = unpaid.filter(created_at__lt=until)
+    return unpaid
+
+
+def _claim(recipient_type, reference, now, min_amount, until, require_bank_account, batch_size):
+    """Mark the unpaid commissions of every payable recipient as part of the run"""
+    fields = RECIPIENTS[recipient_type]
+    recipient = fields['recipient']
+    unpaid = unpaid_commissions(recipient_type, until)
+    max_id = unpaid.aggregate(max_id=Max('id'))['max_id']
+    if max_id is None:
+        return 0
+    unpaid = unpaid.filter(pk__lte=max_id)
+
+    owed = (
+        unpaid.values(f'{recipient}_id')
+        .annotate(total=Sum(fields['amount']), has_account=Count(f'{recipient}__payout_account'))
+        .filter(total__gte=min_amount)
+        .order_by(f'{recipient}_id')
+        .values_list(f'{recipient}_id', 'has_account')
+    )
+    payable = []
+    missing = []
+    for user_id, has_account in owed.iterator():
+        (payable if has_account or not require_bank_account else missing).append(user_id)
+    if missing:
+        logger.warning(
+            'Payout run %s skips %s %s recipients without bank details: %s',
+            reference, len(missing), recipient_type, missing,
+        )
+
+    claimed = 0
+    for start in range(0, len(payable), batch_size):
+        # Only rows still unpaid are claimed; a concurrent run's rows are skipped
+        claimed += unpaid.filter(**{f'{recipient}_id__in': payable[start:start + batch_size]}).update(**{
+            fields['paid']: True,
+            fields['paid_at']: now,
+            fields['reference']: reference,
+        })
+    return claimed
+
+
+def _create_payouts(recipient_type, reference, processed_by, payout_method, batch_size):
+    """Create one payout per recipient from the commissions claimed for the run"""
+    fields = RECIPIENTS[recipient_type]
+    recipient = fields['recipient']
+    claimed = Commission.objects.filter(**{fields['reference']: reference})
+
+    owed = (
+        claimed.values(
+            f'{recipient}_id', f'{recipient}__first_name', f'{recipient}__last_name', f'{recipient}__username',
+            f'{recipient}__payout_account__bank_name', f'{recipient}__payout_account__account_number',
+            f'{recipient}__payout_account__account_holder_name',
+        )
+        .annotate(total=Sum(fields['amount']), count=Count('id'))
+        .order_by(f'{recipient}_id')
+    )
+    payouts = [
+        Payout(
+            recipient_id=row[f'{recipient}_id'],
+            recipient_type=recipient_type,
+            total_amount=row['total'],
+            payout_method=payout_method,
+            bank_name=row[f'{recipient}__payout_account__bank_name'] or '',
+            account_number=row[f'{recipient}__payout_account__account_number'] or '',
+            account_holder_name=(
+                row[f'{recipient}__payout_account__account_holder_name']
+                or f"{row[f'{recipient}__first_name']} {row[f'{recipient}__last_name']}".strip()
+                or row[f'{recipient}__username']
+            ),
+            status='pending',
+            processed_by=processed_by,
+            external_reference=reference,
+            notes=f"{row['count']} comisiones",
+        )
+        for row in owed.iterator()
+    ]
+    if not payouts:
+        return 0
+    Payout.objects.bulk_create(payouts, batch_size=batch_size)
+
+    run = Payout.objects.filter(external_reference=reference, recipient_type=recipient_type)
+    payout_ids = dict(run.values_list('recipient_id', 'id'))
+    links = []
+    Link = Payout.commissions.through
+    for commission_id, user_id in claimed.values_list('id', f'{recipient}_id').iterator(chunk_size=batch_size):
+        links.append(Link(payout_id=payout_ids[user_id], commission_id=commission_id))
+        if len(links) >= batch_size:
+            Link.objects.bulk_create(links)
+            links = []
+    if links:
+        Link.objects.bulk_create(links)
+
+    postings = []
+    for payout in run.only('pk', 'recipient_id', 'total_amount').iterator(chunk_size=batch_size):
+        postings.append(payout_posting(payout, fields['account'](payout.recipient_id)))
+        if len(postings) >= batch_size:
+            post_transactions(postings)
+            postings = []
+    if postings:
+        post_transactions(postings)
+    return len(payouts)
+
+
+def build_payout_run(processed_by=None, payout_method='bank_transfer', min_amount=0,
+                     until=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Create the payouts for a run and return its reference, or ``None`` if
+    nothing is owed.
+    """
+    now = timezone.now()
+    reference = f"RUN-{now:%Y%m%d%H%M%S%f}"
+
+    with transaction.atomic():
+        created = 0
+        for recipient_type in RECIPIENTS:
+            if _claim(recipient_type, reference, now, min_amount, until,
+                      payout_method == 'bank_transfer', batch_size):
+                created += _create_payouts(recipient_type, reference, processed_by, payout_method, batch_size)
+    return reference if created else None
+
+
+def write_bank_transfer_file(reference, stream, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write the bank-transfer batch for a run as CSV to ``stream``, streaming
+    the payouts from the database. Returns the number of rows written.
+    """
+    writer = csv.writer(stream)
+    writer.writerow([
+        'payout_id', 'recipient_id', 'account_holder_name', 'email',
+        'bank_name', 'account_number', 'amount', 'reference'
+    ])
+    rows = 0
+    payouts = (
+        Payout.objects.filter(external_reference=reference, payout_method='bank_transfer')
+        .exclude(account_number='')
+        .order_by('pk')
+        .values_list(
+            'payout_id', 'recipient_id', 'account_holder_name', 'recipient__email',
+            'bank_name', 'account_number', 'total_amount'
+        )
+    )
+    for row in payouts.iterator(chunk_size=batch_size):
+        writer.writerow([*row, reference])
+        rows += 1
+    return rows
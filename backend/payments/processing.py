@@ -0,0 +1,138 @@
+"""
+Payment intent / confirm flow.
+
+A client creates an intent with an ``Idempotency-Key`` and then confirms
+it. Replaying either call with the same key returns the original payment
+instead of charging again; the gateway receives ``payment_id`` as its own
+idempotency reference, so a retried confirmation is safe as well.
+"""
+import hashlib
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from events.rollups import record_sales
+
+from .commissions import create_commission_for_payment
+from .gateways import GatewayError, GatewayTimeout, call_gateway, get_gateway
+from .ledger import payment_posting, post_transactions
+from .models import ACTIVE_PAYMENT_STATUSES, Payment
+
+
+class IdempotencyConflict(Exception):
+    """The idempotency key was already used for a different request"""
+
+
+class TicketAlreadyPaid(Exception):
+    """The ticket already has a payment in progress or completed"""
+
+
+def request_fingerprint(ticket, payment_method):
+    return hashlib.sha256(f"{ticket.pk}:{payment_method.pk}".encode()).hexdigest()
+
+
+def _active_payment(ticket, user, fingerprint):
+    """The ticket's active payment if it is an unfinished intent for this request"""
+    active = Payment.objects.filter(ticket=ticket, status__in=ACTIVE_PAYMENT_STATUSES).first()
+    if active is None:
+        return None
+    if active.status in ('completed', 'partially_refunded'):
+        raise TicketAlreadyPaid('El ticket ya fue pagado')
+    if active.user_id != user.pk or active.metadata.get('request_fingerprint') != fingerprint:
+        raise TicketAlreadyPaid('El ticket ya tiene un pago en curso')
+    return active
+
+
+def create_payment_intent(user, ticket, payment_method, idempotency_key):
+    """
+    Create a pending payment for ``ticket``, or return the one previously
+    created with the same idempotency key. A ticket has at most one active
+    payment: an unfinished intent for the same request is returned whatever
+    the key, anything else raises ``TicketAlreadyPaid``. Returns
+    ``(payment, created)``.
+    """
+    fingerprint = request_fingerprint(ticket, payment_method)
+    existing = Payment.objects.filter(user=user, idempotency_key=idempotency_key).first()
+    if existing is None:
+        existing = _active_payment(ticket, user, fingerprint)
+    if existing is None:
+        subtotal = ticket.total_price
+        fee = payment_method.calculate_fee(subtotal)
+        try:
+            with transaction.atomic():
+                payment = Payment.objects.create(
+                    user=user,
+                    ticket=ticket,
+                    payment_method=payment_method,
+                    idempotency_key=idempotency_key,
+                    subtotal=subtotal,
+                    fee_amount=fee,
+                    total_amount=subtotal + fee,
+                    description=f"Ticket {ticket.ticket_number}",
+                    metadata={'request_fingerprint': fingerprint},
+                )
+            return payment, True
+        except IntegrityError:
+            # A concurrent request with the same key, or for the same ticket, won the race
+            existing = Payment.objects.filter(user=user, idempotency_key=idempotency_key).first()
+            if existing is None:
+                existing = _active_payment(ticket, user, fingerprint)
+            if existing is None:
+                raise
+
+    if existing.metadata.get('request_fingerprint') != fingerprint:
+        raise IdempotencyConflict('La clave de idempotencia ya fue usada con otros datos')
+    return existing, False
+
+
+def confirm_payment(payment, data=None):
+    """
+    Charge a pending payment through its gateway. Payments that already
+    reached a final state are returned unchanged; payments left in
+    ``processing`` by a timed-out attempt are retried with the same reference.
+    """
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().get(pk=payment.pk)
+        if payment.status not in ('pending', 'processing'):
+            return payment
+        if payment.status == 'pending':
+            payment.status = 'processing'
+            payment.save(update_fields=['status', 'updated_at'])
+
+    gateway = get_gateway(payment.payment_method)
+    try:
+        response = call_gateway(gateway.charge, payment, str(payment.payment_id), data)
+    except GatewayTimeout:
+        return payment
+    except GatewayError as exc:
+        response = {'status': 'failed', 'error': str(exc)}
+    return apply_charge_result(payment, response)
+
+
+def apply_charge_result(payment, response):
+    """Record a gateway charge result on a processing payment and its ticket"""
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().select_related('ticket').get(pk=payment.pk)
+        if payment.status not in ('pending', 'processing'):
+            return payment
+
+        now = timezone.now()
+        payment.gateway_response = response
+        payment.external_id = response.get('external_id', payment.external_id)
+        if response.get('status') == 'completed':
+            payment.status = 'completed'
+            payment.processed_at = now
+            ticket = payment.ticket
+            if ticket.status == 'pending':
+                ticket.status = 'confirmed'
+                ticket.save(update_fields=['status', 'updated_at'])
+        else:
+            payment.status = 'failed'
+            payment.failed_at = now
+            payment.failure_reason = response.get('error', '')
+        payment.save()
+        if payment.status == 'completed':
+            post_transactions([payment_posting(payment)])
+            create_commission_for_payment(payment)
+            record_sales(Payment.objects.filter(pk=payment.pk))
+    return payment
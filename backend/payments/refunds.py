@@ -0,0 +1,274 @@
+"""
+Refund engine.
+
+``Payment.refunded_total`` holds the sum of every refund that has been
+requested and not cancelled. Requesting a refund reserves its amount with a
+single conditional UPDATE (``refunded_total + amount <= total_amount``), so
+two concurrent requests can never refund more than was paid.
+``Payment.refund_completed_total`` holds what the gateway has actually
+refunded; the payment status, and the ticket once it is fully refunded,
+follow that column only.
+
+Pending refunds are sent to the gateway in batches through a bounded thread
+pool. Each batch is first claimed by moving it to ``processing``, so two
+runs never send the same refund. Timeouts are retried with exponential
+backoff and, once a run gives up, the refund goes back to ``pending`` until
+it has used ``MAX_TOTAL_ATTEMPTS`` gateway calls. Declines are final. The
+refund id is the gateway idempotency reference, so a retry never refunds
+twice. Completing a refund also reverses the refunded share of the
+payment's commission.
+"""
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from events.rollups import record_refunds
+from tickets.models import Ticket, TicketCancellation
+
+from .commissions import reverse_commissions
+from .gateways import GatewayError, GatewayTimeout, call_gateway, get_gateway
+from .ledger import post_transactions, refund_posting
+from .models import Payment, PaymentRefund
+
+REFUNDABLE_STATUSES = ['completed', 'partially_refunded']
+REFUND_STATUSES = ['completed', 'partially_refunded', 'refunded']
+SUBMITTABLE_STATUSES = ['pending']
+CANCELLABLE_STATUSES = ['pending', 'failed']
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_ATTEMPTS = 3  # gateway calls per submission
+MAX_TOTAL_ATTEMPTS = 9  # gateway calls per refund before it is marked failed
+RETRY_BACKOFF = 0.5  # seconds, doubled after every attempt
+# A run that claimed refunds and died leaves them in processing this long
+CLAIM_TIMEOUT = timedelta(hours=1)
+
+
+class RefundError(Exception):
+    """A refund cannot be requested or cancelled"""
+
+
+def request_refund(payment, amount, processed_by, reason):
+    """Reserve ``amount`` on ``payment`` and create a pending refund for it"""
+    amount = Decimal(amount)
+    if amount <= 0:
+        raise RefundError('El monto del reembolso debe ser mayor a cero')
+
+    with transaction.atomic():
+        reserved = Payment.objects.filter(
+            pk=payment.pk,
+            status__in=REFUNDABLE_STATUSES,
+            refunded_total__lte=F('total_amount') - amount,
+        ).update(refunded_total=F('refunded_total') + amount, updated_at=timezone.now())
+        if not reserved:
+            raise RefundError('El monto excede lo disponible para reembolsar')
+        refund = PaymentRefund.objects.create(
+            payment=payment,
+            processed_by=processed_by,
+            refund_amount=amount,
+            reason=reason,
+        )
+    payment.refresh_from_db(fields=['refunded_total', 'updated_at'])
+    return refund
+
+
+def refund_remaining(payments, processed_by, reason):
+    """
+    Create one refund for whatever is still refundable on each payment in
+    ``payments``, reserving it with one UPDATE. Returns the new refunds.
+    """
+    with transaction.atomic():
+        rows = list(
+            payments.select_for_update()
+            .filter(status__in=REFUNDABLE_STATUSES, refunded_total__lt=F('total_amount'))
+            .order_by('pk')
+            .values_list('pk', 'total_amount', 'refunded_total')
+        )
+        if not rows:
+            return []
+        refunds = PaymentRefund.objects.bulk_create([
+            PaymentRefund(
+                payment_id=pk,
+                processed_by=processed_by,
+                refund_amount=total - refunded,
+                reason=reason,
+            )
+            for pk, total, refunded in rows
+        ])
+        Payment.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(
+            refunded_total=F('total_amount'), updated_at=timezone.now()
+        )
+    return refunds
+
+
+def refund_status():
+    """The payment status implied by its completed refunds"""
+    return Case(
+        When(refund_completed_total__gte=F('total_amount'), then=Value('refunded')),
+        When(refund_completed_total__gt=0, then=Value('partially_refunded')),
+        default=Value('completed'),
+    )
+
+
+def cancel_refund(refund):
+    """Cancel a refund that has not been refunded and release its amount"""
+    now = timezone.now()
+    with transaction.atomic():
+        cancelled = PaymentRefund.objects.filter(
+            pk=refund.pk, status__in=CANCELLABLE_STATUSES
+        ).update(status='cancelled', updated_at=now)
+        if not cancelled:
+            raise RefundError('Solo se pueden cancelar reembolsos pendientes o fallidos')
+        payment = Payment.objects.filter(pk=refund.payment_id)
+        payment.update(refunded_total=F('refunded_total') - refund.refund_amount, updated_at=now)
+        payment.filter(status__in=REFUND_STATUSES).update(status=refund_status())
+    refund.status = 'cancelled'
+    return refund
+
+
+def submittable(refunds, now):
+    """Refunds waiting to be sent, or claimed by a run that never finished"""
+    return refunds.filter(
+        Q(status__in=SUBMITTABLE_STATUSES)
+        | Q(status='processing', updated_at__lt=now - CLAIM_TIMEOUT)
+    )
+
+
+def claim_refunds(refunds, chunk_size):
+    """
+    Move the next ``chunk_size`` submittable refunds in ``refunds`` to
+    processing and return their ids. Refunds claimed by another run are
+    skipped.
+    """
+    now = timezone.now()
+    candidates = submittable(refunds, now).order_by('pk').values_list('pk', flat=True)
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidates.select_for_update(skip_locked=True, of=('self',))[:chunk_size])
+            PaymentRefund.objects.filter(pk__in=ids).update(status='processing', updated_at=now)
+        return ids
+    # Without SKIP LOCKED, claim row by row with a conditional UPDATE
+    return [
+        pk for pk in list(candidates[:chunk_size])
+        if submittable(PaymentRefund.objects.filter(pk=pk), now).update(status='processing', updated_at=now)
+    ]
+
+
+def submit_refunds(refunds=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS,
+                   max_attempts=DEFAULT_MAX_ATTEMPTS, progress=None):
+    """
+    Send the pending refunds in ``refunds`` to their gateways, claiming
+    each chunk first. ``progress`` is called as ``progress(done, total)``.
+    Returns the number of refunds submitted.
+    """
+    if refunds is None:
+        refunds = PaymentRefund.objects.all()
+    total = submittable(refunds, timezone.now()).count()
+    done = 0
+    last_pk = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Refunds sent back to pending in this run wait for the next one
+            ids = claim_refunds(refunds.filter(pk__gt=last_pk), chunk_size)
+            if not ids:
+                break
+            last_pk = max(ids)
+            chunk = list(
+                PaymentRefund.objects.filter(pk__in=ids)
+                .select_related('payment__payment_method')
+                .order_by('pk')
+            )
+            results = pool.map(lambda refund: send_refund(refund, max_attempts), chunk)
+            store_refund_results(list(zip(chunk, results)))
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+
+    return done
+
+
+def send_refund(refund, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Call the gateway, retrying timeouts within the refund's remaining
+    attempts. Declines and other gateway errors are not retried. The
+    response carries the number of calls made as ``attempts``.
+    """
+    gateway = get_gateway(refund.payment.payment_method)
+    attempts = max(min(max_attempts, MAX_TOTAL_ATTEMPTS - refund.attempts), 1)
+    for attempt in range(attempts):
+        try:
+            response = call_gateway(
+                gateway.refund, refund.payment, refund.refund_amount, str(refund.refund_id)
+            )
+        except GatewayTimeout as exc:
+            error = str(exc)
+            if attempt < attempts - 1:
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+        except GatewayError as exc:
+            return {'status': 'failed', 'error': str(exc), 'attempts': attempt + 1}
+        else:
+            return {**response, 'attempts': attempt + 1}
+    return {'status': 'failed', 'error': error, 'attempts': attempts, 'retryable': True}
+
+
+def store_refund_results(results):
+    """
+    Save a batch of ``(refund, gateway_response)`` pairs with bulk writes.
+    Timed-out refunds go back to pending while they have attempts left.
+    """
+    now = timezone.now()
+    completed_amounts = defaultdict(Decimal)
+    completed_refunds = []
+    for refund, response in results:
+        response = dict(response)
+        refund.attempts += response.pop('attempts', 1)
+        retryable = response.pop('retryable', False)
+        refund.gateway_response = response
+        refund.updated_at = now
+        if response.get('status') == 'completed':
+            refund.status = 'completed'
+            refund.external_id = response.get('external_id', '')
+            refund.processed_at = now
+            completed_amounts[refund.payment_id] += refund.refund_amount
+            completed_refunds.append(refund)
+        else:
+            retry = retryable and refund.attempts < MAX_TOTAL_ATTEMPTS
+            refund.status = 'pending' if retry else 'failed'
+            refund.failure_reason = response.get('error', '')
+
+    with transaction.atomic():
+        PaymentRefund.objects.bulk_update(
+            [refund for refund, _ in results],
+            ['status', 'external_id', 'processed_at', 'gateway_response',
+             'failure_reason', 'attempts', 'updated_at'],
+        )
+        if not completed_refunds:
+            return
+        post_transactions([refund_posting(refund) for refund in completed_refunds])
+        record_refunds(PaymentRefund.objects.filter(pk__in=[refund.pk for refund in completed_refunds]))
+        payments = Payment.objects.filter(pk__in=list(completed_amounts))
+        payments.update(
+            refund_completed_total=Case(
+                *[
+                    When(pk=pk, then=F('refund_completed_total') + amount)
+                    for pk, amount in completed_amounts.items()
+                ],
+                default=F('refund_completed_total'),
+            ),
+            updated_at=now,
+        )
+        payments.update(status=refund_status())
+        reverse_commissions(completed_refunds)
+        ticket_ids = payments.filter(status='refunded').values('ticket_id')
+        Ticket.objects.filter(pk__in=ticket_ids, status='cancelled').update(
+            status='refunded', updated_at=now
+        )
+        TicketCancellation.objects.filter(ticket_id__in=ticket_ids).update(
+            refund_processed=True, refund_processed_at=now
+        )
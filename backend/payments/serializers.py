@@ -0,0 +1,51 @@
+from rest_framework import serializers
+from tickets.models import Ticket
+from .models import Payment, PaymentMethod
+
+
+class PaymentMethodSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaymentMethod
+        fields = [
+            'id', 'name', 'payment_type', 'description', 'fixed_fee',
+            'percentage_fee', 'minimum_amount', 'maximum_amount'
+        ]
+
+
+class PaymentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Payment
+        fields = [
+            'payment_id', 'ticket', 'payment_method', 'subtotal', 'tax_amount',
+            'fee_amount', 'total_amount', 'refunded_total', 'refund_completed_total', 'currency',
+            'status', 'processed_at', 'failed_at', 'failure_reason', 'created_at'
+        ]
+        read_only_fields = fields
+
+
+class PaymentIntentSerializer(serializers.Serializer):
+    ticket = serializers.PrimaryKeyRelatedField(queryset=Ticket.objects.all())
+    payment_method = serializers.PrimaryKeyRelatedField(
+        queryset=PaymentMethod.objects.filter(is_active=True)
+    )
+
+    def validate_ticket(self, ticket):
+        if ticket.customer_id != self.context['request'].user.id:
+            raise serializers.ValidationError("El ticket no te pertenece")
+        if ticket.status != 'pending':
+            raise serializers.ValidationError("El ticket no está pendiente de pago")
+        return ticket
+
+    def validate(self, attrs):
+        method = attrs['payment_method']
+        amount = attrs['ticket'].total_price
+        if amount < method.minimum_amount:
+            raise serializers.ValidationError("El monto es menor al mínimo del medio de pago")
+        if method.maximum_amount is not None and amount > method.maximum_amount:
+            raise serializers.ValidationError("El monto excede el máximo del medio de pago")
+        return attrs
+
+
+class PaymentConfirmSerializer(serializers.Serializer):
+    card_number = serializers.CharField(required=False, allow_blank=True, write_only=True)
+    return_url = serializers.URLField(required=False)
@@ -1,3 +1,514 @@
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import smtplib
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from tickets.models import Ticket, TicketCancellation
+from tickets.tests import TicketTestCase
+from . import commissions, ledger, refunds, webhooks
+from .commissions import create_commissions
+from .dte import issue_invoices, send_invoices, sign_invoices
+from .gateways import GatewayError, GatewayTimeout, SimulatorGateway
+from .ledger import account_balance, post_transaction
+from .models import (
+    Commission, FolioRange, Invoice, LedgerTransaction, Payment, PaymentMethod, PaymentRefund, Payout,
+    PayoutAccount, WebhookEvent, WebhookPartition
+)
+from .payouts import build_payout_run, write_bank_transfer_file
+from .refunds import MAX_TOTAL_ATTEMPTS, cancel_refund, request_refund, submit_refunds
+from .webhooks import MAX_ATTEMPTS, lease_partition, process_webhooks, release_lease, release_partition
+
+
+class PaymentTestCase(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.method = PaymentMethod.objects.create(name='Webpay', payment_type='webpay')
+
+    def create_payment(self, ticket=None, status='completed', amount='10000', **kwargs):
+        ticket = ticket or self.create_ticket()
+        return Payment.objects.create(
+            user=ticket.customer, ticket=ticket, payment_method=self.method, status=status,
+            subtotal=Decimal(amount), total_amount=Decimal(amount), **kwargs
+        )
+
+
+class PaymentIntentTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.ticket = self.create_ticket(status='pending')
+
+    def create_intent(self, key, method=None):
+        return self.client.post(
+            '/api/payments/payments/',
+            {'ticket': self.ticket.pk, 'payment_method': (method or self.method).pk},
+            format='json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_replaying_key_returns_same_intent(self):
+        first = self.create_intent('k1')
+        again = self.create_intent('k1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['payment_id'], first.data['payment_id'])
+
+    def test_new_key_for_unfinished_intent_returns_it(self):
+        first = self.create_intent('k1')
+        again = self.create_intent('k2')
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['payment_id'], first.data['payment_id'])
+        self.assertEqual(Payment.objects.filter(ticket=self.ticket).count(), 1)
+
+    def test_second_intent_for_ticket_is_rejected(self):
+        self.create_intent('k1')
+        other = PaymentMethod.objects.create(name='Khipu', payment_type='khipu')
+        self.assertEqual(self.create_intent('k2', method=other).status_code, 409)
+
+        Payment.objects.filter(ticket=self.ticket).update(status='completed')
+        self.assertEqual(self.create_intent('k3').status_code, 409)
+        self.assertEqual(Payment.objects.filter(ticket=self.ticket).count(), 1)
+
+    def test_failed_payment_can_be_retried(self):
+        self.create_payment(self.ticket, status='failed')
+        self.assertEqual(self.create_intent('k1').status_code, 201)
+
+
+class WebhookTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment = self.create_payment(self.create_ticket(status='pending'), status='processing')
+
+    def webhook(self, external_id, reference=None, event_type='payment.completed'):
+        reference = reference or str(self.payment.payment_id)
+        return WebhookEvent.objects.create(
+            gateway='webpay', external_id=external_id, event_type=event_type, partition=0,
+            payment_reference=reference,
+            payload={'id': external_id, 'type': event_type, 'reference': reference, 'data': {}},
+        )
+
+    def failing(self, payment):
+        """Make applying events of ``payment`` fail as if the database were down"""
+        apply = webhooks.apply_charge_result
+
+        def flaky(target, response):
+            if target.pk == payment.pk:
+                raise OperationalError('database is locked')
+            return apply(target, response)
+
+        return mock.patch.object(webhooks, 'apply_charge_result', side_effect=flaky)
+
+    def test_failed_event_backs_off_and_holds_back_its_payment(self):
+        failing = self.webhook('e1')
+        later = self.webhook('e2', event_type='payment.failed')
+        other_payment = self.create_payment(self.create_ticket(status='pending'), status='processing')
+        other = self.webhook('e3', reference=str(other_payment.payment_id))
+
+        with self.failing(self.payment):
+            self.assertEqual(process_webhooks([0]), 1)
+        failing.refresh_from_db()
+        later.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), ('pending', 1))
+        self.assertGreater(failing.next_attempt_at, timezone.now())
+        self.assertEqual(later.attempts, 0)
+        self.assertEqual(WebhookEvent.objects.get(pk=other.pk).status, 'processed')
+
+        # Not due yet: nothing is attempted
+        self.assertEqual(process_webhooks([0]), 0)
+        failing.refresh_from_db()
+        self.assertEqual(failing.attempts, 1)
+
+    def test_exhausted_event_parks_partition(self):
+        failing = self.webhook('e1')
+        WebhookEvent.objects.filter(pk=failing.pk).update(attempts=MAX_ATTEMPTS - 1)
+        queued = self.webhook('e2')
+
+        with self.failing(self.payment):
+            self.assertEqual(process_webhooks([0]), 1)
+        partition = WebhookPartition.objects.get(number=0)
+        self.assertEqual(partition.parked_event_id, failing.pk)
+        self.assertEqual(WebhookEvent.objects.get(pk=failing.pk).status, 'failed')
+        self.assertEqual(process_webhooks([0]), 0)
+        self.assertEqual(WebhookEvent.objects.get(pk=queued.pk).status, 'pending')
+
+        self.assertTrue(release_partition(0, skip=True))
+        self.assertEqual(process_webhooks([0]), 1)
+        self.assertEqual(WebhookEvent.objects.get(pk=queued.pk).status, 'processed')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+
+    def test_unknown_payment_is_rejected_without_parking(self):
+        unknown = self.webhook('e1', reference=str(uuid.uuid4()))
+        malformed = self.webhook('e2', reference='not-a-payment')
+        healthy = self.webhook('e3')
+
+        self.assertEqual(process_webhooks([0]), 3)
+        self.assertEqual(WebhookEvent.objects.get(pk=unknown.pk).status, 'rejected')
+        self.assertEqual(WebhookEvent.objects.get(pk=malformed.pk).status, 'rejected')
+        self.assertEqual(WebhookEvent.objects.get(pk=healthy.pk).status, 'processed')
+        self.assertIsNone(WebhookPartition.objects.get(number=0).parked_at)
+
+    def test_leased_partition_is_skipped(self):
+        self.webhook('e1')
+        self.assertTrue(lease_partition(0, 'other-worker'))
+        self.assertEqual(process_webhooks([0], worker='this-worker'), 0)
+
+        release_lease(0, 'other-worker')
+        self.assertEqual(process_webhooks([0], worker='this-worker'), 1)
+
+
+class WebhookEndpointTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        PaymentMethod.objects.filter(pk=self.method.pk).update(secret_key='primero')
+        self.second = PaymentMethod.objects.create(name='Webpay Plus', payment_type='webpay', secret_key='segundo')
+        self.payment = self.create_payment(self.create_ticket(status='pending'), status='processing')
+
+    def post(self, event_id, reference, event_type='payment.completed', secret='segundo'):
+        body = json.dumps({'id': event_id, 'type': event_type, 'reference': reference, 'data': {}}).encode()
+        signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return APIClient().post(
+            '/api/payments/webhooks/webpay/', body, content_type='application/json', HTTP_X_SIGNATURE=signature
+        )
+
+    def test_method_is_chosen_by_signature(self):
+        self.assertEqual(self.post('e1', str(self.payment.payment_id)).status_code, 200)
+        self.assertEqual(self.post('e2', str(self.payment.payment_id), secret='otro').status_code, 400)
+        self.assertEqual(WebhookEvent.objects.get().status, 'pending')
+
+    def test_events_that_cannot_apply_are_not_queued(self):
+        self.post('e1', '')
+        self.post('e2', str(uuid.uuid4()))
+        self.post('e3', str(self.payment.payment_id), event_type='payment.disputed')
+
+        statuses = dict(WebhookEvent.objects.values_list('external_id', 'status'))
+        self.assertEqual(statuses, {'e1': 'rejected', 'e2': 'rejected', 'e3': 'ignored'})
+        self.assertFalse(WebhookEvent.objects.filter(status='pending').exists())
+
+
+class LedgerTests(TestCase):
+    lines = [('clearing', Decimal('100')), ('unearned', Decimal('-100'))]
+
+    def test_reposting_reference_is_a_no_op(self):
+        self.assertEqual(post_transaction('sale:1', self.lines), 1)
+        self.assertEqual(post_transaction('sale:1', self.lines), 0)
+        self.assertEqual(account_balance('clearing'), Decimal('100'))
+
+    def test_concurrent_post_of_same_reference_is_skipped(self):
+        post = ledger._post
+        attempts = []
+
+        def racing_post(postings):
+            attempts.append(postings)
+            if len(attempts) == 1:
+                # Another worker committed the same reference after our check
+                LedgerTransaction.objects.create(reference='sale:1')
+                raise IntegrityError('UNIQUE constraint failed: payments_ledgertransaction.reference')
+            return post(postings)
+
+        with mock.patch.object(ledger, '_post', side_effect=racing_post):
+            self.assertEqual(post_transaction('sale:1', self.lines), 0)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(LedgerTransaction.objects.filter(reference='sale:1').count(), 1)
+        self.assertEqual(account_balance('clearing'), Decimal('0'))
+
+
+class CommissionTests(PaymentTestCase):
+    def test_counts_only_inserted_commissions(self):
+        first, second = self.create_payment(), self.create_payment()
+        self.assertEqual(create_commissions(Payment.objects.all()), 2)
+        self.assertEqual(create_commissions(Payment.objects.all()), 0)
+        self.assertEqual(Commission.objects.filter(payment__in=[first, second]).count(), 2)
+
+    def test_refunded_payments_get_commission_on_net_amount(self):
+        self.create_payment(status='partially_refunded', refunded_total=Decimal('2500'),
+                            refund_completed_total=Decimal('2500'))
+        self.create_payment(status='refunded', refunded_total=Decimal('10000'),
+                            refund_completed_total=Decimal('10000'))
+        self.create_payment(status='failed')
+
+        self.assertEqual(create_commissions(commissions.pending_payments()), 2)
+        self.assertEqual(
+            sorted(Commission.objects.values_list('gross_amount', 'platform_commission', 'cultor_earning')),
+            [(Decimal('0'), Decimal('0'), Decimal('0')), (Decimal('7500'), Decimal('1125'), Decimal('6375'))],
+        )
+
+    def test_commission_created_concurrently_is_not_counted(self):
+        first, second = self.create_payment(), self.create_payment()
+        build = commissions.build_commission
+
+        def racing_build(row, rates):
+            # Another run inserts the first payment's commission after our read
+            if row['pk'] == first.pk:
+                build(row, rates).save()
+            return build(row, rates)
+
+        with mock.patch.object(commissions, 'build_commission', side_effect=racing_build):
+            self.assertEqual(create_commissions(Payment.objects.all()), 1)
+        self.assertEqual(Commission.objects.count(), 2)
+
+
+class PayoutTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.driver = User.objects.create_user('driver', password='x', user_type='transport')
+        for _ in range(3):
+            payment = self.create_payment()
+            Commission.objects.create(
+                payment=payment, cultor=self.cultor, event=self.event, gross_amount=Decimal('10000'),
+                platform_commission=Decimal('1000'), transport_commission=Decimal('2000'),
+                transport_provider=self.driver, cultor_earning=Decimal('7000'),
+            )
+        PayoutAccount.objects.create(
+            user=self.cultor, bank_name='Banco Estado', account_number='123', account_holder_name='Cultor'
+        )
+
+    def bank_file(self, reference):
+        stream = io.StringIO()
+        write_bank_transfer_file(reference, stream)
+        return list(csv.DictReader(io.StringIO(stream.getvalue())))
+
+    def test_pays_cultors_and_transport_providers(self):
+        PayoutAccount.objects.create(
+            user=self.driver, bank_name='Banco de Chile', account_number='456', account_holder_name='Driver'
+        )
+        reference = build_payout_run()
+
+        payouts = {p.recipient_type: p for p in Payout.objects.filter(external_reference=reference)}
+        self.assertEqual(payouts['cultor'].total_amount, Decimal('21000'))
+        self.assertEqual(payouts['transport'].total_amount, Decimal('6000'))
+        self.assertEqual(payouts['transport'].commissions.count(), 3)
+        self.assertEqual(
+            sorted((row['account_number'], row['amount']) for row in self.bank_file(reference)),
+            [('123', '21000.00'), ('456', '6000.00')],
+        )
+        self.assertEqual(account_balance(f'transport:{self.driver.pk}'), Decimal('6000'))
+
+    def test_second_run_pays_nothing_twice(self):
+        self.assertIsNotNone(build_payout_run())
+        self.assertIsNone(build_payout_run())
+        self.assertEqual(Payout.objects.filter(recipient=self.cultor).count(), 1)
+
+    def test_recipients_without_bank_details_are_skipped(self):
+        reference = build_payout_run()
+
+        self.assertEqual([row['account_number'] for row in self.bank_file(reference)], ['123'])
+        self.assertFalse(Payout.objects.filter(recipient=self.driver).exists())
+        self.assertEqual(Commission.objects.filter(is_paid_to_transport_provider=False).count(), 3)
+
+        PayoutAccount.objects.create(
+            user=self.driver, bank_name='Banco de Chile', account_number='456', account_holder_name='Driver'
+        )
+        reference = build_payout_run()
+        self.assertEqual([row['account_number'] for row in self.bank_file(reference)], ['456'])
+
+
+class RefundedCommissionTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment = self.create_payment()
+        create_commissions(Payment.objects.all())
+        PayoutAccount.objects.create(
+            user=self.cultor, bank_name='Banco Estado', account_number='123', account_holder_name='Cultor'
+        )
+
+    def refund(self, amount):
+        request_refund(self.payment, amount, self.organizer, 'x')
+
+    def test_partial_refund_holds_then_reduces_commission(self):
+        self.refund('4000')
+        self.assertIsNone(build_payout_run())
+
+        submit_refunds()
+        commission = Commission.objects.get()
+        self.assertEqual(
+            (commission.gross_amount, commission.platform_commission, commission.cultor_earning),
+            (Decimal('6000'), Decimal('900'), Decimal('5100')),
+        )
+        reference = build_payout_run()
+        self.assertEqual(Payout.objects.get(external_reference=reference).total_amount, Decimal('5100'))
+        self.assertEqual(account_balance(f'cultor:{self.cultor.pk}'), Decimal('0'))
+        self.assertEqual(account_balance('platform_revenue'), Decimal('-900'))
+
+    def test_refunded_sale_pays_nothing(self):
+        self.refund('10000')
+        submit_refunds()
+
+        self.assertIsNone(build_payout_run())
+        self.assertEqual(Commission.objects.get().cultor_earning, Decimal('0'))
+        self.assertEqual(account_balance(f'cultor:{self.cultor.pk}'), Decimal('0'))
+
+    def test_refund_after_payout_leaves_a_debt(self):
+        build_payout_run()
+        self.refund('10000')
+        submit_refunds()
+
+        commission = Commission.objects.get()
+        self.assertEqual((commission.cultor_earning, commission.is_paid_to_cultor), (Decimal('0'), True))
+        self.assertEqual(account_balance(f'cultor:{self.cultor.pk}'), Decimal('8500'))
+        self.assertIsNone(build_payout_run())
+
+
+@mock.patch.object(refunds, 'RETRY_BACKOFF', 0)
+class RefundTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment = self.create_payment(self.create_ticket(status='cancelled'))
+        TicketCancellation.objects.create(ticket=self.payment.ticket, cancelled_by=self.alice, reason='customer_request')
+
+    def refund(self, amount='5000'):
+        return request_refund(self.payment, amount, self.organizer, 'x')
+
+    def test_status_follows_completed_refunds(self):
+        first, second = self.refund(), self.refund()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+
+        submit_refunds(PaymentRefund.objects.filter(pk=first.pk))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'partially_refunded')
+        self.assertEqual(self.payment.refund_completed_total, Decimal('5000'))
+        self.assertEqual(Ticket.objects.get(pk=self.payment.ticket_id).status, 'cancelled')
+        self.assertFalse(TicketCancellation.objects.get().refund_processed)
+
+        submit_refunds()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'refunded')
+        self.assertEqual(Ticket.objects.get(pk=self.payment.ticket_id).status, 'refunded')
+        self.assertTrue(TicketCancellation.objects.get().refund_processed)
+
+    def test_cancel_refund_recomputes_status(self):
+        refund = self.refund()
+        # Left over from when the status followed requested refunds
+        Payment.objects.filter(pk=self.payment.pk).update(status='partially_refunded')
+
+        cancel_refund(refund)
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.refunded_total), ('completed', Decimal('0')))
+
+    def test_claimed_refund_is_not_resent(self):
+        refund = self.refund()
+        PaymentRefund.objects.filter(pk=refund.pk).update(status='processing', updated_at=timezone.now())
+
+        with mock.patch.object(SimulatorGateway, 'refund') as gateway_refund:
+            self.assertEqual(submit_refunds(), 0)
+        gateway_refund.assert_not_called()
+
+        # A claim left behind by a run that died is picked up again
+        PaymentRefund.objects.filter(pk=refund.pk).update(
+            updated_at=timezone.now() - refunds.CLAIM_TIMEOUT - timedelta(minutes=1)
+        )
+        self.assertEqual(submit_refunds(), 1)
+        self.assertEqual(PaymentRefund.objects.get(pk=refund.pk).status, 'completed')
+
+    def test_timeouts_are_retried_until_attempts_run_out(self):
+        refund = self.refund()
+        timeout = mock.patch.object(SimulatorGateway, 'refund', side_effect=GatewayTimeout('timeout'))
+
+        with timeout as gateway_refund:
+            submit_refunds()
+            refund.refresh_from_db()
+            self.assertEqual((refund.status, refund.attempts), ('pending', refunds.DEFAULT_MAX_ATTEMPTS))
+
+            while submit_refunds():
+                pass
+        refund.refresh_from_db()
+        self.assertEqual((refund.status, refund.attempts), ('failed', MAX_TOTAL_ATTEMPTS))
+        self.assertEqual(gateway_refund.call_count, MAX_TOTAL_ATTEMPTS)
+
+    def test_decline_is_not_retried(self):
+        refund = self.refund()
+
+        with mock.patch.object(SimulatorGateway, 'refund', side_effect=GatewayError('rechazado')) as gateway_refund:
+            submit_refunds()
+            self.assertEqual(submit_refunds(), 0)
+        refund.refresh_from_db()
+        self.assertEqual((refund.status, refund.attempts, refund.failure_reason), ('failed', 1, 'rechazado'))
+        self.assertEqual(gateway_refund.call_count, 1)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+
+
+class ExportTests(PaymentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin', password='x', is_staff=True))
+        self.old, self.new = self.create_payment(), self.create_payment()
+        Payment.objects.filter(pk=self.old.pk).update(created_at=timezone.now() - timedelta(days=10))
+
+    def export(self, **params):
+        response = self.client.get('/api/payments/exports/sales/', params)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        if params.get('gzip'):
+            content = gzip.decompress(content)
+        return list(csv.DictReader(io.StringIO(content.decode())))
+
+    def test_since_and_until_bound_created_at(self):
+        week_ago = (timezone.now() - timedelta(days=7)).date().isoformat()
+        self.assertEqual([row['payment_id'] for row in self.export(since=week_ago)], [str(self.new.payment_id)])
+        self.assertEqual([row['payment_id'] for row in self.export(until=week_ago)], [str(self.old.payment_id)])
+
+    def test_gzip_export_streams_the_same_rows(self):
+        self.assertEqual(self.export(gzip='1'), self.export())
+        self.assertEqual(len(self.export(gzip='1')), 2)
+
+    def test_impossible_date_is_rejected(self):
+        response = self.client.get('/api/payments/exports/sales/', {'since': '2026-02-31'})
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaisesMessage(CommandError, 'Fecha inválida: 2026-02-31'):
+            call_command('export_financials', 'sales', '--until', '2026-02-31')
+
+
+class InvoiceTests(PaymentTestCase):
+    def test_ticket_without_participants_is_billed_as_one(self):
+        FolioRange.objects.create(invoice_type='boleta', start_folio=1, end_folio=10, next_folio=1)
+        self.create_payment(self.create_ticket(participants_count=0))
+        self.create_payment(self.create_ticket(participants_count=2))
+
+        self.assertEqual(issue_invoices(), 2)
+        items = [invoice.items[0] for invoice in Invoice.objects.order_by('pk')]
+        self.assertEqual([(item['quantity'], item['unit_price']) for item in items], [(1, '10000'), (2, '5000')])
+
+    def test_only_delivered_invoices_are_marked_sent(self):
+        FolioRange.objects.create(invoice_type='boleta', start_folio=1, end_folio=10, next_folio=1)
+        User.objects.filter(pk=self.alice.pk).update(email='alice@example.com')
+        User.objects.filter(pk=self.bob.pk).update(email='bob@example.com')
+        self.create_payment(self.create_ticket())
+        self.create_payment(self.create_ticket(customer=self.bob))
+        issue_invoices()
+        sign_invoices(workers=1)
+        send = EmailBackend.send_messages
+
+        def refuse_bob(backend, messages):
+            if messages[0].to == ['bob@example.com']:
+                raise smtplib.SMTPRecipientsRefused({'bob@example.com': (550, b'no')})
+            return send(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', refuse_bob):
+            self.assertEqual(send_invoices(batch_size=1), 1)
+        self.assertEqual(
+            list(Invoice.objects.filter(is_sent=True).values_list('customer_email', flat=True)),
+            ['alice@example.com'],
+        )
+        self.assertEqual([message.to for message in mail.outbox], [['alice@example.com']])
 
-# Create your tests here.
+        self.assertEqual(send_invoices(), 1)
+        self.assertFalse(Invoice.objects.filter(is_sent=False).exists())
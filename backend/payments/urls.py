@@ -1,9 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import views
 
 router = DefaultRouter()
+router.register(r'methods', views.PaymentMethodViewSet)
+router.register(r'payments', views.PaymentViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
-    # Payments endpoints will be implemented later
+    path('webhooks/<str:gateway>/', views.PaymentWebhookView.as_view(), name='payment_webhook'),
+    path('exports/<str:name>/', views.FinancialExportView.as_view(), name='financial_export'),
 ]
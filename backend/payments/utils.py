@@ -0,0 +1,33 @@
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def parse_moment(value):
+    """
+    Parse ``YYYY-MM-DD`` or an ISO datetime into an aware datetime, or
+    ``None`` if it is malformed or not a real date (``2026-02-31``).
+    """
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day, time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_moment_option(value):
+    """``parse_moment`` for management command options"""
+    from django.core.management.base import CommandError
+
+    moment = parse_moment(value) if value else None
+    if value and moment is None:
+        raise CommandError(f"Fecha inválida: {value}")
+    return moment
@@ -1,3 +1,130 @@
-from django.shortcuts import render
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import viewsets, mixins, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.throttling import ScopedRateThrottle
+from rest_framework.views import APIView
+from .exports import EXPORTS, export_stream
+from .models import Payment, PaymentMethod
+from .processing import IdempotencyConflict, TicketAlreadyPaid, confirm_payment, create_payment_intent
+from .webhooks import InvalidWebhook, ingest_webhook, webhook_payment_method
+from .utils import parse_moment
+from .serializers import (
+    PaymentSerializer, PaymentMethodSerializer, PaymentIntentSerializer,
+    PaymentConfirmSerializer
+)
 
-# Create your views here.
+
+class PaymentMethodViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = PaymentMethod.objects.filter(is_active=True)
+    serializer_class = PaymentMethodSerializer
+    permission_classes = [IsAuthenticated]
+
+
+class PaymentViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Payment intents. Creating one requires an ``Idempotency-Key`` header;
+    replaying the same key returns the original payment.
+    """
+    queryset = Payment.objects.all()
+    serializer_class = PaymentSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'payment_id'
+
+    def get_queryset(self):
+        return Payment.objects.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip()
+        if not idempotency_key or len(idempotency_key) > 100:
+            return Response(
+                {'error': 'Se requiere el encabezado Idempotency-Key (máx. 100 caracteres)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = PaymentIntentSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        try:
+            payment, created = create_payment_intent(
+                request.user,
+                serializer.validated_data['ticket'],
+                serializer.validated_data['payment_method'],
+                idempotency_key,
+            )
+        except (IdempotencyConflict, TicketAlreadyPaid) as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+
+        return Response(
+            PaymentSerializer(payment).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    @action(detail=True, methods=['post'])
+    def confirm(self, request, payment_id=None):
+        payment = self.get_object()
+        serializer = PaymentConfirmSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        payment = confirm_payment(payment, serializer.validated_data)
+        return Response(
+            PaymentSerializer(payment).data,
+            status=status.HTTP_202_ACCEPTED if payment.status == 'processing' else status.HTTP_200_OK
+        )
+
+
+class PaymentWebhookView(APIView):
+    """
+    Receives gateway callbacks. The event is only verified and queued here;
+    the process_payment_webhooks worker applies it.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'payment_webhooks'
+
+    def post(self, request, gateway):
+        payment_method = webhook_payment_method(
+            gateway, request.body, request.headers.get('X-Signature', '')
+        )
+        if payment_method is None:
+            raise Http404
+        try:
+            created = ingest_webhook(
+                payment_method, request.body, request.headers.get('X-Signature', '')
+            )
+        except InvalidWebhook as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'received': True, 'duplicate': not created})
+
+
+class FinancialExportView(APIView):
+    """
+    Streams a sales, commissions, refunds or invoices export as CSV.
+    ``since``/``until`` bound ``created_at``; ``gzip=1`` compresses on the fly.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name):
+        if name not in EXPORTS:
+            return Response({'error': 'Exportación no encontrada'}, status=status.HTTP_404_NOT_FOUND)
+
+        bounds = {}
+        for param in ('since', 'until'):
+            value = request.query_params.get(param)
+            bounds[param] = parse_moment(value) if value else None
+            if value and bounds[param] is None:
+                return Response(
+                    {'error': f'Fecha inválida en {param}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        filename = f"{name}_{timezone.now():%Y%m%d%H%M%S}.csv" + ('.gz' if compress else '')
+        response = StreamingHttpResponse(
+            export_stream(name, bounds['since'], bounds['until'], compress=compress),
+            content_type='application/gzip' if compress else 'text/csv; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
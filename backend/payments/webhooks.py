@@ -0,0 +1,273 @@
+"""
+Payment gateway webhook queue.
+
+The receiver only verifies the signature and inserts a ``WebhookEvent``,
+deduplicated by a unique (gateway, event id) constraint, so callbacks
+are acknowledged quickly even during a sales burst. The
+``process_payment_webhooks`` worker applies the queued events later.
+
+Only events that can be applied are queued. Event types without a
+handler are stored as ``ignored``, and events whose reference is not one
+of our payments as ``rejected``. Neither ever reaches a partition.
+
+Events are partitioned by payment. A worker drains a partition only while
+it holds the partition's lease (``WebhookPartition``), in id order, so the
+events of a payment are applied in the order they arrived. A failed event
+is retried with exponential backoff, holding back the later events of its
+payment; once it runs out of attempts the partition is parked on it until
+an operator releases it (``process_payment_webhooks --release``). An
+event found not to refer to a payment when it is applied is rejected on
+its own and does not park the partition.
+"""
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .gateways import get_gateway
+from .models import Payment, PaymentMethod, WebhookEvent, WebhookPartition
+from .processing import apply_charge_result
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30  # seconds before the first retry, doubled after each failure
+MAX_RETRY_DELAY = 60 * 60
+DEFAULT_LEASE_SECONDS = 60
+
+
+class InvalidWebhook(Exception):
+    """The callback could not be authenticated or parsed"""
+
+
+class RejectedWebhook(Exception):
+    """The event can never be applied, so retrying it is pointless"""
+
+
+def webhook_partitions():
+    return getattr(settings, 'PAYMENT_WEBHOOK_PARTITIONS', 8)
+
+
+def partition_for(reference):
+    return zlib.crc32(reference.encode()) % webhook_partitions()
+
+
+def webhook_payment_method(payment_type, body, signature):
+    """
+    The active payment method of ``payment_type`` whose secret signed
+    ``body``, or the first one (by id) if none did, so the callback is
+    rejected as unsigned. ``None`` if the gateway has no active method.
+    """
+    methods = list(PaymentMethod.objects.filter(payment_type=payment_type, is_active=True).order_by('pk'))
+    for method in methods:
+        if get_gateway(method).verify_webhook(body, signature):
+            return method
+    return methods[0] if methods else None
+
+
+def ingest_webhook(payment_method, body, signature):
+    """
+    Verify and enqueue a gateway callback. Returns ``True`` if it was new
+    and ``False`` if the gateway event had already been received.
+    """
+    gateway = get_gateway(payment_method)
+    if not gateway.verify_webhook(body, signature):
+        raise InvalidWebhook('Firma inválida')
+    try:
+        payload = json.loads(body)
+        event = gateway.parse_webhook(payload)
+    except (ValueError, KeyError, TypeError) as exc:
+        raise InvalidWebhook(f'Payload inválido: {exc}')
+
+    status, error = 'pending', ''
+    if event['event_type'] not in WEBHOOK_HANDLERS:
+        status = 'ignored'
+    elif not known_payment(event['reference']):
+        status, error = 'rejected', f"Pago desconocido: {event['reference'] or '(sin referencia)'}"
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(
+                gateway=payment_method.payment_type,
+                external_id=event['event_id'],
+                event_type=event['event_type'],
+                payment_reference=event['reference'],
+                partition=partition_for(event['reference']),
+                payload=payload,
+                status=status,
+                last_error=error,
+                processed_at=None if status == 'pending' else timezone.now(),
+            )
+    except IntegrityError:
+        return False  # Gateway retry of an event we already have
+    return True
+
+
+def payment_id(reference):
+    """``reference`` as a payment id, or ``None`` if it can't be one"""
+    try:
+        return uuid.UUID(reference)
+    except (TypeError, ValueError):
+        return None
+
+
+def known_payment(reference):
+    payment_uuid = payment_id(reference)
+    return payment_uuid is not None and Payment.objects.filter(payment_id=payment_uuid).exists()
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY))
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_partition(number, worker, seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Take or renew ``worker``'s lease on a partition. ``False`` if another
+    worker holds it or the partition is parked.
+    """
+    now = timezone.now()
+    WebhookPartition.objects.bulk_create([WebhookPartition(number=number)], ignore_conflicts=True)
+    return bool(
+        WebhookPartition.objects.filter(number=number, parked_at__isnull=True)
+        .filter(Q(leased_until__isnull=True) | Q(leased_until__lte=now) | Q(leased_by=worker))
+        .update(leased_by=worker, leased_until=now + timedelta(seconds=seconds))
+    )
+
+
+def release_lease(number, worker):
+    WebhookPartition.objects.filter(number=number, leased_by=worker).update(leased_by='', leased_until=None)
+
+
+def release_partition(number, skip=False):
+    """
+    Resume a parked partition. Its failed event is retried from scratch, or
+    left failed with ``skip``. Returns ``False`` if it was not parked.
+    """
+    partition = WebhookPartition.objects.filter(number=number, parked_at__isnull=False).first()
+    if partition is None:
+        return False
+    with transaction.atomic():
+        if partition.parked_event_id and not skip:
+            WebhookEvent.objects.filter(pk=partition.parked_event_id, status='failed').update(
+                status='pending', attempts=0, next_attempt_at=None
+            )
+        WebhookPartition.objects.filter(pk=partition.pk).update(parked_event=None, parked_at=None)
+    return True
+
+
+def process_webhooks(partitions=None, batch_size=100, worker=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Apply one batch of due events from each of ``partitions`` (default all)
+    that this worker can lease. Returns the number of events that left the
+    queue.
+    """
+    worker = worker or worker_name()
+    if partitions is None:
+        partitions = range(webhook_partitions())
+    done = 0
+    for number in partitions:
+        if not lease_partition(number, worker, lease_seconds):
+            continue
+        try:
+            done += _drain(number, batch_size, worker, lease_seconds)
+        finally:
+            release_lease(number, worker)
+    return done
+
+
+def _drain(number, batch_size, worker, lease_seconds):
+    events = list(WebhookEvent.objects.filter(status='pending', partition=number).order_by('id')[:batch_size])
+    now = timezone.now()
+    renew_at = time.monotonic() + lease_seconds / 2
+    blocked = set()
+    done = 0
+    for event in events:
+        if event.payment_reference in blocked:
+            continue
+        if event.next_attempt_at and event.next_attempt_at > now:
+            # Still backing off; later events of this payment wait behind it
+            blocked.add(event.payment_reference)
+            continue
+        if time.monotonic() >= renew_at:
+            if not lease_partition(number, worker, lease_seconds):
+                break
+            renew_at = time.monotonic() + lease_seconds / 2
+
+        status = _apply(event)
+        if status == 'pending':
+            blocked.add(event.payment_reference)
+            continue
+        done += 1
+        if status == 'rejected':
+            logger.warning('Webhook %s rejected: %s', event.pk, event.last_error)
+        if status == 'failed':
+            WebhookPartition.objects.filter(number=number).update(parked_event=event, parked_at=timezone.now())
+            logger.error('Webhook partition %s parked on event %s', number, event.pk)
+            break
+    return done
+
+
+def _apply(event):
+    """Apply one event; returns its new status"""
+    handler = WEBHOOK_HANDLERS.get(event.event_type)
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            if handler is None:
+                event.status = 'ignored'
+            else:
+                handler(event)
+                event.status = 'processed'
+            event.processed_at = now
+            event.attempts += 1
+            event.next_attempt_at = None
+            event.save(update_fields=['status', 'processed_at', 'attempts', 'next_attempt_at'])
+    except RejectedWebhook as exc:
+        event.attempts += 1
+        event.status = 'rejected'
+        event.last_error = str(exc)
+        event.processed_at = now
+        event.next_attempt_at = None
+        event.save(update_fields=['status', 'attempts', 'last_error', 'processed_at', 'next_attempt_at'])
+    except Exception as exc:
+        logger.exception('Error processing webhook %s', event.pk)
+        event.attempts += 1
+        event.last_error = str(exc)
+        if event.attempts >= MAX_ATTEMPTS:
+            event.status = 'failed'
+            event.next_attempt_at = None
+        else:
+            event.status = 'pending'
+            event.next_attempt_at = now + retry_delay(event.attempts)
+        event.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
+    return event.status
+
+
+def handle_charge(event):
+    payment_uuid = payment_id(event.payment_reference)
+    payment = payment_uuid and Payment.objects.select_related('payment_method').filter(
+        payment_id=payment_uuid
+    ).first()
+    if payment is None:
+        raise RejectedWebhook(f"Pago desconocido: {event.payment_reference or '(sin referencia)'}")
+    response = get_gateway(payment.payment_method).parse_webhook(event.payload)['response']
+    response.setdefault('status', 'completed' if event.event_type == 'payment.completed' else 'failed')
+    apply_charge_result(payment, response)
+
+
+WEBHOOK_HANDLERS = {
+    'payment.completed': handle_charge,
+    'payment.failed': handle_charge,
+}
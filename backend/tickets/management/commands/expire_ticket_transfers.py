@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from tickets.models import TicketTransfer
+
+
+class Command(BaseCommand):
+    help = 'Expire pending ticket transfers whose valid_until has passed'
+
+    def handle(self, *args, **options):
+        expired = TicketTransfer.objects.expire_stale()
+        self.stdout.write(self.style.SUCCESS(f'{expired} transferencias expiradas'))
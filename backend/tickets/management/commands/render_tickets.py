@@ -0,0 +1,75 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+
+from tickets.models import Ticket
+from tickets.rendering import DEFAULT_RENDER_WORKERS, render_orders, render_tickets
+
+
+class Command(BaseCommand):
+    help = 'Render printable PDFs (and optionally wallet passes) for tickets that changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, help='Only render tickets for this event')
+        parser.add_argument('--ticket', type=int, action='append', help='Only render these tickets')
+        parser.add_argument('--wallet-pass', action='store_true', help='Also build wallet-pass bundles')
+        parser.add_argument('--per-order', action='store_true',
+                            help="Render one PDF per customer and event instead of per ticket")
+        parser.add_argument('--workers', type=int, default=DEFAULT_RENDER_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--force', action='store_true', help='Re-render even if unchanged')
+
+    def handle(self, *args, **options):
+        tickets = Ticket.objects.filter(status__in=['confirmed', 'used']).select_related(
+            'event__location', 'customer'
+        )
+        if options['event']:
+            tickets = tickets.filter(event_id=options['event'])
+        if options['ticket']:
+            tickets = tickets.filter(pk__in=options['ticket'])
+
+        if options['per_order']:
+            tickets = tickets.order_by('customer_id', 'event_id', 'pk')
+            rendered = 0
+            batch = []
+            size = 0
+            # Orders are never split, so a batch may run over by its last order
+            for _, group in groupby(
+                tickets.iterator(chunk_size=options['batch_size']), key=lambda t: (t.customer_id, t.event_id)
+            ):
+                order = list(group)
+                batch.append(order)
+                size += len(order)
+                if size >= options['batch_size']:
+                    rendered += self._render_orders(batch, options)
+                    batch = []
+                    size = 0
+            if batch:
+                rendered += self._render_orders(batch, options)
+            self.stdout.write(self.style.SUCCESS(f"{rendered} órdenes renderizadas"))
+            return
+
+        rendered = 0
+        batch = []
+        for ticket in tickets.order_by('pk').iterator(chunk_size=options['batch_size']):
+            batch.append(ticket)
+            if len(batch) >= options['batch_size']:
+                rendered += self._render(batch, options)
+                batch = []
+        if batch:
+            rendered += self._render(batch, options)
+        self.stdout.write(self.style.SUCCESS(f"{rendered} tickets renderizados"))
+
+    def _render_orders(self, batch, options):
+        paths = render_orders(batch, workers=options['workers'])
+        for path in paths:
+            self.stdout.write(path)
+        return len(paths)
+
+    def _render(self, batch, options):
+        return render_tickets(
+            batch,
+            wallet_pass=options['wallet_pass'],
+            workers=options['workers'],
+            force=options['force'],
+        )
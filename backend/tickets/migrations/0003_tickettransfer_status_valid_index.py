@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tickets", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="tickettransfer",
+            options={"ordering": ["-created_at"]},
+        ),
+        migrations.AddIndex(
+            model_name="tickettransfer",
+            index=models.Index(
+                fields=["status", "valid_until"], name="tickettransfer_status_valid"
+            ),
+        ),
+    ]
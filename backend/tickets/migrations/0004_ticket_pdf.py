@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tickets", "0003_tickettransfer_status_valid_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ticket",
+            name="pdf",
+            field=models.FileField(blank=True, null=True, upload_to="tickets/pdf/"),
+        ),
+        migrations.AddField(
+            model_name="ticket",
+            name="pdf_digest",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 import uuid
 import qrcode
 from io import BytesIO
@@ -25,6 +26,10 @@ class Ticket(models.Model):
     ticket_number = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     qr_code = models.ImageField(upload_to='tickets/qr/', blank=True, null=True)
     
+    # Printable ticket, stored under the digest of its rendered content
+    pdf = models.FileField(upload_to='tickets/pdf/', blank=True, null=True)
+    pdf_digest = models.CharField(max_length=64, blank=True)
+    
     # Relations
     event = models.ForeignKey('events.Event', on_delete=models.CASCADE, related_name='tickets')
     customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='purchased_tickets')
@@ -81,11 +86,14 @@ class Ticket(models.Model):
             self.generate_qr_code()
         super().save(*args, **kwargs)
 
+    @property
+    def qr_data(self):
+        return f"casaroja:ticket:{self.ticket_number}"
+
     def generate_qr_code(self):
         """Generate QR code for the ticket"""
-        qr_data = f"casaroja:ticket:{self.ticket_number}"
         qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(qr_data)
+        qr.add_data(self.qr_data)
         qr.make(fit=True)
         
         img = qr.make_image(fill_color="black", back_color="white")
@@ -99,6 +107,18 @@ class Ticket(models.Model):
         filebuffer = File(buffer, name=filename)
         self.qr_code.save(filename, filebuffer, save=False)
 
+    def regenerate_qr_code(self):
+        """
+        Issue a new ticket number and QR, invalidating the previous one. The
+        old image is only deleted once the surrounding transaction commits.
+        """
+        old_qr = self.qr_code.name if self.qr_code else None
+        self.ticket_number = uuid.uuid4()
+        self.generate_qr_code()
+        if old_qr:
+            storage = self.qr_code.storage
+            transaction.on_commit(lambda: storage.delete(old_qr))
+
     def __str__(self):
         return f"Ticket {self.ticket_number} - {self.event.title}"
 
@@ -221,6 +241,18 @@ class TicketCancellation(models.Model):
         return f"Cancellation for {self.ticket.ticket_number}"
 
 
+class TicketTransferQuerySet(models.QuerySet):
+    def pending(self):
+        return self.filter(status='pending', valid_until__gt=timezone.now())
+
+    def expire_stale(self):
+        """Expire overdue pending transfers in a single UPDATE"""
+        return self.filter(
+            status='pending',
+            valid_until__lte=timezone.now()
+        ).update(status='expired')
+
+
 class TicketTransfer(models.Model):
     """
     Track ticket transfers between users
@@ -246,5 +278,57 @@ class TicketTransfer(models.Model):
     accepted_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TicketTransferQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'valid_until'], name='tickettransfer_status_valid'),
+        ]
+
     def __str__(self):
         return f"Transfer {self.ticket.ticket_number}: {self.from_user.username} → {self.to_user.username}"
+
+    @property
+    def is_expired(self):
+        return self.valid_until <= timezone.now()
+
+    def accept(self):
+        """Move the ticket to the receiver and invalidate the old QR"""
+        # Expire it in its own statement so the change survives the error below
+        if TicketTransfer.objects.filter(pk=self.pk, status='pending', valid_until__lte=timezone.now()).update(
+            status='expired'
+        ):
+            self.refresh_from_db()
+            raise ValueError('La transferencia ha expirado')
+
+        with transaction.atomic():
+            transfer = TicketTransfer.objects.select_for_update().get(pk=self.pk)
+            if transfer.status != 'pending':
+                raise ValueError('La transferencia ya no está pendiente')
+            if transfer.is_expired:
+                raise ValueError('La transferencia ha expirado')
+
+            ticket = Ticket.objects.select_for_update().get(pk=transfer.ticket_id)
+            if ticket.customer_id != transfer.from_user_id or ticket.status != 'confirmed':
+                raise ValueError('El ticket ya no puede ser transferido')
+
+            ticket.customer_id = transfer.to_user_id
+            ticket.regenerate_qr_code()
+            ticket.save()
+
+            transfer.status = 'accepted'
+            transfer.accepted_at = timezone.now()
+            transfer.save(update_fields=['status', 'accepted_at'])
+
+        self.refresh_from_db()
+        return ticket
+
+    def reject(self):
+        """Reject a pending transfer"""
+        updated = TicketTransfer.objects.filter(
+            pk=self.pk, status='pending'
+        ).update(status='rejected')
+        if not updated:
+            raise ValueError('La transferencia ya no está pendiente')
+        self.refresh_from_db()
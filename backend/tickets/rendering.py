@@ -0,0 +1,247 @@
+"""
+Printable ticket rendering.
+
+Tickets are rendered to PDF (and optionally to an unsigned wallet-pass
+bundle) by the render_tickets job, in a process pool reused across
+batches; a ticket requested before the job reached it is rendered on the
+spot. Every output is stored under the digest of the data it was
+rendered from, so a ticket is only re-rendered when something printed on
+it actually changes.
+"""
+import hashlib
+import json
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import qrcode
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from casaroja.imaging import load_font
+
+# Bump whenever the layout changes so every ticket is re-rendered.
+RENDER_VERSION = 1
+DEFAULT_RENDER_WORKERS = 4
+
+PAGE_SIZE = (1240, 1754)  # A4 at 150 dpi
+MARGIN = 100
+
+
+def ticket_payload(ticket):
+    """Everything printed on a ticket, as plain data that can cross processes"""
+    event = ticket.event
+    location = event.location
+    start = timezone.localtime(event.start_datetime)
+    return {
+        'version': RENDER_VERSION,
+        'ticket_number': str(ticket.ticket_number),
+        'qr_data': ticket.qr_data,
+        'status': ticket.get_status_display(),
+        'event_title': event.title,
+        'event_start': start.strftime('%d/%m/%Y %H:%M'),
+        'venue_name': location.name,
+        'venue_address': f"{location.address}, {location.city}",
+        'customer_name': ticket.customer.get_full_name() or ticket.customer.username,
+        'participants_count': ticket.participants_count,
+        'participant_names': list(ticket.participant_names or []),
+    }
+
+
+def payload_digest(payload):
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def pdf_path(digest):
+    return f"tickets/pdf/{digest}.pdf"
+
+
+def wallet_pass_path(digest):
+    return f"tickets/passes/{digest}.pkpass"
+
+
+def _qr_image(data, size):
+    qr = qrcode.QRCode(version=1, box_size=10, border=2)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+    return img.resize((size, size))
+
+
+def draw_ticket_page(payload):
+    """Draw a single ticket page"""
+    page = Image.new('RGB', PAGE_SIZE, 'white')
+    draw = ImageDraw.Draw(page)
+    title_font, text_font, small_font = load_font(56), load_font(36), load_font(26)
+
+    draw.rectangle([0, 0, PAGE_SIZE[0], 180], fill='#b71c1c')
+    draw.text((MARGIN, 60), 'Casa Roja', font=title_font, fill='white')
+
+    y = 240
+    draw.text((MARGIN, y), payload['event_title'], font=title_font, fill='black')
+    y += 100
+    for line in (
+        payload['event_start'],
+        payload['venue_name'],
+        payload['venue_address'],
+        f"Titular: {payload['customer_name']}",
+        f"Participantes: {payload['participants_count']}",
+    ):
+        draw.text((MARGIN, y), line, font=text_font, fill='black')
+        y += 60
+    for name in payload['participant_names']:
+        draw.text((MARGIN + 40, y), f"- {name}", font=small_font, fill='#444444')
+        y += 40
+
+    qr_size = 600
+    qr_top = max(y + 60, 900)
+    page.paste(_qr_image(payload['qr_data'], qr_size), ((PAGE_SIZE[0] - qr_size) // 2, qr_top))
+    draw.text(
+        (MARGIN, qr_top + qr_size + 40),
+        f"Ticket {payload['ticket_number']} - {payload['status']}",
+        font=small_font,
+        fill='#444444',
+    )
+    return page
+
+
+def render_pdf(payloads):
+    """Render one or more tickets into a single PDF document"""
+    pages = [draw_ticket_page(payload) for payload in payloads]
+    buffer = BytesIO()
+    pages[0].save(buffer, format='PDF', save_all=True, append_images=pages[1:], resolution=150)
+    return buffer.getvalue()
+
+
+def render_wallet_pass(payload):
+    """
+    Render an unsigned wallet-pass bundle (pass.json, QR and manifest).
+    Signing happens when the bundle is handed to the wallet provider.
+    """
+    pass_json = json.dumps({
+        'formatVersion': 1,
+        'serialNumber': payload['ticket_number'],
+        'organizationName': 'Casa Roja',
+        'description': payload['event_title'],
+        'barcode': {
+            'format': 'PKBarcodeFormatQR',
+            'message': payload['qr_data'],
+            'messageEncoding': 'iso-8859-1',
+        },
+        'eventTicket': {
+            'primaryFields': [{'key': 'event', 'label': 'Evento', 'value': payload['event_title']}],
+            'secondaryFields': [
+                {'key': 'date', 'label': 'Fecha', 'value': payload['event_start']},
+                {'key': 'venue', 'label': 'Lugar', 'value': payload['venue_name']},
+            ],
+            'auxiliaryFields': [
+                {'key': 'holder', 'label': 'Titular', 'value': payload['customer_name']},
+            ],
+        },
+    }, ensure_ascii=False).encode()
+
+    qr_buffer = BytesIO()
+    _qr_image(payload['qr_data'], 300).save(qr_buffer, format='PNG')
+    files = {'pass.json': pass_json, 'icon.png': qr_buffer.getvalue()}
+    manifest = {name: hashlib.sha1(content).hexdigest() for name, content in files.items()}
+    files['manifest.json'] = json.dumps(manifest).encode()
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for name, content in files.items():
+            bundle.writestr(name, content)
+    return buffer.getvalue()
+
+
+_pool = None
+
+
+def _render_map(fn, jobs, workers):
+    """
+    ``map`` over a process pool kept for the life of the process, so batch
+    after batch reuses warm workers. ``workers`` sizes the pool when it is
+    first created. A single job is rendered in-process.
+    """
+    global _pool
+    if len(jobs) == 1:
+        return [fn(jobs[0])]
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        return list(_pool.map(fn, jobs))
+    except BrokenProcessPool:
+        _pool = None
+        raise
+
+
+def _render_job(job):
+    digest, payload, wallet_pass = job
+    outputs = {pdf_path(digest): render_pdf([payload])}
+    if wallet_pass:
+        outputs[wallet_pass_path(digest)] = render_wallet_pass(payload)
+    return digest, outputs
+
+
+def _store(path, content):
+    if not default_storage.exists(path):
+        default_storage.save(path, ContentFile(content))
+
+
+def render_tickets(tickets, wallet_pass=False, workers=DEFAULT_RENDER_WORKERS, force=False):
+    """
+    Render the given tickets in the shared process pool, skipping any whose
+    current digest has already been rendered. Returns the number of tickets rendered.
+    """
+    from .models import Ticket
+
+    jobs = []
+    stale = []
+    for ticket in tickets:
+        payload = ticket_payload(ticket)
+        digest = payload_digest(payload)
+        if not force and ticket.pdf_digest == digest and (
+            not wallet_pass or default_storage.exists(wallet_pass_path(digest))
+        ):
+            continue
+        ticket.pdf_digest = digest
+        ticket.pdf.name = pdf_path(digest)
+        stale.append(ticket)
+        if force or not default_storage.exists(pdf_path(digest)) or (
+            wallet_pass and not default_storage.exists(wallet_pass_path(digest))
+        ):
+            jobs.append((digest, payload, wallet_pass))
+
+    if jobs:
+        for _, outputs in _render_map(_render_job, jobs, workers):
+            for path, content in outputs.items():
+                if force and default_storage.exists(path):
+                    default_storage.delete(path)
+                _store(path, content)
+
+    Ticket.objects.bulk_update(stale, ['pdf', 'pdf_digest'])
+    return len(stale)
+
+
+def render_orders(orders, workers=DEFAULT_RENDER_WORKERS):
+    """
+    Render groups of tickets (e.g. everything a customer bought for an event)
+    into one multi-page PDF per group. Returns the storage paths in order.
+    """
+    paths = []
+    jobs = []
+    for tickets in orders:
+        payloads = [ticket_payload(ticket) for ticket in tickets]
+        path = f"tickets/orders/{payload_digest(payloads)}.pdf"
+        paths.append(path)
+        if not default_storage.exists(path):
+            jobs.append((path, payloads))
+
+    if jobs:
+        rendered = _render_map(render_pdf, [payloads for _, payloads in jobs], workers)
+        for (path, _), content in zip(jobs, rendered):
+            _store(path, content)
+    return paths
@@ -1,10 +1,18 @@
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Ticket
+from .models import Ticket, TicketTransfer
+from events.models import Event, Location
 from events.serializers import EventListSerializer
+from transport.models import PassengerBooking
 
 
 class TicketSerializer(serializers.ModelSerializer):
     event = EventListSerializer(read_only=True)
+    special_requests = serializers.CharField(source='special_requirements', read_only=True)
+    purchase_date = serializers.DateTimeField(source='created_at', read_only=True)
+    used_date = serializers.DateTimeField(source='checked_in_at', read_only=True)
     
     class Meta:
         model = Ticket
@@ -18,6 +26,10 @@ class TicketSerializer(serializers.ModelSerializer):
 
 
 class PurchaseTicketSerializer(serializers.ModelSerializer):
+    special_requests = serializers.CharField(
+        source='special_requirements', required=False, allow_blank=True
+    )
+
     class Meta:
         model = Ticket
         fields = [
@@ -59,3 +71,85 @@ class PurchaseTicketSerializer(serializers.ModelSerializer):
         })
         
         return super().create(validated_data)
+
+
+class WalletLocationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Location
+        fields = ['id', 'name', 'address', 'city', 'latitude', 'longitude']
+
+
+class WalletEventSerializer(serializers.ModelSerializer):
+    location = WalletLocationSerializer(read_only=True)
+
+    class Meta:
+        model = Event
+        fields = [
+            'id', 'title', 'start_datetime', 'end_datetime', 'status',
+            'main_image', 'meeting_point', 'location'
+        ]
+
+
+class WalletTransportBookingSerializer(serializers.ModelSerializer):
+    departure_datetime = serializers.DateTimeField(
+        source='transport_service.departure_datetime', read_only=True
+    )
+
+    class Meta:
+        model = PassengerBooking
+        fields = [
+            'status', 'pickup_location', 'estimated_pickup_time',
+            'seat_number', 'departure_datetime'
+        ]
+
+
+class WalletTicketSerializer(serializers.ModelSerializer):
+    """Compact ticket representation for the mobile wallet"""
+    event = WalletEventSerializer(read_only=True)
+    transport_booking = WalletTransportBookingSerializer(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Ticket
+        fields = [
+            'id', 'ticket_number', 'status', 'qr_code', 'participants_count',
+            'participant_names', 'total_price', 'checked_in_at', 'updated_at',
+            'event', 'transport_booking'
+        ]
+
+
+class TicketTransferSerializer(serializers.ModelSerializer):
+    to_user = serializers.SlugRelatedField(
+        slug_field='username', queryset=get_user_model().objects.all()
+    )
+    from_user = serializers.SlugRelatedField(slug_field='username', read_only=True)
+    valid_until = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = TicketTransfer
+        fields = [
+            'id', 'ticket', 'from_user', 'to_user', 'transfer_fee', 'status',
+            'message', 'valid_until', 'accepted_at', 'created_at'
+        ]
+        read_only_fields = ['transfer_fee', 'status', 'accepted_at', 'created_at']
+
+    def validate_ticket(self, ticket):
+        if ticket.customer_id != self.context['request'].user.id:
+            raise serializers.ValidationError("El ticket no te pertenece")
+        if ticket.status != 'confirmed':
+            raise serializers.ValidationError("Solo se pueden transferir tickets confirmados")
+        if ticket.transfers.pending().exists():
+            raise serializers.ValidationError("El ticket ya tiene una transferencia pendiente")
+        return ticket
+
+    def validate(self, attrs):
+        if attrs['to_user'] == self.context['request'].user:
+            raise serializers.ValidationError("No puedes transferirte un ticket a ti mismo")
+        valid_until = attrs.get('valid_until')
+        if valid_until and valid_until <= timezone.now():
+            raise serializers.ValidationError("La fecha de expiración debe ser futura")
+        return attrs
+
+    def create(self, validated_data):
+        validated_data['from_user'] = self.context['request'].user
+        validated_data.setdefault('valid_until', timezone.now() + timedelta(hours=48))
+        return super().create(validated_data)
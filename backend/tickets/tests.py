@@ -1,3 +1,144 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from events.models import Category, Event, Location
+from .models import Ticket, TicketTransfer
+from .rendering import payload_digest, ticket_payload
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TicketTestCase(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.organizer = User.objects.create_user('org', password='x', user_type='event_creator')
+        self.cultor = User.objects.create_user('cultor', password='x', user_type='cultor')
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        start = timezone.now() + timedelta(days=5)
+        self.event = Event.objects.create(
+            title='Fest', description='d', category=Category.objects.create(name='Música'),
+            organizer=self.organizer, cultor=self.cultor,
+            start_datetime=start, end_datetime=start + timedelta(hours=2), duration_minutes=120,
+            location=Location.objects.create(name='Teatro', address='x', city='Santiago'),
+            base_price=Decimal('10000'), max_participants=100, status='published',
+        )
+
+    def create_ticket(self, customer=None, status='confirmed', price='10000', **kwargs):
+        return Ticket.objects.create(
+            event=self.event, customer=customer or self.alice, base_price=Decimal(price),
+            total_price=Decimal(price), status=status, **kwargs
+        )
+
+
+class TicketTransferTests(TicketTestCase):
+    def transfer(self, valid_for=timedelta(days=1)):
+        return TicketTransfer.objects.create(
+            ticket=self.create_ticket(), from_user=self.alice, to_user=self.bob,
+            valid_until=timezone.now() + valid_for,
+        )
+
+    def test_accept_moves_ticket_and_replaces_qr_after_commit(self):
+        transfer = self.transfer()
+        old_qr = transfer.ticket.qr_code.name
+        storage = transfer.ticket.qr_code.storage
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            ticket = transfer.accept()
+        self.assertTrue(storage.exists(old_qr))
+
+        for callback in callbacks:
+            callback()
+        self.assertFalse(storage.exists(old_qr))
+        self.assertEqual(ticket.customer, self.bob)
+        self.assertNotEqual(ticket.qr_code.name, old_qr)
+        self.assertEqual(transfer.status, 'accepted')
+
+    def test_accepting_expired_transfer_marks_it_expired(self):
+        transfer = self.transfer(valid_for=-timedelta(minutes=1))
+
+        with self.assertRaisesMessage(ValueError, 'La transferencia ha expirado'):
+            transfer.accept()
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.status, 'expired')
+        self.assertEqual(transfer.ticket.customer, self.alice)
+
+
+class TicketPdfTests(TicketTestCase):
+    def test_pdf_is_rendered_on_first_request(self):
+        ticket = self.create_ticket()
+        client = APIClient()
+        client.force_authenticate(self.alice)
+
+        response = client.get(f'/api/tickets/tickets/{ticket.pk}/pdf/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content)[:5], b'%PDF-')
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.pdf_digest, payload_digest(ticket_payload(ticket)))
+
+
+    def test_per_order_rendering_is_batched_without_splitting_orders(self):
+        for _ in range(3):
+            self.create_ticket()
+        carol = User.objects.create_user('carol', password='x')
+        for customer in (self.bob, carol):
+            self.create_ticket(customer=customer)
+
+        batches = []
+
+        def render_orders(orders, workers):
+            batches.append([[ticket.customer.username for ticket in order] for order in orders])
+            return [f'orden-{n}' for n in range(len(orders))]
+
+        with mock.patch('tickets.management.commands.render_tickets.render_orders', render_orders):
+            call_command('render_tickets', '--per-order', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(batches, [[['alice'] * 3], [['bob'], ['carol']]])
+
+
+class WalletTests(TicketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.create_ticket()
+
+    def test_query_count_does_not_grow_with_tickets(self):
+        with self.assertNumQueries(3):
+            self.assertEqual(len(self.client.get('/api/tickets/wallet/').data['results']), 1)
+        for _ in range(4):
+            self.create_ticket()
+        with self.assertNumQueries(3):
+            self.assertEqual(len(self.client.get('/api/tickets/wallet/').data['results']), 5)
+
+    def test_unchanged_wallet_answers_304(self):
+        etag = self.client.get('/api/tickets/wallet/')['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/tickets/wallet/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.event.title = 'Fest 2'
+        self.event.save()
+        response = self.client.get('/api/tickets/wallet/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_is_per_user(self):
+        etag = self.client.get('/api/tickets/wallet/')['ETag']
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.get('/api/tickets/wallet/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
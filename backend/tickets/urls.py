@@ -4,9 +4,11 @@ from . import views
 
 router = DefaultRouter()
 router.register(r'tickets', views.TicketViewSet)
+router.register(r'transfers', views.TicketTransferViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
     path('purchase/', views.PurchaseTicketView.as_view(), name='purchase_ticket'),
     path('my-tickets/', views.MyTicketsView.as_view(), name='my_tickets'),
+    path('wallet/', views.WalletView.as_view(), name='ticket_wallet'),
 ]
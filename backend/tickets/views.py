@@ -1,9 +1,22 @@
-from rest_framework import viewsets, generics, status
+import hashlib
+
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.http import FileResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from rest_framework import viewsets, generics, mixins, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from .models import Ticket
-from .serializers import TicketSerializer, PurchaseTicketSerializer
+from events.rollups import record_check_ins
+from .models import Ticket, TicketTransfer
+from .rendering import payload_digest, render_tickets, ticket_payload
+from .serializers import (
+    TicketSerializer, PurchaseTicketSerializer, TicketTransferSerializer,
+    WalletTicketSerializer
+)
 
 
 class TicketViewSet(viewsets.ReadOnlyModelViewSet):
@@ -19,13 +32,32 @@ class TicketViewSet(viewsets.ReadOnlyModelViewSet):
         ticket = self.get_object()
         if ticket.status == 'confirmed':
             ticket.status = 'used'
-            ticket.save()
+            ticket.checked_in_at = ticket.checked_in_at or timezone.now()
+            with transaction.atomic():
+                ticket.save()
+                record_check_ins(Ticket.objects.filter(pk=ticket.pk))
             return Response({'status': 'Ticket usado exitosamente'})
         return Response(
             {'error': 'Ticket no puede ser usado'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(detail=True, methods=['get'])
+    def pdf(self, request, pk=None):
+        """
+        Serve the pre-rendered PDF. Tickets the render_tickets job has not
+        reached yet (or that changed since) are rendered in the request.
+        """
+        ticket = self.get_object()
+        current = payload_digest(ticket_payload(ticket))
+        if not ticket.pdf or ticket.pdf_digest != current:
+            render_tickets([ticket])
+        return FileResponse(
+            ticket.pdf.open('rb'),
+            content_type='application/pdf',
+            filename=f"ticket_{ticket.ticket_number}.pdf"
+        )
+
 
 class PurchaseTicketView(generics.CreateAPIView):
     serializer_class = PurchaseTicketSerializer
@@ -37,4 +69,78 @@ class MyTicketsView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Ticket.objects.filter(customer=self.request.user).order_by('-purchase_date')
+        return Ticket.objects.filter(customer=self.request.user).select_related(
+            'event__category', 'event__location',
+            'event__organizer__profile', 'event__cultor__profile',
+        ).order_by('-created_at')
+
+
+def wallet_etag(request, *args, **kwargs):
+    """Weak ETag for the wallet, derived from the latest change to any row it renders"""
+    state = Ticket.objects.filter(customer=request.user).aggregate(
+        count=Count('id'),
+        ticket_updated=Max('updated_at'),
+        event_updated=Max('event__updated_at'),
+        location_updated=Max('event__location__updated_at'),
+        booking_updated=Max('transport_booking__updated_at'),
+    )
+    key = f"{request.user.pk}:{request.get_full_path()}:" + ':'.join(
+        str(state[name]) for name in sorted(state)
+    )
+    return 'W/"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+
+@method_decorator(condition(etag_func=wallet_etag), name='get')
+class WalletView(generics.ListAPIView):
+    """
+    The user's tickets with event, venue and transport details. Loads in a
+    constant number of queries and answers 304 when the ETag still matches.
+    """
+    serializer_class = WalletTicketSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Ticket.objects.filter(customer=self.request.user).select_related(
+            'event__location',
+            'transport_booking__transport_service',
+        ).order_by('-created_at')
+
+
+class TicketTransferViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = TicketTransfer.objects.all()
+    serializer_class = TicketTransferSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        return TicketTransfer.objects.filter(
+            Q(from_user=user) | Q(to_user=user)
+        ).select_related('from_user', 'to_user')
+
+    @action(detail=True, methods=['post'])
+    def accept(self, request, pk=None):
+        transfer = self.get_object()
+        if transfer.to_user_id != request.user.id:
+            return Response(
+                {'error': 'Solo el destinatario puede aceptar la transferencia'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            transfer.accept()
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(transfer).data)
+
+    @action(detail=True, methods=['post'])
+    def reject(self, request, pk=None):
+        transfer = self.get_object()
+        if transfer.to_user_id != request.user.id:
+            return Response(
+                {'error': 'Solo el destinatario puede rechazar la transferencia'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            transfer.reject()
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(transfer).data)